@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The tools are flat scripts in the repository root
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+@pytest.fixture
+def repo_font(monkeypatch):
+    """Points tkt_gen3 at the repository's font, whatever directory pytest runs from."""
+    import tkt_gen3
+    monkeypatch.setattr(tkt_gen3, "FONT_PATH", os.path.join(REPO_DIR, "arial.ttf"))
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+import tkt_gen3
+import tkt_verify
+
+KEY = "test key"
+
+
+@pytest.fixture
+def gang_variants(tmp_path, monkeypatch, repo_font):
+    monkeypatch.setattr(tkt_gen3, "VERIFICATION_KEY", KEY)
+    monkeypatch.setattr(tkt_gen3, "ACTIVE_SHEET_LAYOUT", None) # Fixed grid
+    events_path = tmp_path / "gang.json"
+    events_path.write_text(json.dumps([
+        {"event": "gala", "numbers": "1-23", "title": "SPRING GALA"},
+        {"event": "quiz", "numbers": "1-7", "title": "QUIZ NIGHT"},
+    ]))
+    default_style = {"title": "EVENT", "stub_color": tkt_gen3.DEFAULT_STUB_BG_COLOR, "background": None}
+    return tkt_gen3.load_gang_events(str(events_path), default_style)
+
+@pytest.fixture
+def printed_codes(monkeypatch):
+    """{number string: code} of every back rendered, as passed to create_ticket_back."""
+    codes = {}
+    create_ticket_back = tkt_gen3.create_ticket_back
+    def recording_create_ticket_back(number_str, *args, **kwargs):
+        codes[number_str] = kwargs.get("verification_code")
+        return create_ticket_back(number_str, *args, **kwargs)
+    monkeypatch.setattr(tkt_gen3, "create_ticket_back", recording_create_ticket_back)
+    return codes
+
+def scan_results(index_path, printed_codes):
+    index = tkt_verify.VerificationIndex.open(str(index_path), KEY)
+    return {result for _, _, result in index.verify_scans(f"{number} {code}" for number, code in printed_codes.items())}
+
+
+def test_reprinted_gang_ticket_verifies_against_its_event_index(tmp_path, gang_variants, printed_codes):
+    tkt_gen3.variants_verification_codes(gang_variants, 3, str(tmp_path / "run.pdf"))
+    positions = tkt_gen3.reprint_positions(tkt_gen3.parse_ticket_ranges("quiz:3"), gang_variants)
+    for _ in tkt_gen3.render_reprint_sheets(gang_variants, 3, positions):
+        pass
+    assert list(printed_codes) == ["003"]
+    assert scan_results(tmp_path / "run_quiz_codes.idx", printed_codes) == {"valid"}
+
+def test_proofed_gang_tickets_verify_against_their_event_index(tmp_path, gang_variants, printed_codes, capsys):
+    tkt_gen3.variants_verification_codes(gang_variants, 3, str(tmp_path / "run.pdf"))
+    tkt_gen3.render_proof_contact_sheet(gang_variants[1:], 3, str(tmp_path / "proof.pdf")) # Only quiz, so numbers are unique
+    assert printed_codes
+    assert scan_results(tmp_path / "run_quiz_codes.idx", printed_codes) == {"valid"}
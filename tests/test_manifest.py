@@ -0,0 +1,33 @@
+import csv
+
+import pytest
+from PIL import Image
+
+import tkt_gen3
+
+
+@pytest.fixture(autouse=True)
+def grid_layout(monkeypatch):
+    monkeypatch.setattr(tkt_gen3, "ACTIVE_SHEET_LAYOUT", None) # Fixed grid
+
+def manifest_pages(tmp_path, output_sides):
+    """(page_index, back_page_index) of the first ticket on sheets 0 and 1."""
+    tile = Image.new("RGB", (4, 4), "white")
+    path = tmp_path / "manifest.csv"
+    with tkt_gen3.TicketManifestWriter(str(path), "csv", output_sides=output_sides) as writer:
+        for ticket_index in (0, tkt_gen3.tickets_per_sheet()):
+            writer.add_ticket(str(ticket_index), ticket_index, tile, tile, "GALA")
+    with open(path, newline="", encoding="utf-8") as f:
+        return [(row["page_index"], row["back_page_index"]) for row in csv.DictReader(f)]
+
+
+@pytest.mark.parametrize("output_sides, pages", [
+    (("duplex",), [("0", "1"), ("2", "3")]),
+    (("duplex", "fronts", "backs"), [("0", "1"), ("2", "3")]),
+    (("fronts", "backs"), [("0", "0"), ("1", "1")]),
+    (("fronts",), [("0", ""), ("1", "")]),
+    (("backs",), [("", "0"), ("", "1")]),
+    ((), [("", ""), ("", "")]), # Per-ticket exports have no pages
+])
+def test_page_indexes_follow_the_pdfs_written(tmp_path, output_sides, pages):
+    assert manifest_pages(tmp_path, output_sides) == pages
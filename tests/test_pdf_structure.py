@@ -0,0 +1,126 @@
+import io
+import re
+import zlib
+import contextlib
+
+import pytest
+from PIL import Image, ImageDraw
+
+import tkt_gen3
+
+# Enough tiles for several object streams (PDF_OBJECT_STREAM_SIZE) and page tree levels (PDF_PAGE_TREE_FANOUT)
+TICKET_COUNT = 2_500
+TILE_SIZE = (120, 50)
+
+
+def write_pdf(path, compact):
+    tkt_gen3.PDF_COMPACT_STRUCTURE = compact # Restored by the monkeypatch in the fixture
+    writer = tkt_gen3.SheetPdfWriter(str(path), "fast")
+    for i in range(TICKET_COUNT):
+        tile = Image.new("L", TILE_SIZE, 255)
+        ImageDraw.Draw(tile).text((8, 18), f"{i + 1:06d}", fill=0)
+        writer.add_image(tile)
+    with contextlib.redirect_stdout(io.StringIO()):
+        writer.close()
+    return path.read_bytes()
+
+def stream_at(data, offset):
+    """(dictionary text, decoded data) of the stream object at offset."""
+    dictionary_end = data.index(b"stream\n", offset)
+    dictionary = data[offset:dictionary_end].decode("latin-1")
+    length = int(re.search(r"/Length (\d+)", dictionary).group(1))
+    return dictionary, zlib.decompress(data[dictionary_end + 7:dictionary_end + 7 + length])
+
+def undo_up_predictor(rows, columns):
+    decoded, previous = bytearray(), bytes(columns)
+    for row_start in range(0, len(rows), columns + 1):
+        assert rows[row_start] == 2, "PNG Up filter expected"
+        previous = bytes((a + b) & 0xFF for a, b in zip(rows[row_start + 1:row_start + 1 + columns], previous))
+        decoded += previous
+    return bytes(decoded)
+
+def direct_body(data, obj_id, offset):
+    header = f"{obj_id} 0 obj\n".encode("ascii")
+    assert data[offset:offset + len(header)] == header, f"offset {offset} of object {obj_id}"
+    return data[offset + len(header):data.index(b"endobj", offset)]
+
+def xref_object_bodies(data):
+    """Resolves every object through the file's xref table or cross-reference stream,
+    asserting each offset and object stream index. Returns ({object number: body}, trailer)."""
+    startxref = int(data[data.rindex(b"startxref") + 9:].split()[0])
+    bodies = {}
+    if data[startxref:startxref + 5] == b"xref\n":
+        lines = data[startxref:data.index(b"trailer", startxref)].split(b"\n")
+        trailer = data[data.index(b"trailer", startxref):].decode("latin-1")
+        first, count = map(int, lines[1].split())
+        assert (first, count) == (0, int(re.search(r"/Size (\d+)", trailer).group(1)))
+        for obj_id, line in enumerate(lines[3:2 + count], start=1):
+            offset, _, in_use = line.split()
+            assert in_use == b"n"
+            bodies[obj_id] = direct_body(data, obj_id, int(offset))
+        return bodies, trailer
+
+    trailer, rows = stream_at(data, startxref)
+    predictor = re.search(r"/Predictor (\d+) /Columns (\d+)", trailer)
+    if predictor:
+        rows = undo_up_predictor(rows, int(predictor.group(2)))
+    assert "/W [1 5 2]" in trailer
+    entries = [(rows[i], int.from_bytes(rows[i + 1:i + 6], "big"), int.from_bytes(rows[i + 6:i + 8], "big"))
+               for i in range(0, len(rows), 8)]
+    assert len(entries) == int(re.search(r"/Size (\d+)", trailer).group(1))
+    assert entries[0] == (0, 0, 0xFFFF)
+    object_streams = {}
+    for obj_id, (entry_type, field, index) in enumerate(entries[1:], start=1):
+        assert entry_type in (1, 2), f"object {obj_id} has type {entry_type}"
+        if entry_type == 1:
+            bodies[obj_id] = direct_body(data, obj_id, field)
+            continue
+        if field not in object_streams:
+            assert entries[field][0] == 1, f"object stream {field} of object {obj_id} is not a direct object"
+            dictionary, stream = stream_at(data, entries[field][1] + len(f"{field} 0 obj\n"))
+            first = int(re.search(r"/First (\d+)", dictionary).group(1))
+            numbers = list(map(int, stream[:first].split()))
+            object_streams[field] = (numbers[0::2], numbers[1::2], stream[first:])
+        ids, offsets, stream_data = object_streams[field]
+        assert ids[index] == obj_id, f"entry {index} of object stream {field}"
+        end = offsets[index + 1] if index + 1 < len(offsets) else len(stream_data)
+        bodies[obj_id] = stream_data[offsets[index]:end]
+        assert bodies[obj_id].startswith(b"<<"), f"object {obj_id} at offset {offsets[index]} of object stream {field}"
+    xref_id = int(data[startxref:].split()[0])
+    assert xref_id == len(entries) - 1 and entries[xref_id] == (1, startxref, 0)
+    return bodies, trailer
+
+def page_tree_counts(bodies, trailer):
+    """(/Count of the page tree root, number of page objects)."""
+    root_id = int(re.search(r"/Root (\d+) 0 R", trailer).group(1))
+    pages_id = int(re.search(rb"/Pages (\d+) 0 R", bodies[root_id]).group(1))
+    count = int(re.search(rb"/Count (\d+)", bodies[pages_id]).group(1))
+    return count, sum(1 for body in bodies.values() if b"/Type /Page " in body)
+
+
+@pytest.fixture(autouse=True)
+def restore_structure(monkeypatch):
+    monkeypatch.setattr(tkt_gen3, "PDF_COMPACT_STRUCTURE", tkt_gen3.PDF_COMPACT_STRUCTURE)
+    monkeypatch.setattr(tkt_gen3, "ACTIVE_SHEET_LAYOUT", None) # Fixed grid
+
+
+@pytest.mark.parametrize("compact, use_numpy", [(False, True), (True, True), (True, False)],
+                         ids=["classic", "compact", "compact_no_numpy"])
+def test_every_xref_entry_points_at_its_object(tmp_path, monkeypatch, compact, use_numpy):
+    if use_numpy and tkt_gen3.np is None:
+        pytest.skip("NumPy is not installed")
+    if not use_numpy:
+        monkeypatch.setattr(tkt_gen3, "np", None) # Cross-reference stream without the Up predictor
+    data = write_pdf(tmp_path / "structure.pdf", compact)
+    bodies, trailer = xref_object_bodies(data)
+    expected_pages = -(-TICKET_COUNT // tkt_gen3.tickets_per_sheet()) # One tile per slot, no backs
+    assert page_tree_counts(bodies, trailer) == (expected_pages, expected_pages)
+    if compact:
+        assert sum(1 for body in bodies.values() if b"/Type /ObjStm" in body) > 1
+
+def test_pypdf_reads_both_structures(tmp_path):
+    pypdf = pytest.importorskip("pypdf")
+    for compact in (False, True):
+        path = tmp_path / f"structure_{compact}.pdf"
+        write_pdf(path, compact)
+        assert len(pypdf.PdfReader(str(path), strict=True).pages) == -(-TICKET_COUNT // tkt_gen3.tickets_per_sheet())
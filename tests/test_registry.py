@@ -0,0 +1,75 @@
+import math
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import tkt_registry
+from tkt_registry import TicketRegistry, STATE_ISSUED, STATE_SOLD, STATE_VOID, STATE_RETURNED
+
+
+@pytest.fixture
+def registry(tmp_path):
+    """Tickets 1-200: 1-150 and 190 sold, 100-119 then voided, 7 returned."""
+    registry = TicketRegistry.create(str(tmp_path / "registry.bin"), 1, 200, 5)
+    registry.import_ranges(["1-150", "00190 # padded", "", "# comment"], STATE_SOLD)
+    registry.set_range_status(100, 119, STATE_VOID)
+    registry.set_status("00007", STATE_RETURNED)
+    registry.flush()
+    return registry
+
+def sold_numbers(registry):
+    return {registry.format_number(number) for number in range(1, 201) if registry.status(number) == STATE_SOLD}
+
+
+def test_new_registry_is_issued(tmp_path):
+    registry = TicketRegistry.create(str(tmp_path / "registry.bin"), 1, 200, 5)
+    assert registry.counts()["issued"] == 200
+
+def test_range_updates_return_counts(tmp_path):
+    registry = TicketRegistry.create(str(tmp_path / "registry.bin"), 1, 200, 5)
+    assert registry.import_ranges(["1-150", "00190 # padded", "", "# comment"], STATE_SOLD) == 151
+    assert registry.set_range_status(100, 119, STATE_VOID) == 20
+
+def test_status_transitions(registry):
+    assert registry.status(7) == STATE_RETURNED
+    assert registry.status("00099") == STATE_SOLD
+    assert registry.status("00100") == STATE_VOID
+    assert registry.status(119) == STATE_VOID
+    assert registry.status(120) == STATE_SOLD
+    assert registry.status(151) == STATE_ISSUED
+
+def test_out_of_range_and_reversed_ranges_are_rejected(registry):
+    with pytest.raises(ValueError):
+        registry.status(201)
+    with pytest.raises(ValueError):
+        registry.set_range_status(20, 10, STATE_SOLD)
+
+def test_state_persists_after_reopening(registry, tmp_path):
+    reopened = TicketRegistry.open(str(tmp_path / "registry.bin"), read_only=True)
+    assert reopened.counts() == {"unissued": 0, "issued": 49, "sold": 130, "void": 20, "returned": 1}
+
+def test_drawing_every_sold_ticket_returns_each_once(registry, monkeypatch):
+    monkeypatch.setattr(tkt_registry, "DRAW_BLOCK_SIZE", 16) # Draws cross many block boundaries
+    winners = registry.draw_winners(130, random.Random(1))
+    assert len(set(winners)) == len(winners)
+    assert set(winners) == sold_numbers(registry)
+    with pytest.raises(ValueError):
+        registry.draw_winners(131)
+
+def test_single_draws_are_uniform_over_sold_tickets(registry, monkeypatch):
+    monkeypatch.setattr(tkt_registry, "DRAW_BLOCK_SIZE", 16)
+    sold = sold_numbers(registry)
+    wins = dict.fromkeys(sold, 0)
+    rng = random.Random(2)
+    draws = 30_000
+    for _ in range(draws):
+        winner, = registry.draw_winners(1, rng)
+        assert winner in wins, f"drew {winner}, which is not sold"
+        wins[winner] += 1
+    expected = draws / len(sold)
+    chi_square = sum((count - expected) ** 2 / expected for count in wins.values())
+    degrees = len(sold) - 1
+    critical = degrees * (1 - 2 / (9 * degrees) + 3.09 * math.sqrt(2 / (9 * degrees))) ** 3 # p = 0.001 (Wilson-Hilferty)
+    assert chi_square < critical
@@ -0,0 +1,49 @@
+import pytest
+
+import tkt_gen3
+
+pytest.importorskip("numpy")
+
+
+@pytest.fixture(autouse=True)
+def fresh_templates(repo_font):
+    tkt_gen3.clear_render_caches()
+    yield
+    tkt_gen3.clear_render_caches()
+
+def fronts(numbers, stub_color=(200, 30, 30)):
+    return [tkt_gen3.create_ticket_front(str(number).zfill(5), None, stub_color, "GALA") for number in numbers]
+
+
+def test_reduced_tiles_reproduce_the_rendered_pixels():
+    palette = tkt_gen3.front_tile_palette(None, (200, 30, 30), "GALA")
+    for front in fronts(range(1, 30)):
+        reduced = tkt_gen3.reduce_tile_mode(front, palette)
+        assert reduced.mode == "P"
+        assert reduced.convert("RGB").tobytes() == front.tobytes()
+    back = tkt_gen3.create_ticket_back("00001")
+    reduced_back = tkt_gen3.reduce_tile_mode(back, tkt_gen3.back_tile_palette())
+    assert reduced_back.mode in ("L", "1")
+    assert reduced_back.convert("RGB").tobytes() == back.tobytes()
+
+def test_tile_palette_holds_only_the_colors_the_tile_uses():
+    palette = tkt_gen3.front_tile_palette(None, (200, 30, 30), "GALA")
+    for front in fronts([8888, 1, 11111]): # The wide numbers add colors the narrow one does not use
+        reduced = tkt_gen3.reduce_tile_mode(front, palette)
+        assert len(reduced.getpalette()) // 3 <= len(front.getcolors(256)) + palette._template_color_count
+
+def test_tiles_with_too_many_colors_stay_rgb():
+    palette = tkt_gen3.TilePalette(fronts([1])[0])
+    noisy = fronts([2])[0]
+    noisy.putdata([(i % 256, i // 256 % 256, 7) for i in range(noisy.width * noisy.height)])
+    assert tkt_gen3.reduce_tile_mode(noisy, palette) is noisy
+
+def test_tile_does_not_depend_on_the_tickets_reduced_before_it():
+    later = fronts([40])[0]
+    fresh = tkt_gen3.TilePalette(tkt_gen3.build_front_template(None, (200, 30, 30), "GALA")["image"])
+    palette = tkt_gen3.front_tile_palette(None, (200, 30, 30), "GALA")
+    for front in fronts(range(1, 40)):
+        tkt_gen3.reduce_tile_mode(front, palette)
+    after_others = tkt_gen3.reduce_tile_mode(later, palette)
+    alone = tkt_gen3.reduce_tile_mode(later, fresh)
+    assert after_others.tobytes() == alone.tobytes() and after_others.getpalette() == alone.getpalette()
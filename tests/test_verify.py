@@ -0,0 +1,73 @@
+import hmac
+import struct
+import hashlib
+
+import pytest
+
+from tkt_verify import (VerificationIndex, verification_codes, verification_code, write_verification_index,
+                        format_code, parse_code, MAX_CODE_LENGTH, INDEX_HEADER_SIZE, INDEX_MAC_SIZE)
+
+KEY = b"test key"
+EVENT_ID = "GALA-2026"
+CODE_LENGTH = 5
+
+
+@pytest.fixture
+def codes():
+    return verification_codes(KEY, EVENT_ID, 95, 130, CODE_LENGTH)
+
+@pytest.fixture
+def index_path(tmp_path, codes):
+    path = tmp_path / "codes.idx"
+    write_verification_index(str(path), KEY, EVENT_ID, 95, 130, 5, codes, CODE_LENGTH)
+    return path
+
+
+def test_codes_are_truncated_hmac_of_event_and_number(codes):
+    direct = [int.from_bytes(hmac.new(KEY, f"{EVENT_ID}:{number}".encode("ascii"), hashlib.sha256).digest()[:4], "big")
+              >> (32 - 5 * CODE_LENGTH) for number in range(95, 131)]
+    assert list(codes) == direct
+
+def test_padded_number_gets_the_same_code(codes):
+    assert verification_code(KEY, EVENT_ID, "00100", CODE_LENGTH) == format_code(codes[5], CODE_LENGTH)
+
+def test_event_id_and_key_change_the_codes(codes):
+    assert list(verification_codes(KEY, "OTHER", 95, 130, CODE_LENGTH)) != list(codes)
+    assert list(verification_codes(b"other key", EVENT_ID, 95, 130, CODE_LENGTH)) != list(codes)
+
+def test_code_formatting_round_trips(codes):
+    assert all(parse_code(format_code(code, CODE_LENGTH)) == code for code in codes)
+    assert parse_code("AB0") is None
+    assert parse_code("ab2") == parse_code("AB2")
+
+def test_code_length_is_bounded():
+    with pytest.raises(ValueError):
+        verification_codes(KEY, EVENT_ID, 1, 2, MAX_CODE_LENGTH + 1)
+
+def test_index_round_trip(index_path, codes):
+    index = VerificationIndex.open(str(index_path), KEY)
+    assert (index.start_number, index.end_number, index.num_leading_zeros, index.code_length, index.event_id) == \
+        (95, 130, 5, CODE_LENGTH, EVENT_ID)
+    assert list(index.codes) == list(codes)
+
+def test_wrong_key_is_rejected(index_path):
+    with pytest.raises(ValueError, match="different key"):
+        VerificationIndex.open(str(index_path), b"wrong key")
+
+@pytest.mark.parametrize("edit", [
+    lambda data: data[:INDEX_HEADER_SIZE] + bytes([data[INDEX_HEADER_SIZE] ^ 1]) + data[INDEX_HEADER_SIZE + 1:], # A code
+    lambda data: data[:16] + struct.pack("<q", 131) + data[24:], # The end number
+    lambda data: data[:-INDEX_MAC_SIZE - 4] + data[-INDEX_MAC_SIZE:], # One code cut out
+    lambda data: data[:INDEX_HEADER_SIZE], # No codes or MAC
+], ids=["code", "end_number", "truncated", "short"])
+def test_edited_index_is_rejected(index_path, edit):
+    index_path.write_bytes(edit(index_path.read_bytes()))
+    with pytest.raises(ValueError):
+        VerificationIndex.open(str(index_path), KEY)
+
+def test_scan_results(index_path, codes):
+    index = VerificationIndex.open(str(index_path), KEY)
+    code = format_code(codes[5], CODE_LENGTH)
+    results = [result for _, _, result in index.verify_scans(
+        [f"00100 {code}", f"100-{code.lower()}", f"00101 {code}", f"00131 {code}", "hello", "# comment"])]
+    assert results == ["valid", "duplicate", "invalid_code", "unknown_number", "unreadable"]
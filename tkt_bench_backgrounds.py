@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+from PIL import Image, ImageDraw
+
+# Benchmarks time-to-first-ticket and peak memory when the main body background is a
+# large camera photo, comparing a full-resolution decode with tkt_gen3's draft/reduce loader.
+#   python tkt_bench_backgrounds.py > bench_output.txt
+
+SOURCE_SIZES_MP = (24, 50)
+SOURCE_ASPECT = 3 / 2
+
+def make_source_photo(path, megapixels, mode="RGB", orientation=None):
+    """Writes a synthetic camera-like JPEG (gradient plus shapes, so it does not compress to nothing)."""
+    width = int((megapixels * 1_000_000 * SOURCE_ASPECT) ** 0.5)
+    height = int(width / SOURCE_ASPECT)
+    img = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for i in range(0, width, max(1, width // 40)):
+        draw.ellipse([(i, height // 4), (i + width // 30, height // 4 + width // 30)], fill=(200, 40, (i * 7) % 255))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    if mode == "CMYK":
+        img = img.convert("CMYK")
+    img.save(path, format="JPEG", quality=90, exif=exif)
+
+def measure_in_child(loader, image_path):
+    """Runs one load in a fresh process so ru_maxrss reflects only that load."""
+    code = f"""
+import sys, time, json, resource
+sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})
+import tkt_gen3
+from PIL import Image
+start = time.perf_counter()
+if {loader!r} == "full_decode":
+    img = Image.open({image_path!r}).convert("RGB")
+    img.resize((tkt_gen3.TICKET_WIDTH_PX - tkt_gen3.STUB_WIDTH_PX, tkt_gen3.TICKET_HEIGHT_PX), Image.Resampling.LANCZOS)
+else:
+    tkt_gen3.create_ticket_front("00001", {image_path!r}, tkt_gen3.DEFAULT_STUB_BG_COLOR)
+seconds = time.perf_counter() - start
+# VmHWM is this process's own high-water mark; ru_maxrss can carry over the parent's across fork
+try:
+    with open("/proc/self/status") as f:
+        peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+except OSError:
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"seconds": seconds, "peak_rss_mb": peak_kb / 1024}}))
+"""
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cases = []
+        for megapixels in SOURCE_SIZES_MP:
+            cases.append((f"{megapixels} MP RGB", megapixels, "RGB", None))
+        cases.append((f"{SOURCE_SIZES_MP[-1]} MP RGB, EXIF rotated", SOURCE_SIZES_MP[-1], "RGB", 6))
+        cases.append((f"{SOURCE_SIZES_MP[0]} MP CMYK", SOURCE_SIZES_MP[0], "CMYK", None))
+
+        print(f"{'source':<26} {'loader':<14} {'first ticket (s)':>16} {'peak RSS (MB)':>14}")
+        for label, megapixels, mode, orientation in cases:
+            path = os.path.join(tmp_dir, f"source_{megapixels}_{mode}_{orientation}.jpg")
+            make_source_photo(path, megapixels, mode, orientation)
+            for loader in ("full_decode", "tkt_gen3"):
+                stats = measure_in_child(loader, path)
+                print(f"{label:<26} {loader:<14} {stats['seconds']:>16.3f} {stats['peak_rss_mb']:>14.0f}")
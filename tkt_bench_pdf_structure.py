@@ -0,0 +1,81 @@
+import io
+import os
+import time
+import contextlib
+import tempfile
+
+from PIL import Image, ImageDraw
+
+import tkt_gen3
+
+try:
+    import pypdf
+except ImportError:
+    print("pypdf library not found. Please install it: pip install pypdf")
+    print("Only file sizes are reported; parse times need pypdf.")
+    pypdf = None
+
+# Compares the classic PDF structure (xref table, one resource dictionary per page, flat
+# page tree) with PDF_COMPACT_STRUCTURE on file size, bytes spent outside the image
+# streams, and how long a parser takes to open the file, walk every page and reach pages
+# at random. Tiles are small so the structure, not the image data, dominates.
+#   python tkt_bench_pdf_structure.py > bench_output.txt
+
+BENCH_TICKET_COUNTS = (2_000, 20_000)
+BENCH_TILE_SIZE = (120, 50)
+RANDOM_PAGE_LOOKUPS = 200
+
+def synthetic_tiles(count):
+    """Small distinct tiles; a handful of templates with the number drawn on, like real runs."""
+    for i in range(count):
+        tile = Image.new("L", BENCH_TILE_SIZE, 255)
+        draw = ImageDraw.Draw(tile)
+        draw.rectangle([(0, 0), (BENCH_TILE_SIZE[0] - 1, BENCH_TILE_SIZE[1] - 1)], outline=i % 7 * 30)
+        draw.text((8, 18), f"{i + 1:06d}", fill=0)
+        yield tile
+
+def write_pdf(path, ticket_count, compact):
+    tkt_gen3.PDF_COMPACT_STRUCTURE = compact
+    start = time.perf_counter()
+    writer = tkt_gen3.SheetPdfWriter(path, "fast")
+    for tile in synthetic_tiles(ticket_count):
+        writer.add_image(tile)
+    with contextlib.redirect_stdout(io.StringIO()): # Keep the "Saved PDF" line out of the table
+        writer.close()
+    seconds = time.perf_counter() - start
+    return seconds, writer.compression_stats["compressed_bytes"]
+
+def parse_times(path):
+    """(open seconds, seconds to walk every page's resources, seconds per random page lookup)."""
+    start = time.perf_counter()
+    reader = pypdf.PdfReader(path)
+    page_count = len(reader.pages)
+    opened = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for page in reader.pages:
+        page["/Resources"]["/XObject"].keys()
+    walked = time.perf_counter() - start
+
+    reader = pypdf.PdfReader(path)
+    start = time.perf_counter()
+    for i in range(RANDOM_PAGE_LOOKUPS):
+        reader.pages[(i * 7919) % page_count].mediabox
+    per_lookup = (time.perf_counter() - start) / RANDOM_PAGE_LOOKUPS
+    return opened, walked, per_lookup
+
+if __name__ == "__main__":
+    print(f"{'tickets':>8} {'structure':<9} {'file (KB)':>10} {'overhead (KB)':>14} {'write (s)':>10} "
+          f"{'open (s)':>9} {'walk (s)':>9} {'lookup (ms)':>12}", flush=True)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for ticket_count in BENCH_TICKET_COUNTS:
+            for compact in (False, True):
+                path = os.path.join(tmp_dir, f"bench_{ticket_count}_{compact}.pdf")
+                write_seconds, image_bytes = write_pdf(path, ticket_count, compact)
+                size = os.path.getsize(path)
+                row = (f"{ticket_count:>8,} {'compact' if compact else 'classic':<9} {size / 1024:>10,.0f} "
+                       f"{(size - image_bytes) / 1024:>14,.0f} {write_seconds:>10.2f}")
+                if pypdf is not None:
+                    opened, walked, per_lookup = parse_times(path)
+                    row += f" {opened:>9.3f} {walked:>9.3f} {per_lookup * 1000:>12.3f}"
+                print(row, flush=True)
@@ -1,16 +1,40 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
 import os
+import math
 import io
-import tempfile # Keep for fpdf workaround if still needed by some, though user confirmed fix
+import csv
+import json
+import functools
+import itertools
+import bisect
+import contextlib
+import hashlib
+import sqlite3
+import time
+import zlib
+import collections
+import array
+import concurrent.futures
+import cProfile
+import threading
+import zipfile
+import tarfile
+import re
+import sys
+import shutil
+import struct
+
+import tkt_verify
 
 try:
-    from fpdf import FPDF
-except ImportError:
-    print("FPDF2 library not found. Please install it: pip install fpdf2")
-    print("PDF output will not be available.")
-    FPDF = None
+    from PIL import ImageCms
+except ImportError: # Pillow built without littlecms: CMYK falls back to Pillow's plain conversion
+    ImageCms = None
 
-DEBUG_ROTATED_TEXT = False
+try:
+    import numpy as np
+except ImportError: # Only needed for exact palette tiles; gray/1-bit tiles work without it
+    np = None
 
 # --- Scaling Factor ---
 SCALE_FACTOR = 0.5
@@ -35,31 +59,50 @@ ORIG_BACK_MULTILINE_SPACING_PX = 4
 ORIG_BACK_SERIAL_BOTTOM_MARGIN_PX = 30
 ORIG_PERFORATION_DASH_STEP_PX = 10
 ORIG_PERFORATION_DASH_LENGTH_PX = 5
+ORIG_RIGHT_SIDE_TEXT_X_OFFSET = 10
+ORIG_MICROTEXT_FONT_SIZE = 5 # Security underlay microtext, ~0.6 mm tall at 300 dpi
+ORIG_GUILLOCHE_LINE_WIDTH_PX = 1.0
+ORIG_MIN_FIT_FONT_SIZE = 10 # Smallest size auto-fit shrinks text to
+ORIG_TITLE_BOX_HEIGHT_PX = 30 # Event title box, from FRONT_TEXT_TOP_MARGIN_PX down to above the "table" slot
 
 # --- Scaled Configuration (Ticket Design) ---
-TICKET_WIDTH_PX = int(ORIG_TICKET_WIDTH_PX * SCALE_FACTOR)
-TICKET_HEIGHT_PX = int(ORIG_TICKET_HEIGHT_PX * SCALE_FACTOR)
-STUB_WIDTH_PX = int(ORIG_STUB_WIDTH_PX * SCALE_FACTOR)
-IMAGE_ON_TICKET_HEIGHT_PX = int(ORIG_IMAGE_ON_TICKET_HEIGHT_PX * SCALE_FACTOR) # Retained, might be useful for future small overlay logos
-NUMBER_FONT_SIZE = max(8, int(ORIG_NUMBER_FONT_SIZE * SCALE_FACTOR))
-TEXT_FONT_SIZE = max(6, int(ORIG_TEXT_FONT_SIZE * SCALE_FACTOR))
-TICKET_BORDER_WIDTH = max(1, int(ORIG_TICKET_BORDER_WIDTH * SCALE_FACTOR)) if ORIG_TICKET_BORDER_WIDTH > 0 else 0
-ROTATED_NUMBER_X_OFFSET_STUB_PX = int(ORIG_ROTATED_NUMBER_X_OFFSET_STUB_PX * SCALE_FACTOR)
-ROTATED_TEXT_PADDING_PX = max(2, int(ORIG_ROTATED_TEXT_PADDING_PX * SCALE_FACTOR))
-MAIN_BODY_MARGIN_PX = max(3, int(ORIG_MAIN_BODY_MARGIN_PX * SCALE_FACTOR)) # Ensure some padding
-FRONT_TEXT_TOP_MARGIN_PX = max(5, int(ORIG_FRONT_TEXT_TOP_MARGIN_PX * SCALE_FACTOR))
-FRONT_TEXT_BOTTOM_MARGIN_PX = max(5, int(ORIG_FRONT_TEXT_BOTTOM_MARGIN_PX * SCALE_FACTOR))
-BACK_TEXT_START_Y_PX = max(10, int(ORIG_BACK_TEXT_START_Y_PX * SCALE_FACTOR))
-BACK_TEXT_LINE_SPACING_ADDON_PX = max(3, int(ORIG_BACK_TEXT_LINE_SPACING_ADDON_PX * SCALE_FACTOR))
-BACK_MULTILINE_SPACING_PX = max(1, int(ORIG_BACK_MULTILINE_SPACING_PX * SCALE_FACTOR))
-BACK_SERIAL_BOTTOM_MARGIN_PX = max(10, int(ORIG_BACK_SERIAL_BOTTOM_MARGIN_PX * SCALE_FACTOR))
-PERFORATION_DASH_STEP_PX = max(4, int(ORIG_PERFORATION_DASH_STEP_PX * SCALE_FACTOR))
-PERFORATION_DASH_LENGTH_PX = max(1, int(ORIG_PERFORATION_DASH_LENGTH_PX * SCALE_FACTOR))
-if PERFORATION_DASH_LENGTH_PX >= PERFORATION_DASH_STEP_PX :
-    PERFORATION_DASH_LENGTH_PX = PERFORATION_DASH_STEP_PX // 2
-    PERFORATION_DASH_LENGTH_PX = max(1, PERFORATION_DASH_LENGTH_PX)
-
-RIGHT_SIDE_TEXT_X_OFFSET = 5
+def apply_scale_factor(scale_factor):
+    """(Re)computes every scaled layout constant from the ORIG_* design values."""
+    global SCALE_FACTOR, TICKET_WIDTH_PX, TICKET_HEIGHT_PX, STUB_WIDTH_PX, IMAGE_ON_TICKET_HEIGHT_PX
+    global NUMBER_FONT_SIZE, TEXT_FONT_SIZE, TICKET_BORDER_WIDTH, ROTATED_NUMBER_X_OFFSET_STUB_PX
+    global ROTATED_TEXT_PADDING_PX, MAIN_BODY_MARGIN_PX, FRONT_TEXT_TOP_MARGIN_PX, FRONT_TEXT_BOTTOM_MARGIN_PX
+    global BACK_TEXT_START_Y_PX, BACK_TEXT_LINE_SPACING_ADDON_PX, BACK_MULTILINE_SPACING_PX
+    global BACK_SERIAL_BOTTOM_MARGIN_PX, PERFORATION_DASH_STEP_PX, PERFORATION_DASH_LENGTH_PX
+    global RIGHT_SIDE_TEXT_X_OFFSET, MICROTEXT_FONT_SIZE, GUILLOCHE_LINE_WIDTH_PX, MIN_FIT_FONT_SIZE, TITLE_BOX_HEIGHT_PX
+    SCALE_FACTOR = scale_factor
+    TICKET_WIDTH_PX = int(ORIG_TICKET_WIDTH_PX * SCALE_FACTOR)
+    TICKET_HEIGHT_PX = int(ORIG_TICKET_HEIGHT_PX * SCALE_FACTOR)
+    STUB_WIDTH_PX = int(ORIG_STUB_WIDTH_PX * SCALE_FACTOR)
+    IMAGE_ON_TICKET_HEIGHT_PX = int(ORIG_IMAGE_ON_TICKET_HEIGHT_PX * SCALE_FACTOR) # Retained, might be useful for future small overlay logos
+    NUMBER_FONT_SIZE = max(8, int(ORIG_NUMBER_FONT_SIZE * SCALE_FACTOR))
+    TEXT_FONT_SIZE = max(6, int(ORIG_TEXT_FONT_SIZE * SCALE_FACTOR))
+    TICKET_BORDER_WIDTH = max(1, int(ORIG_TICKET_BORDER_WIDTH * SCALE_FACTOR)) if ORIG_TICKET_BORDER_WIDTH > 0 else 0
+    ROTATED_NUMBER_X_OFFSET_STUB_PX = int(ORIG_ROTATED_NUMBER_X_OFFSET_STUB_PX * SCALE_FACTOR)
+    ROTATED_TEXT_PADDING_PX = max(2, int(ORIG_ROTATED_TEXT_PADDING_PX * SCALE_FACTOR))
+    MAIN_BODY_MARGIN_PX = max(3, int(ORIG_MAIN_BODY_MARGIN_PX * SCALE_FACTOR)) # Ensure some padding
+    FRONT_TEXT_TOP_MARGIN_PX = max(5, int(ORIG_FRONT_TEXT_TOP_MARGIN_PX * SCALE_FACTOR))
+    FRONT_TEXT_BOTTOM_MARGIN_PX = max(5, int(ORIG_FRONT_TEXT_BOTTOM_MARGIN_PX * SCALE_FACTOR))
+    BACK_TEXT_START_Y_PX = max(10, int(ORIG_BACK_TEXT_START_Y_PX * SCALE_FACTOR))
+    BACK_TEXT_LINE_SPACING_ADDON_PX = max(3, int(ORIG_BACK_TEXT_LINE_SPACING_ADDON_PX * SCALE_FACTOR))
+    BACK_MULTILINE_SPACING_PX = max(1, int(ORIG_BACK_MULTILINE_SPACING_PX * SCALE_FACTOR))
+    BACK_SERIAL_BOTTOM_MARGIN_PX = max(10, int(ORIG_BACK_SERIAL_BOTTOM_MARGIN_PX * SCALE_FACTOR))
+    PERFORATION_DASH_STEP_PX = max(4, int(ORIG_PERFORATION_DASH_STEP_PX * SCALE_FACTOR))
+    PERFORATION_DASH_LENGTH_PX = max(1, int(ORIG_PERFORATION_DASH_LENGTH_PX * SCALE_FACTOR))
+    if PERFORATION_DASH_LENGTH_PX >= PERFORATION_DASH_STEP_PX :
+        PERFORATION_DASH_LENGTH_PX = PERFORATION_DASH_STEP_PX // 2
+        PERFORATION_DASH_LENGTH_PX = max(1, PERFORATION_DASH_LENGTH_PX)
+    RIGHT_SIDE_TEXT_X_OFFSET = int(ORIG_RIGHT_SIDE_TEXT_X_OFFSET * SCALE_FACTOR)
+    MICROTEXT_FONT_SIZE = max(3, int(ORIG_MICROTEXT_FONT_SIZE * SCALE_FACTOR))
+    GUILLOCHE_LINE_WIDTH_PX = max(0.6, ORIG_GUILLOCHE_LINE_WIDTH_PX * SCALE_FACTOR)
+    MIN_FIT_FONT_SIZE = max(5, int(ORIG_MIN_FIT_FONT_SIZE * SCALE_FACTOR))
+    TITLE_BOX_HEIGHT_PX = max(8, int(ORIG_TITLE_BOX_HEIGHT_PX * SCALE_FACTOR))
+
+apply_scale_factor(SCALE_FACTOR)
 
 # --- Static Configuration (Ticket Design) ---
 FONT_PATH = "arial.ttf"
@@ -74,6 +117,14 @@ TEXT_COLOR_ON_DARK_BG = (255, 255, 255) # White
 DEFAULT_STUB_BG_COLOR = (220, 220, 220) # Default light grey for the stub
 MAIN_BODY_TEXT_COLOR_OVER_IMAGE = TEXT_COLOR_ON_DARK_BG # Text on main image is white
 
+# --- Color Output Configuration ---
+# Tiles are rendered in OUTPUT_COLOR_MODE; "CMYK" is set by the *_cmyk output profiles for offset printing.
+# Design colors stay RGB above and are converted through one ICC transform per run (see ink()).
+OUTPUT_COLOR_MODE = "RGB"
+CMYK_ICC_PROFILE_PATH = None # e.g. "USWebCoatedSWOP.icc"; also embedded in the PDF. None: Pillow's plain conversion, DeviceCMYK
+CMYK_RENDERING_INTENT = 0 # 0 perceptual, 1 relative colorimetric, 2 saturation, 3 absolute colorimetric
+CMYK_NEUTRALS_BLACK_ONLY = True # Black and gray design colors (text, borders) print with K only, so small text does not misregister
+
 # --- PDF Sheet Layout Configuration ---
 PDF_TICKETS_PER_ROW = 2
 PDF_TICKETS_PER_COL = 6
@@ -83,8 +134,271 @@ PDF_MARGIN_PT = 36
 PDF_SPACING_PT = 10
 EFFECTIVE_DPI_FOR_CONVERSION = 96.0
 
+# --- Sheet Packing Configuration ---
+# "grid" keeps PDF_TICKETS_PER_ROW x PDF_TICKETS_PER_COL. "optimized" is opt-in: it packs
+# as many tickets per sheet as fit (rotated tickets, leftover strips, either page
+# orientation), which saves sheets but changes the cutting plan and may need landscape
+# duplexing, so check it with the print shop first.
+PDF_SHEET_LAYOUT = "grid"
+PDF_LAYOUT_ALLOW_ROTATED_TICKETS = True
+PDF_LAYOUT_ALLOW_PAGE_ROTATION = True
+PDF_PAGE_SIZES_PT = {
+    "a3": (841.89, 1190.55), "a4": (595.28, 841.89), "a5": (420.94, 595.28),
+    "letter": (612, 792), "legal": (612, 1008), "tabloid": (792, 1224),
+}
+ACTIVE_SHEET_LAYOUT = None # Set by use_sheet_layout(); None means the fixed grid
+
+# --- PDF Compression Configuration ---
+# Image streams are deflated in a thread pool (zlib releases the GIL while compressing).
+# Presets only pick the level: on rendered tiles zlib's default strategy was as small as or
+# smaller than Z_FILTERED (rows are unfiltered) and Z_RLE (16-50% larger) at every level.
+PDF_COMPRESSION_PRESETS = {
+    "fast":    {"level": 1}, # Proofs
+    "default": {"level": 6},
+    "archive": {"level": 9}, # Smallest file, slowest
+}
+DEFAULT_PDF_COMPRESSION_PRESET = "default"
+PDF_COMPRESSION_WORKERS = os.cpu_count() or 1
+PDF_COMPRESSION_MAX_PENDING = 4 * PDF_COMPRESSION_WORKERS # Tiles in flight per writer before placement waits
+PDF_COMPRESSION_STREAM_LOG = True # Write per-stream time/ratio rows to <pdf>_compression.csv
+# PDFs written by a full run, all from one render with each tile deflated once:
+# "duplex" -> <output>.pdf (front and back pages interleaved), "fronts" -> <output>_fronts.pdf,
+# "backs" -> <output>_backs.pdf (mirrored slots, for printing the second side separately)
+PDF_OUTPUT_SIDES = ("duplex",)
+PDF_SIDE_CHOICES = ("duplex", "fronts", "backs")
+
+# --- PDF Structure Configuration ---
+# Compact structure (PDF 1.5): page, page tree and catalog objects packed into compressed
+# object streams, a compressed cross-reference stream instead of the xref table, each
+# sheet's images in one resource dictionary shared by its front and back page, and a
+# balanced page tree, so a RIP parses far less to find a page. Off by default: some older
+# RIPs only read PDF 1.4.
+PDF_COMPACT_STRUCTURE = False
+PDF_OBJECT_STREAM_SIZE = 200 # Objects per object stream
+PDF_PAGE_TREE_FANOUT = 32 # Kids per intermediate page tree node
+# Chunk index written next to each shard's PDF chunk: header, then int64 object offsets and page ids
+PDF_CHUNK_MAGIC = b"PDFCHNK1"
+PDF_CHUNK_HEADER_FORMAT = "<8sqqq" # magic, first_object, object_count, page_count
+PDF_CHUNK_HEADER_SIZE = struct.calcsize(PDF_CHUNK_HEADER_FORMAT)
+PDF_LINEARIZE = False # Rewrite the finished PDF linearized ("fast web view") for first-page display; needs pikepdf
+
+# --- Tile Bit Depth ---
+# Store each rendered tile in the smallest pixel mode that reproduces it exactly: 1-bit,
+# 8-bit grayscale, or an 8-bit palette (<= 256 colors), falling back to 24-bit RGB for photos.
+REDUCE_TILE_BIT_DEPTH = True
+
+# --- Output Profiles ---
+# The physical ticket size is fixed by SCALE_FACTOR at EFFECTIVE_DPI_FOR_CONVERSION above
+# (ORIG px * SCALE_FACTOR / dpi, captured here before any profile rescales). A profile renders
+# that same size at a different dpi; print profiles also derive a low-res preview PDF from
+# the same tiles with an integer reduce().
+TICKET_WIDTH_IN = int(ORIG_TICKET_WIDTH_PX * SCALE_FACTOR) / EFFECTIVE_DPI_FOR_CONVERSION
+OUTPUT_PROFILES = {
+    "preview":  {"dpi": 96,  "preview_reduce": None},
+    "print300": {"dpi": 300, "preview_reduce": 3},
+    "print600": {"dpi": 600, "preview_reduce": 6},
+    "print300_cmyk": {"dpi": 300, "preview_reduce": 3, "color_mode": "CMYK"},
+}
+DEFAULT_OUTPUT_PROFILE = "preview"
+MEMORY_BUDGET_MB = 2048 # Upper bound for tiles held in memory at once (one sheet of fronts + backs)
+
+# --- Per-ticket Export Configuration ---
+# Encoder settings per format. "flat_params" apply to tiles reduced to 1-bit, gray or
+# palette mode (no photo): lossless there is both exact and smaller than lossy.
+EXPORT_FORMATS = {
+    "png":  {"pil_format": "PNG",  "extension": ".png",
+             "params": {"compress_level": 6}, "flat_params": {"compress_level": 9}},
+    "webp": {"pil_format": "WEBP", "extension": ".webp",
+             "params": {"quality": 85, "method": 4}, "flat_params": {"lossless": True, "quality": 100, "method": 4}},
+    "jpeg": {"pil_format": "JPEG", "extension": ".jpg",
+             "params": {"quality": 88, "optimize": True, "subsampling": 0}, # 4:4:4 keeps small text crisp
+             "flat_params": {"quality": 90, "optimize": True, "subsampling": 0}},
+    "pdf":  {"extension": ".pdf", "level": 6},
+}
+EXPORT_CONTAINERS = ("dir", "zip", "tar")
+EXPORT_INCLUDE_BACKS = True
+EXPORT_FILES_PER_SHARD = 1000 # Ticket numbers per subdirectory / archive folder
+EXPORT_SHARD_DIGITS = 4
+EXPORT_WORKERS = os.cpu_count() or 1
+EXPORT_MAX_PENDING = 8 * EXPORT_WORKERS
+
+# --- Thermal Roll Printer Configuration ---
+# Fronts rendered at the printer's dot width, dithered to 1 bit and streamed as ESC/POS
+# raster commands (GS v 0) with a cut after every ticket, e.g. for gate kiosk printers.
+THERMAL_PRINTERS = {
+    "58mm": {"dots": 384}, # Printable dots per line at 203 dpi
+    "80mm": {"dots": 576},
+}
+DEFAULT_THERMAL_PRINTER = "58mm"
+THERMAL_ROTATE_TICKET = True # Ticket height across the roll, length along it (a 58 mm roll gives a ~96 mm ticket)
+THERMAL_RASTER_BAND_ROWS = 256 # Rows per GS v 0 command; many printers cap one raster image's height
+# The cut command first feeds the last printed row past the cutter (which sits above the
+# print head) by itself, then this many more vertical motion units (set by GS P; 1/180 or
+# 1/360 inch on most Epson models, so 4 is well under a millimetre), at most 255.
+THERMAL_FEED_UNITS_BEFORE_CUT = 4
+THERMAL_CUT = "partial" # "partial" leaves a hinge so tickets hang in the kiosk slot, "full" separates them
+THERMAL_TEMPLATE_CACHE_SIZE = 512 # Dithered 1-bit templates are ~40 KB, so every rotating background can stay dithered
+
+# --- Manifest Configuration ---
+MANIFEST_FORMAT = "csv" # "csv", "sqlite", or None to skip writing a manifest
+MANIFEST_BATCH_SIZE = 5000 # Rows buffered before each CSV write / SQLite executemany
+MANIFEST_COLUMNS = (
+    "ticket_number", "ticket_index", "page_index", "slot_row", "slot_col",
+    "back_page_index", "back_slot_row", "back_slot_col", "event_title", "event",
+    "front_tile_hash", "back_tile_hash", "background",
+) # "event" is the gang event name (see load_gang_events), "" otherwise; ganged events can share numbers.
+# page_index/back_page_index are pages of the PDFs the run wrote (see ticket_page_indexes), empty for a side it did not write.
+
+# --- Background Image Decoding ---
+BACKGROUND_DECODE_OVERSAMPLE = 2 # Decode/reduce huge photos to no less than this multiple of the main body size
+EXIF_ORIENTATION_TAG = 0x0112
+EXIF_ORIENTATION_TRANSPOSE = { # Same mapping as PIL.ImageOps.exif_transpose
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# --- Variable Data Configuration ---
+# Named text slots for per-ticket data merged from a CSV (seat, table, holder name...).
+# orig_box is (left, top, right, bottom) in original ticket pixels, scaled by SCALE_FACTOR when drawn.
+VARIABLE_TEXT_SLOTS = {
+    "seat":   {"side": "front", "orig_box": (90, 195, 455, 235)},
+    "table":  {"side": "front", "orig_box": (90, 45, 455, 80)},
+    "holder": {"side": "back",  "orig_box": (20, 140, 480, 185)},
+}
+VARIABLE_DATA_COLUMN_MAP = {} # Optional CSV column -> slot renames, e.g. {"Guest Name": "holder"}
+VARIABLE_DATA_NUMBER_COLUMN = "ticket_number" # If present, checked against the ticket each row lands on
+
+# --- Text Fitting Configuration ---
+# Text that would overflow its slot (long titles, wide numbers, long variable-data fields)
+# is set at the largest size that fits, found once per distinct text shape; text that fits
+# keeps its configured size.
+AUTO_FIT_TEXT = True
+TITLE_MAX_LINES = 2 # The title may wrap at spaces onto this many lines before it shrinks further
+
+# --- Variant Configuration ---
+TEMPLATE_CACHE_SIZE = 16 # Front templates kept in memory (one per variant/background/color combination)
+RENDER_CACHE_MEMORY_MB = 2048 # Runs with more templates/backgrounds than the cache sizes grow them up to this (see size_render_caches)
+
+# --- Background Rotation Configuration ---
+# A background may be a directory (or list) of images, e.g. sponsor artwork, picked per ticket.
+BACKGROUND_ROTATION_POLICY = "round_robin" # "round_robin", "weighted" or "hashed" (stable per ticket number)
+BACKGROUND_WEIGHTS_FILENAME = "weights.json" # Optional {"sponsor_a.png": 3, ...} in the directory; unlisted images weigh 1
+BACKGROUND_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+PREPARED_BACKGROUND_CACHE_SIZE = 32 # Decoded + cropped backgrounds kept in memory (keep above BACKGROUND_PREFETCH_AHEAD); at least the rotation length
+BACKGROUND_PREFETCH_AHEAD = 16 # Tickets the prefetch threads may decode ahead of rendering
+BACKGROUND_PREFETCH_WORKERS = min(4, os.cpu_count() or 1) # A camera JPEG takes several tickets' worth of render time to decode
+
+# --- Security Underlay Configuration ---
+# Guilloche lines and a microtext band under the front's text, with every curve parameter
+# and the band's phase derived from a keyed hash of the ticket number (needs NumPy).
+SECURITY_UNDERLAY = False
+SECURITY_UNDERLAY_KEY = b"change-this-per-client" # Keep private: without it the pattern of a number cannot be predicted
+SECURITY_UNDERLAY_COLOR = (0, 0, 0)
+SECURITY_GUILLOCHE_OPACITY = 0.22
+SECURITY_MICROTEXT_OPACITY = 0.55
+SECURITY_GUILLOCHE_LINES = 14 # Wavy lines per family across the ticket height; two families cross into the mesh
+SECURITY_UNDERLAY_BATCH_SIZE = 8 # Tickets evaluated per NumPy pass (float32 work arrays are ~16 bytes per pixel per ticket)
+
+# --- Verification Code Configuration ---
+# With a key set, every back shows a short HMAC code of the event id and number next to its
+# serial, and the run writes an index for `python tkt_verify.py` to check scanned codes.
+VERIFICATION_KEY = os.environ.get(tkt_verify.KEY_ENVIRONMENT_VARIABLE, "") # Keep secret; "" prints no codes
+VERIFICATION_EVENT_ID = "event" # Set per event, so the same number gets a different code at the next one
+VERIFICATION_CODE_LENGTH = 6 # Base32 characters (5 bits each), 4-6
+
+# --- Proof Mode Configuration ---
+# A proof renders a sample (first/last sheet, every Nth sheet, number width and variant
+# boundaries) as a captioned contact sheet instead of the full run.
+PROOF_EVERY_N_SHEETS = 50
+PROOF_MAX_SAMPLED_SHEETS = 100 # N is raised for long runs so the proof stays small
+PROOF_PROFILE = "preview" # Proofs always render at this profile, then shrink
+PROOF_THUMBNAIL_REDUCE = 2
+PROOF_COLUMNS = 3 # Cells (front + back) per contact sheet row
+PROOF_ROWS = 8
+PROOF_CELL_PADDING_PX = 8
+PROOF_CAPTION_FONT_SIZE = 10
+
+# --- Tracing Configuration ---
+TRACE_OUTPUT_PATH = None # e.g. "ticket_trace.json": Chrome/Perfetto trace of every ticket and stage
+PROFILE_OUTPUT_PATH = None # e.g. "ticket_profile.pstats": cProfile dump, open with `python -m pstats`
+PROFILE_SAMPLE_EVERY_N_TICKETS = 100 # Only every Nth ticket runs under cProfile, keeping overhead low
+
+# --- Tracing ---
+
+class _TraceSpan:
+    __slots__ = ("tracer", "name", "args", "start_us")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start_us = time.perf_counter_ns() // 1000
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, self.start_us, time.perf_counter_ns() // 1000 - self.start_us, self.args)
+
+class ChromeTracer:
+    """Streams complete ("X") events in the Chrome trace event format, loadable in
+    chrome://tracing or ui.perfetto.dev. Events are written as they finish, so a long run
+    does not accumulate them in memory."""
+
+    def __init__(self, output_filename):
+        self.output_filename = output_filename
+        self.event_count = 0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._file = open(output_filename, "w", encoding="utf-8", buffering=1024 * 1024)
+        self._file.write("[\n")
+
+    def span(self, name, args=None):
+        return _TraceSpan(self, name, args)
+
+    def record(self, name, start_us, duration_us, args=None):
+        event = {"name": name, "ph": "X", "ts": start_us, "dur": duration_us,
+                 "pid": self._pid, "tid": threading.get_ident()}
+        if args:
+            event["args"] = args
+        line = json.dumps(event)
+        with self._lock: # Compression worker threads record spans too
+            self._file.write(line if self.event_count == 0 else ",\n" + line)
+            self.event_count += 1
+
+    def close(self):
+        self._file.write("\n]\n")
+        self._file.close()
+        print(f"Saved trace: {self.output_filename} ({self.event_count} spans)")
+
+ACTIVE_TRACER = None
+_NO_TRACE = contextlib.nullcontext()
+
+def trace_span(name, args=None):
+    """`with trace_span("stage"):` records a span when tracing is on; otherwise it returns a
+    shared no-op context, so instrumented code costs one function call."""
+    if ACTIVE_TRACER is None:
+        return _NO_TRACE
+    return ACTIVE_TRACER.span(name, args)
+
+def start_tracing(output_filename):
+    global ACTIVE_TRACER
+    ACTIVE_TRACER = ChromeTracer(output_filename)
+
+def stop_tracing():
+    global ACTIVE_TRACER
+    if ACTIVE_TRACER is not None:
+        ACTIVE_TRACER.close()
+        ACTIVE_TRACER = None
+
 # --- Helper Functions ---
 
+@functools.lru_cache(maxsize=None)
 def load_font(size):
     try:
         return ImageFont.truetype(FONT_PATH, size)
@@ -102,7 +416,37 @@ def get_text_color_for_background(bg_color_tuple):
     else:
         return TEXT_COLOR_ON_DARK_BG   # White text
 
+@functools.lru_cache(maxsize=1)
+def cmyk_transform():
+    """sRGB -> CMYK_ICC_PROFILE_PATH transform, built once per run. None without a profile."""
+    if ImageCms is None or not CMYK_ICC_PROFILE_PATH:
+        return None
+    return ImageCms.buildTransform(ImageCms.createProfile("sRGB"), ImageCms.getOpenProfile(CMYK_ICC_PROFILE_PATH),
+                                   "RGB", "CMYK", renderingIntent=CMYK_RENDERING_INTENT)
+
+def to_output_color(pil_image):
+    """Converts an RGB image (template, prepared background) to OUTPUT_COLOR_MODE."""
+    if OUTPUT_COLOR_MODE == "RGB" or pil_image.mode == OUTPUT_COLOR_MODE:
+        return pil_image
+    transform = cmyk_transform()
+    if transform is None:
+        return pil_image.convert("CMYK")
+    return ImageCms.applyTransform(pil_image.convert("RGB"), transform)
+
+@functools.lru_cache(maxsize=256)
+def _cmyk_ink(rgb):
+    red, green, blue = rgb
+    if CMYK_NEUTRALS_BLACK_ONLY and red == green == blue:
+        return (0, 0, 0, 255 - red)
+    return to_output_color(Image.new("RGB", (1, 1), rgb)).getpixel((0, 0))
+
+def ink(rgb):
+    """A design color (RGB tuple) in OUTPUT_COLOR_MODE. Flat colors go through a small
+    lookup instead of transforming each drawn pixel."""
+    return rgb if OUTPUT_COLOR_MODE == "RGB" else _cmyk_ink(tuple(rgb))
+
 def draw_rotated_text(image, text, center_position, font, fill, angle):
+    """Pastes text rotated by angle, centered on center_position; returns the pasted [x, y, width, height]."""
     dummy_draw = ImageDraw.Draw(Image.new("RGB", (1,1)))
     try:
         bbox = dummy_draw.textbbox((0,0), text, font=font)
@@ -120,7 +464,8 @@ def draw_rotated_text(image, text, center_position, font, fill, angle):
     
     txt_canvas_img = Image.new("RGBA", (canvas_width, canvas_height), (0, 0, 0, 0))
     draw_on_canvas = ImageDraw.Draw(txt_canvas_img)
-    draw_on_canvas.text((padding, padding), text, font=font, fill=fill)
+    # Non-RGB tiles (CMYK): only the alpha of the drawn text is used, as a mask for the fill below
+    draw_on_canvas.text((padding, padding), text, font=font, fill=fill if image.mode == "RGB" else (0, 0, 0))
 
     actual_content_bbox = txt_canvas_img.getbbox()
     if actual_content_bbox:
@@ -131,21 +476,455 @@ def draw_rotated_text(image, text, center_position, font, fill, angle):
     rotated_txt_img = txt_img_cropped.rotate(angle, expand=True, resample=Image.Resampling.BICUBIC)
     paste_x = center_position[0] - rotated_txt_img.width // 2
     paste_y = center_position[1] - rotated_txt_img.height // 2
-    image.paste(rotated_txt_img, (int(paste_x), int(paste_y)), rotated_txt_img)
-
-    if DEBUG_ROTATED_TEXT: # Simplified debug, can be expanded if needed
-        print(f"Rotated text '{text}': paste at ({paste_x}, {paste_y}), size {rotated_txt_img.size}")
+    if image.mode == "RGB":
+        image.paste(rotated_txt_img, (int(paste_x), int(paste_y)), rotated_txt_img)
+    else:
+        image.paste(fill, (int(paste_x), int(paste_y)), rotated_txt_img.getchannel("A"))
+    return [int(paste_x), int(paste_y), rotated_txt_img.width, rotated_txt_img.height]
+
+# --- Text Fitting ---
+
+def _text_layout(text, font, box_width, box_height, max_lines):
+    """Lines of `text` at `font` if it fits the box (wrapped at spaces onto at most
+    max_lines lines), else None."""
+    if font.getlength(text) <= box_width:
+        left, top, right, bottom = font.getbbox(text)
+        return (text,) if bottom - top <= box_height else None
+    if max_lines < 2:
+        return None
+    lines = []
+    for word in text.split():
+        if lines and font.getlength(lines[-1] + " " + word) <= box_width:
+            lines[-1] += " " + word
+        elif font.getlength(word) <= box_width:
+            lines.append(word)
+        else:
+            return None
+    ascent, descent = font.getmetrics()
+    if len(lines) > max_lines or len(lines) * (ascent + descent) > box_height:
+        return None
+    return tuple(lines)
+
+@functools.lru_cache(maxsize=4096)
+def fit_text(text, max_size, box_width, box_height, max_lines=1):
+    """Largest font size up to max_size at which `text` fits a box_width x box_height
+    box, by binary search over sizes (text extent grows with size). Memoized, so a title
+    is fitted once per job and a number once per shape (see number_shape).
+
+    Returns (size, lines). If nothing down to MIN_FIT_FONT_SIZE fits, that size is returned
+    with the text on one line, and the caller truncates or reports it.
+    """
+    if not AUTO_FIT_TEXT:
+        return max_size, (text,)
+    lines = _text_layout(text, load_font(max_size), box_width, box_height, max_lines)
+    if lines is not None:
+        return max_size, lines
+    best = (min(MIN_FIT_FONT_SIZE, max_size), (text,))
+    low, high = MIN_FIT_FONT_SIZE, max_size - 1
+    while low <= high:
+        size = (low + high) // 2
+        lines = _text_layout(text, load_font(size), box_width, box_height, max_lines)
+        if lines is None:
+            high = size - 1
+        else:
+            best = (size, lines)
+            low = size + 1
+    return best
+
+@functools.lru_cache(maxsize=None)
+def widest_character(characters, font_size):
+    return max(characters, key=load_font(font_size).getlength)
+
+@functools.lru_cache(maxsize=None)
+def _number_shape_table(font_size):
+    return str.maketrans("0123456789", widest_character("0123456789", font_size) * 10)
+
+def number_shape(text, font_size):
+    """`text` with every digit replaced by the font's widest digit. Fitting the shape
+    instead of the number gives every number with the same digit count the same size."""
+    return text.translate(_number_shape_table(font_size))
+
+def open_background_image(image_path, target_w, target_h):
+    """Opens a background photo as upright RGB, decoded no larger than needed.
+
+    Camera JPEGs are 24-50 MP while the main body is a few hundred pixels, so instead of a
+    full-resolution decode: JPEG draft mode lets libjpeg decode at 1/2, 1/4 or 1/8 scale in
+    the DCT domain, then reduce() box-filters down to a nearby integer factor. Both stop at
+    BACKGROUND_DECODE_OVERSAMPLE x the fill size, leaving the final LANCZOS resample enough
+    detail. EXIF orientation is applied and CMYK (e.g. Adobe) JPEGs are converted to RGB.
+    """
+    img = Image.open(image_path)
+    orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    # Orientations 5-8 are rotated by 90 degrees: the stored image is target_h wide
+    fill_w, fill_h = (target_h, target_w) if orientation in (5, 6, 7, 8) else (target_w, target_h)
+    fill_scale = max(fill_w / img.width, fill_h / img.height) * BACKGROUND_DECODE_OVERSAMPLE
+    needed_w = max(1, math.ceil(img.width * fill_scale))
+    needed_h = max(1, math.ceil(img.height * fill_scale))
+
+    if img.format == "JPEG":
+        img.draft(img.mode, (needed_w, needed_h))
+
+    reduce_factor = min(img.width // needed_w, img.height // needed_h)
+    if reduce_factor >= 2:
+        img = img.reduce(reduce_factor) if img.mode in ("RGB", "L", "CMYK", "RGBA") else img.convert("RGB").reduce(reduce_factor)
+
+    # The reduced copy no longer carries EXIF, so apply the orientation read above directly
+    if orientation in EXIF_ORIENTATION_TRANSPOSE:
+        img = img.transpose(EXIF_ORIENTATION_TRANSPOSE[orientation])
+    return img.convert("RGB") # Convert to RGB (also handles CMYK and palette sources)
+
+def load_main_body_image(image_path, target_w, target_h):
+    """Loads image_path and resizes/crops it to fill target_w x target_h. Returns None (after
+    printing a warning) if the image cannot be used, so the main body keeps BACKGROUND_COLOR."""
+    try:
+        img_original = open_background_image(image_path, target_w, target_h)
 
+        img_w, img_h = img_original.size
+        
+        img_aspect = img_w / img_h
+        target_aspect = target_w / target_h
+
+        if img_aspect > target_aspect: # Image is wider than target aspect (letterbox top/bottom if not cropping, or crop sides)
+                                       # To fill, we resize to match height, then crop width
+            new_h = target_h
+            new_w = int(new_h * img_aspect)
+            img_resized = img_original.resize((new_w, new_h), Image.Resampling.LANCZOS)
+            crop_x_offset = (new_w - target_w) // 2
+            img_to_paste = img_resized.crop((crop_x_offset, 0, crop_x_offset + target_w, new_h))
+        else: # Image is taller or same aspect (pillarbox left/right if not cropping, or crop top/bottom)
+              # To fill, we resize to match width, then crop height
+            new_w = target_w
+            new_h = int(new_w / img_aspect)
+            img_resized = img_original.resize((new_w, new_h), Image.Resampling.LANCZOS)
+            crop_y_offset = (new_h - target_h) // 2
+            img_to_paste = img_resized.crop((0, crop_y_offset, new_w, crop_y_offset + target_h))
+
+        # Ensure final pasted image is exactly target dimensions due to potential rounding
+        if img_to_paste.size != (target_w, target_h):
+            img_to_paste = img_to_paste.resize((target_w, target_h), Image.Resampling.LANCZOS)
+
+        return img_to_paste
+    except FileNotFoundError:
+        print(f"Warning: Main image '{image_path}' not found. Main body will show fallback BG_COLOR.")
+    except Exception as e:
+        print(f"Warning: Could not load/resize main image '{image_path}': {e}. Main body will show fallback BG_COLOR.")
+    return None
+
+# --- Background Rotation ---
+
+class BackgroundRotation:
+    """A set of main body backgrounds rotated across tickets (e.g. sponsor artwork).
+
+    The pick depends only on the ticket number, so reprints and the prefetch thread
+    resolve the same background as the render loop without sharing any state:
+    "round_robin" cycles through the images in name order, "hashed" spreads them
+    pseudo-randomly but stably, and "weighted" does the same in proportion to each
+    image's weight.
+    """
+
+    def __init__(self, image_paths, policy=None, weights=None):
+        self.image_paths = tuple(image_paths)
+        if not self.image_paths:
+            raise ValueError("A background rotation needs at least one image.")
+        self.policy = policy or BACKGROUND_ROTATION_POLICY
+        if self.policy not in ("round_robin", "weighted", "hashed"):
+            raise ValueError(f"Unknown background rotation policy '{self.policy}'. Use 'round_robin', 'weighted' or 'hashed'.")
+        weights = weights or {}
+        cumulative_weight = 0.0
+        self._cumulative_weights = []
+        for image_path in self.image_paths:
+            weight = float(weights.get(os.path.basename(image_path), weights.get(image_path, 1)))
+            if weight < 0:
+                raise ValueError(f"Negative weight for background '{image_path}'.")
+            cumulative_weight += weight
+            self._cumulative_weights.append(cumulative_weight)
+        if cumulative_weight <= 0:
+            raise ValueError("Background rotation weights add up to zero.")
+
+    @classmethod
+    def from_source(cls, source, policy=None):
+        """Builds a rotation from a directory (every image in it, plus an optional
+        BACKGROUND_WEIGHTS_FILENAME) or from a list of image paths."""
+        if isinstance(source, (list, tuple)):
+            return cls(source, policy)
+        image_paths = sorted(
+            os.path.join(source, name) for name in os.listdir(source)
+            if name.lower().endswith(BACKGROUND_IMAGE_EXTENSIONS)
+        )
+        weights = None
+        weights_path = os.path.join(source, BACKGROUND_WEIGHTS_FILENAME)
+        if os.path.exists(weights_path):
+            with open(weights_path, encoding="utf-8") as f:
+                weights = json.load(f)
+        return cls(image_paths, policy, weights)
+
+    def pick(self, number_str):
+        number = int(number_str)
+        if self.policy == "round_robin":
+            return self.image_paths[number % len(self.image_paths)]
+        number_hash = int.from_bytes(hashlib.blake2b(str(number).encode(), digest_size=8).digest(), "little")
+        if self.policy == "hashed":
+            return self.image_paths[number_hash % len(self.image_paths)]
+        target = (number_hash / 2.0 ** 64) * self._cumulative_weights[-1]
+        return self.image_paths[min(bisect.bisect_right(self._cumulative_weights, target), len(self.image_paths) - 1)]
+
+    def __str__(self):
+        return f"{len(self.image_paths)} backgrounds ({self.policy})"
+
+def resolve_background_source(source):
+    """Turns a background setting into what create_ticket_front expects: None, a single
+    image path, or a BackgroundRotation for a directory or list of images."""
+    if not source or isinstance(source, BackgroundRotation):
+        return source or None
+    if isinstance(source, (list, tuple)) or os.path.isdir(source):
+        return BackgroundRotation.from_source(source)
+    return source
+
+def ticket_background(background, number_str):
+    """The single image path used for ticket number_str."""
+    return background.pick(number_str) if isinstance(background, BackgroundRotation) else background
+
+def main_body_size():
+    """(width, height) of the main body area the background image fills."""
+    main_body_x_start_coord = STUB_WIDTH_PX if STUB_WIDTH_PX > 0 else 0
+    return TICKET_WIDTH_PX - main_body_x_start_coord, TICKET_HEIGHT_PX
+
+class PreparedBackgroundCache:
+    """Bounded LRU of main body images that are already decoded and cropped to size.
+
+    Shared by the render loop and the BackgroundPrefetcher thread. A file being loaded by
+    one thread is waited on by the other instead of being decoded twice. Failed loads are
+    cached as None so the warning is printed once per file.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity or PREPARED_BACKGROUND_CACHE_SIZE
+        self.hits = 0
+        self.misses = 0 # The render loop had to wait for or do the decode itself
+        self._images = collections.OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, image_path, target_w, target_h, prefetch=False):
+        key = (image_path, target_w, target_h)
+        counted = prefetch # Only the render loop's lookups count towards hits/misses
+        while True:
+            with self._lock:
+                if key in self._images:
+                    self._images.move_to_end(key)
+                    if not counted:
+                        self.hits += 1
+                    return self._images[key]
+                if not counted:
+                    self.misses += 1
+                    counted = True
+                loading_event = self._loading.get(key)
+                if loading_event is None:
+                    self._loading[key] = threading.Event()
+                    break
+            loading_event.wait() # Loaded by the other thread; normally found on the next pass
 
-def create_ticket_front(number_str, image_path, current_stub_bg_color):
-    ticket = Image.new("RGB", (TICKET_WIDTH_PX, TICKET_HEIGHT_PX), BACKGROUND_COLOR)
+        try:
+            img = load_main_body_image(image_path, target_w, target_h)
+            if img is not None:
+                img = to_output_color(img) # Once per prepared background, not per ticket
+        except BaseException:
+            with self._lock:
+                self._loading.pop(key).set()
+            raise
+        with self._lock: # Stored before waiters wake, so none of them finds the key missing and decodes it again
+            self._images[key] = img
+            self._images.move_to_end(key)
+            while len(self._images) > self.capacity:
+                self._images.popitem(last=False)
+            self._loading.pop(key).set()
+        return img
+
+    def resize(self, capacity):
+        with self._lock:
+            self.capacity = capacity
+            while len(self._images) > self.capacity:
+                self._images.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+
+PREPARED_BACKGROUNDS = PreparedBackgroundCache()
+
+class BackgroundPrefetcher:
+    """Decodes upcoming backgrounds on daemon threads, reading ahead in ticket order.
+
+    `upcoming_paths` yields the image path of every ticket in render order (see
+    iter_ticket_backgrounds). The threads stay at most BACKGROUND_PREFETCH_AHEAD tickets
+    ahead: the render loop calls ticket_done() after each ticket to let them advance.
+    Pillow releases the GIL while decoding and resampling, so this overlaps with rendering.
+    """
+
+    def __init__(self, upcoming_paths, cache=None, read_ahead=None, workers=None):
+        self.cache = cache or PREPARED_BACKGROUNDS
+        self._upcoming_paths = iter(upcoming_paths)
+        self._upcoming_lock = threading.Lock()
+        self._window = threading.Semaphore(read_ahead or BACKGROUND_PREFETCH_AHEAD)
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"background-prefetch-{n}", daemon=True)
+            for n in range(workers or BACKGROUND_PREFETCH_WORKERS)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        target_w, target_h = main_body_size()
+        while True:
+            self._window.acquire()
+            if self._stopped.is_set():
+                return
+            with self._upcoming_lock:
+                image_path = next(self._upcoming_paths, False)
+            if image_path is False:
+                return
+            if image_path:
+                self.cache.get(image_path, target_w, target_h, prefetch=True)
+
+    def ticket_done(self):
+        self._window.release()
+
+    def close(self):
+        self._stopped.set()
+        for _ in self._threads:
+            self._window.release()
+        for thread in self._threads:
+            thread.join()
+
+def iter_ticket_backgrounds(variants, num_leading_zeros):
+    """Yields the background image path of every ticket, in the order render_ticket_sheets renders them."""
+    for variant in variants:
+        for i in range(variant["first"], variant["last"] + 1):
+            yield ticket_background(variant["background"], str(i).zfill(num_leading_zeros))
+
+# --- Security Underlay ---
+
+MICROTEXT_GLYPHS = "0123456789-"
+
+def security_underlay_params(number_strs):
+    """Pattern parameters for a batch of ticket numbers, each a float32 array with one entry
+    per ticket. They come from a BLAKE2b hash of the number keyed with SECURITY_UNDERLAY_KEY,
+    so a ticket's pattern can be regenerated from its number to check it, but not predicted
+    without the key."""
+    digests = b"".join(hashlib.blake2b(number_str.encode("ascii"), digest_size=16, key=SECURITY_UNDERLAY_KEY).digest()
+                       for number_str in number_strs)
+    unit = np.frombuffer(digests, dtype="<u2").reshape(len(number_strs), 8).astype(np.float32) / 65535
+    return {
+        "phase_a": unit[:, 0] * np.float32(2 * math.pi),
+        "phase_b": unit[:, 1] * np.float32(2 * math.pi),
+        "cycles_a": 2 + np.floor(unit[:, 2] * 4), # Waves across the ticket width
+        "cycles_b": 5 + np.floor(unit[:, 3] * 7),
+        "amplitude_a": 0.6 + unit[:, 4], # In line spacings
+        "amplitude_b": 0.2 + 0.4 * unit[:, 5],
+        "microtext_shift": unit[:, 6],
+    }
+
+@functools.lru_cache(maxsize=4)
+def microtext_atlas(font_size):
+    """Fixed-width glyph cells for MICROTEXT_GLYPHS as a (glyphs, height, width) uint8 array."""
+    font = load_font(font_size)
+    cell_width = max(1, max(math.ceil(font.getlength(glyph)) for glyph in MICROTEXT_GLYPHS))
+    ascent, descent = font.getmetrics()
+    atlas = np.zeros((len(MICROTEXT_GLYPHS), ascent + descent, cell_width), dtype=np.uint8)
+    for glyph_index, glyph in enumerate(MICROTEXT_GLYPHS):
+        cell = Image.new("L", (cell_width, ascent + descent), 0)
+        ImageDraw.Draw(cell).text((0, 0), glyph, font=font, fill=255)
+        atlas[glyph_index] = np.asarray(cell)
+    return atlas
+
+def security_underlays(number_strs):
+    """Renders the underlay masks for a batch of tickets in one vectorized pass.
+
+    Returns a (tickets, TICKET_HEIGHT_PX, TICKET_WIDTH_PX) uint8 array of ink coverage:
+    two crossing families of SECURITY_GUILLOCHE_LINES wavy lines (anti-aliased by their
+    distance to the curve) plus a microtext band of the repeated ticket number along the
+    bottom edge. Only the wave terms are evaluated per column; the per-pixel work is a few
+    in-place array operations shared by the whole batch.
+    """
+    params = security_underlay_params(number_strs)
+    batch_size, width, height = len(number_strs), TICKET_WIDTH_PX, TICKET_HEIGHT_PX
+    x = (np.arange(width, dtype=np.float32) + 0.5) * np.float32(2 * math.pi / width) # Radians per wave cycle
+    y = (np.arange(height, dtype=np.float32) + 0.5)
+    spacing = np.float32(height / SECURITY_GUILLOCHE_LINES)
+    coverage = np.zeros((batch_size, height, width), dtype=np.float32)
+    for sign, phase_a, phase_b in ((1, params["phase_a"], params["phase_b"]), (-1, params["phase_b"], params["phase_a"])):
+        angle_a = params["cycles_a"][:, None] * x + phase_a[:, None]
+        angle_b = params["cycles_b"][:, None] * x + phase_b[:, None]
+        wave = sign * (params["amplitude_a"][:, None] * np.sin(angle_a) + params["amplitude_b"][:, None] * np.sin(angle_b))
+        slope = spacing * np.float32(2 * math.pi / width) * (
+            params["amplitude_a"][:, None] * params["cycles_a"][:, None] * np.cos(angle_a)
+            + params["amplitude_b"][:, None] * params["cycles_b"][:, None] * np.cos(angle_b))
+        pixels_per_line = spacing / np.sqrt(1 + slope * slope) # Perpendicular distance, so steep lines keep their width
+        # Distance (in lines) to the nearest line of the family, then coverage of a line of the set width
+        lines = y[None, :, None] / spacing + wave[:, None, :]
+        lines -= np.rint(lines)
+        np.abs(lines, out=lines)
+        lines *= pixels_per_line[:, None, :]
+        np.subtract(np.float32(GUILLOCHE_LINE_WIDTH_PX / 2 + 0.5), lines, out=lines)
+        np.clip(lines, 0, 1, out=lines)
+        np.maximum(coverage, lines, out=coverage)
+    coverage *= np.float32(255 * SECURITY_GUILLOCHE_OPACITY)
+    underlays = np.rint(coverage).astype(np.uint8)
+
+    atlas = microtext_atlas(MICROTEXT_FONT_SIZE)
+    cell_height, cell_width = atlas.shape[1:]
+    band_top = height - TICKET_BORDER_WIDTH - 1 - cell_height
+    if band_top > 0:
+        max_period = max(len(number_str) + 1 for number_str in number_strs)
+        glyph_count = width // cell_width + 2 * max_period
+        glyph_indices = np.array([[MICROTEXT_GLYPHS.index(glyph) for glyph in ((number_str + "-") * glyph_count)[:glyph_count]]
+                                  for number_str in number_strs])
+        bands = atlas[glyph_indices].transpose(0, 2, 1, 3).reshape(batch_size, cell_height, glyph_count * cell_width)
+        # Each ticket's band starts at its own hashed phase within one repeat of its number
+        offsets = (params["microtext_shift"] * np.array([(len(number_str) + 1) * cell_width for number_str in number_strs])).astype(np.intp)
+        columns = offsets[:, None] + np.arange(width)
+        bands = np.take_along_axis(bands, columns[:, None, :].repeat(cell_height, axis=1), axis=2)
+        bands = np.rint(bands * np.float32(SECURITY_MICROTEXT_OPACITY)).astype(np.uint8)
+        band_rows = underlays[:, band_top:band_top + cell_height, :]
+        np.maximum(band_rows, bands, out=band_rows)
+    return underlays
+
+def iter_security_underlays(variants, num_leading_zeros):
+    """Yields each ticket's underlay mask in render order, evaluating SECURITY_UNDERLAY_BATCH_SIZE tickets per pass."""
+    batch = []
+    for variant in variants:
+        for i in range(variant["first"], variant["last"] + 1):
+            batch.append(str(i).zfill(num_leading_zeros))
+            if len(batch) == SECURITY_UNDERLAY_BATCH_SIZE:
+                yield from security_underlays(batch)
+                batch = []
+    if batch:
+        yield from security_underlays(batch)
+
+def apply_security_underlay(ticket, underlay, keep_mask=None):
+    """Blends an underlay mask into a front in SECURITY_UNDERLAY_COLOR, except where
+    keep_mask is 0 (the template's own text)."""
+    if keep_mask is not None:
+        underlay = np.minimum(underlay, keep_mask)
+    ticket.paste(ink(SECURITY_UNDERLAY_COLOR), (0, 0), Image.fromarray(underlay, "L"))
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def build_front_template(image_path, stub_bg_color, event_title):
+    """Renders everything on a ticket front that does not depend on the ticket number
+    (stub fill, main body image, event title). Cached per variant, so a run with several
+    color-coded ranges renders each variant's template once.
+
+    Returns a dict with the template image and the text colors/geometry that
+    render_front_from_template needs to draw the per-ticket parts.
+    """
+    ticket = Image.new(OUTPUT_COLOR_MODE, (TICKET_WIDTH_PX, TICKET_HEIGHT_PX), ink(BACKGROUND_COLOR))
     draw = ImageDraw.Draw(ticket)
 
     # 1. Define main body area coordinates and dimensions
     # If STUB_WIDTH_PX is 0, main body starts at 0, otherwise it starts after the stub.
     main_body_x_start_coord = STUB_WIDTH_PX if STUB_WIDTH_PX > 0 else 0
-    main_body_actual_width = TICKET_WIDTH_PX - main_body_x_start_coord
-    main_body_actual_height = TICKET_HEIGHT_PX # Main body covers full ticket height
+    main_body_actual_width, main_body_actual_height = main_body_size() # Main body covers full ticket height
 
     # 2. Fill stub background if stub exists
     if STUB_WIDTH_PX > 0:
@@ -153,46 +932,19 @@ def create_ticket_front(number_str, image_path, current_stub_bg_color):
         # Or draw it full and let border overwrite. Let's draw full.
         draw.rectangle(
             [(0, 0), (STUB_WIDTH_PX, TICKET_HEIGHT_PX)], # Covers up to the edge of stub
-            fill=current_stub_bg_color
+            fill=ink(stub_bg_color)
         )
 
     # 3. Load, resize (crop-to-fill), and paste main body image
     image_loaded_successfully = False
     if image_path and main_body_actual_width > 0 and main_body_actual_height > 0:
-        try:
-            img_original = Image.open(image_path).convert("RGB") # Convert to RGB
-
-            img_w, img_h = img_original.size
-            target_w, target_h = main_body_actual_width, main_body_actual_height
-            
-            img_aspect = img_w / img_h
-            target_aspect = target_w / target_h
-
-            if img_aspect > target_aspect: # Image is wider than target aspect (letterbox top/bottom if not cropping, or crop sides)
-                                           # To fill, we resize to match height, then crop width
-                new_h = target_h
-                new_w = int(new_h * img_aspect)
-                img_resized = img_original.resize((new_w, new_h), Image.Resampling.LANCZOS)
-                crop_x_offset = (new_w - target_w) // 2
-                img_to_paste = img_resized.crop((crop_x_offset, 0, crop_x_offset + target_w, new_h))
-            else: # Image is taller or same aspect (pillarbox left/right if not cropping, or crop top/bottom)
-                  # To fill, we resize to match width, then crop height
-                new_w = target_w
-                new_h = int(new_w / img_aspect)
-                img_resized = img_original.resize((new_w, new_h), Image.Resampling.LANCZOS)
-                crop_y_offset = (new_h - target_h) // 2
-                img_to_paste = img_resized.crop((0, crop_y_offset, new_w, crop_y_offset + target_h))
-            
-            # Ensure final pasted image is exactly target dimensions due to potential rounding
-            if img_to_paste.size != (target_w, target_h):
-                img_to_paste = img_to_paste.resize((target_w, target_h), Image.Resampling.LANCZOS)
+        with trace_span("background_paste", {"image_path": image_path}):
+            img_to_paste = PREPARED_BACKGROUNDS.get(image_path, main_body_actual_width, main_body_actual_height)
+            if img_to_paste is not None:
+                ticket.paste(img_to_paste, (main_body_x_start_coord, 0))
+                image_loaded_successfully = True
 
-            ticket.paste(img_to_paste, (main_body_x_start_coord, 0))
-            image_loaded_successfully = True
-        except FileNotFoundError:
-            print(f"Warning: Main image '{image_path}' not found. Main body will show fallback BG_COLOR.")
-        except Exception as e:
-            print(f"Warning: Could not load/resize main image '{image_path}': {e}. Main body will show fallback BG_COLOR.")
+    title_mask = Image.new("L", (TICKET_WIDTH_PX, TICKET_HEIGHT_PX), 0) if SECURITY_UNDERLAY else None
 
     # 4. Determine text color for main body
     # If image loaded, text is MAIN_BODY_TEXT_COLOR_OVER_IMAGE.
@@ -218,58 +970,50 @@ def create_ticket_front(number_str, image_path, current_stub_bg_color):
     if text_content_area_width > 0:
         main_body_text_center_x = text_content_area_x_start + text_content_area_width // 2
 
-        small_font = load_font(TEXT_FONT_SIZE)
+        # The centered title keeps clear of the rotated number's column at the right edge, on both sides
+        title_box_width = max(1, text_content_area_width - 4 * (ROTATED_TEXT_PADDING_PX + RIGHT_SIDE_TEXT_X_OFFSET))
+        title_size, title_lines = fit_text(event_title, TEXT_FONT_SIZE, title_box_width, TITLE_BOX_HEIGHT_PX, TITLE_MAX_LINES)
+        small_font = load_font(title_size)
+        title_text = "\n".join(title_lines)
+        title_anchor = "mt" if len(title_lines) == 1 else "ma" # Multiline text has no "top" anchor
         event_text_y = FRONT_TEXT_TOP_MARGIN_PX # Margin from top of ticket
-        try:
-            draw.text((main_body_text_center_x, event_text_y), EVENT_TITLE, font=small_font, fill=current_main_body_text_color, anchor="mt")
-        except TypeError: # Fallback for older Pillow
-            et_w, _ = draw.textsize(EVENT_TITLE, font=small_font)
-            draw.text((main_body_text_center_x - et_w // 2, event_text_y), EVENT_TITLE, font=small_font, fill=current_main_body_text_color)
-
-        # num_text_y = TICKET_HEIGHT_PX - FRONT_TEXT_BOTTOM_MARGIN_PX # Margin from bottom
-        # try:
-        #     # Draw a small box around the text, fill it white, and set the text color to contrast with the box
-        #     # Get the text size to generate the box
-        #     bbox_num = draw.textbbox((main_body_text_center_x, num_text_y), f"No. {number_str}", font=small_font, anchor="mb")
-        #     num_text_width = bbox_num[2] - bbox_num[0]
-        #     num_text_height = bbox_num[3] - bbox_num[1]
-        #     # Draw a rectangle around the text
-        #     # Adjust the rectangle size to fit the text
-        #     # Draw the rectangle with a small padding
-        #     # draw.rectangle([(main_body_text_center_x - 20, num_text_y - 10), (main_body_text_center_x + 20, num_text_y + 10)], fill=(255, 255, 255))
-        #     draw.rectangle([(bbox_num[0] - 2, bbox_num[1] - 2), (bbox_num[2] + 2, bbox_num[3] + 2)], fill=(255, 255, 255))
-        #     draw.text((main_body_text_center_x, num_text_y), f"No. {number_str}", font=small_font, fill=(0,0,0), anchor="mb")
-        # except TypeError:
-        #     ns_w, ns_h = draw.textsize(f"No. {number_str}", font=small_font)
-        #     draw.text((main_body_text_center_x - ns_w // 2, num_text_y - ns_h), f"No. {number_str}", font=small_font, fill=current_main_body_text_color)
-
-        # Draw the ticket number on the right side of the ticket rotated
-        # Calculate the position for the rotated text
-        # Center point for rotated text
-        rotated_text_center_x = main_body_x_start_coord + main_body_actual_width - ROTATED_TEXT_PADDING_PX
-        
-        rotated_text_center_y = TICKET_HEIGHT_PX // 2
-        # Draw the rotated text
-        draw_rotated_text(ticket, f"No. {number_str}", (rotated_text_center_x - RIGHT_SIDE_TEXT_X_OFFSET, rotated_text_center_y),
-                            small_font, current_main_body_text_color, -ROTATED_NUMBER_ANGLE)
-
-    # 6. Draw Rotated Number on Stub
-    if STUB_WIDTH_PX > 0:
-        number_font = load_font(NUMBER_FONT_SIZE)
-        # Determine text color for stub number based on stub_bg_color
-        stub_number_text_color = get_text_color_for_background(current_stub_bg_color)
-        
-        base_stub_center_x = STUB_WIDTH_PX // 2
-        final_stub_center_x = base_stub_center_x + ROTATED_NUMBER_X_OFFSET_STUB_PX
-        stub_center_y = TICKET_HEIGHT_PX // 2
-        draw_rotated_text(ticket, number_str, (final_stub_center_x, stub_center_y),
-                          number_font, stub_number_text_color, ROTATED_NUMBER_ANGLE)
-
-    # 7. Draw Border and Perforation Line (on top of everything else)
+        title_layers = [(draw, ink(current_main_body_text_color))]
+        if title_mask is not None: # The underlay goes under the title, so it is kept off the title's pixels
+            title_layers.append((ImageDraw.Draw(title_mask), 255))
+        with trace_span("title_draw"):
+            for layer_draw, layer_fill in title_layers:
+                try:
+                    layer_draw.text((main_body_text_center_x, event_text_y), title_text, font=small_font, fill=layer_fill,
+                                    anchor=title_anchor, align="center")
+                except TypeError: # Fallback for older Pillow
+                    et_w, _ = layer_draw.textsize(title_text, font=small_font)
+                    layer_draw.text((main_body_text_center_x - et_w // 2, event_text_y), title_text, font=small_font, fill=layer_fill)
+
+    return {
+        "image": ticket,
+        "main_body_x_start": main_body_x_start_coord,
+        "main_body_width": main_body_actual_width,
+        "has_main_body_text": text_content_area_width > 0,
+        "main_body_text_color": current_main_body_text_color,
+        "stub_text_color": get_text_color_for_background(stub_bg_color),
+        "tile_palette": TilePalette(ticket), # For reduce_tile_mode
+        # 0 on (and one pixel around) the title, 255 elsewhere; see apply_security_underlay
+        "underlay_keep_mask": 255 - np.asarray(title_mask.filter(ImageFilter.MaxFilter(3))) if title_mask is not None else None,
+    }
+
+def front_tile_palette(image_path, stub_bg_color, event_title=None):
+    """The TilePalette of the front template create_ticket_front used for these arguments, or
+    None with SECURITY_UNDERLAY on (see TilePalette)."""
+    if SECURITY_UNDERLAY:
+        return None
+    return build_front_template(image_path, tuple(stub_bg_color), event_title or EVENT_TITLE)["tile_palette"]
+
+def draw_ticket_decorations(draw):
+    """Draws the border and stub perforation line (on top of everything else)."""
     if TICKET_BORDER_WIDTH > 0:
         draw.rectangle(
             [(0,0), (TICKET_WIDTH_PX - 1, TICKET_HEIGHT_PX - 1)], # Draw border within ticket dimensions
-            outline=TICKET_BORDER_COLOR,
+            outline=ink(TICKET_BORDER_COLOR),
             width=TICKET_BORDER_WIDTH
         )
         # Perforation line is drawn at the edge of the stub
@@ -284,19 +1028,79 @@ def create_ticket_front(number_str, image_path, current_stub_bg_color):
             for y_dash in range(y_start_perf, y_end_perf, PERFORATION_DASH_STEP_PX):
                 dash_end_y = min(y_dash + PERFORATION_DASH_LENGTH_PX, y_end_perf)
                 if dash_end_y > y_dash: # Only draw if there's positive length
-                    draw.line([(line_x, y_dash), (line_x, dash_end_y)], fill=TICKET_BORDER_COLOR, width=1) # Width 1 for perforation
+                    draw.line([(line_x, y_dash), (line_x, dash_end_y)], fill=ink(TICKET_BORDER_COLOR), width=1) # Width 1 for perforation
+
+def render_front_from_template(template, number_str, variable_fields=None, overflow_report=None, underlay=None):
+    """Copies a front template and draws the per-ticket parts: the security underlay (if
+    given), the rotated numbers, any variable-data slots, then the border/perforation."""
+    ticket = template["image"].copy()
+    if underlay is not None:
+        with trace_span("security_underlay"):
+            apply_security_underlay(ticket, underlay, template["underlay_keep_mask"])
+    draw = ImageDraw.Draw(ticket)
+
+    with trace_span("rotated_number") as span:
+        pasted_boxes = {}
+        # Rotated text runs along the ticket height; fitted per number width (memoized, see fit_text)
+        rotated_length = TICKET_HEIGHT_PX - 2 * MAIN_BODY_MARGIN_PX
+        if template["has_main_body_text"]:
+            # Draw the ticket number on the right side of the ticket rotated
+            # Calculate the position for the rotated text
+            # Center point for rotated text
+            rotated_text_center_x = template["main_body_x_start"] + template["main_body_width"] - ROTATED_TEXT_PADDING_PX
+            
+            rotated_text_center_y = TICKET_HEIGHT_PX // 2
+            main_number_size, _ = fit_text(f"No. {number_shape(number_str, TEXT_FONT_SIZE)}", TEXT_FONT_SIZE, rotated_length,
+                                           2 * (ROTATED_TEXT_PADDING_PX + RIGHT_SIDE_TEXT_X_OFFSET))
+            # Draw the rotated text
+            main_number_text = f"No. {number_str}"
+            pasted_boxes[main_number_text] = draw_rotated_text(ticket, main_number_text, (rotated_text_center_x - RIGHT_SIDE_TEXT_X_OFFSET, rotated_text_center_y),
+                                                               load_font(main_number_size), ink(template["main_body_text_color"]), -ROTATED_NUMBER_ANGLE)
+
+        # Draw Rotated Number on Stub
+        if STUB_WIDTH_PX > 0:
+            stub_number_size, _ = fit_text(number_shape(number_str, NUMBER_FONT_SIZE), NUMBER_FONT_SIZE, rotated_length,
+                                           STUB_WIDTH_PX - 2 * MAIN_BODY_MARGIN_PX)
+            number_font = load_font(stub_number_size)
+            base_stub_center_x = STUB_WIDTH_PX // 2
+            final_stub_center_x = base_stub_center_x + ROTATED_NUMBER_X_OFFSET_STUB_PX
+            stub_center_y = TICKET_HEIGHT_PX // 2
+            pasted_boxes[number_str] = draw_rotated_text(ticket, number_str, (final_stub_center_x, stub_center_y),
+                                                         number_font, ink(template["stub_text_color"]), ROTATED_NUMBER_ANGLE)
+        if span is not None: # What DEBUG_ROTATED_TEXT used to print, on this span instead of one event per text
+            span.args = {"pasted_boxes": pasted_boxes}
+
+    if variable_fields:
+        with trace_span("variable_slots"):
+            draw_variable_text_slots(draw, "front", variable_fields, template["main_body_text_color"], number_str, overflow_report)
+
+    with trace_span("border_perforation"):
+        draw_ticket_decorations(draw)
     return ticket
 
-def create_ticket_back(number_str):
-    # (This function remains unchanged from the previous version,
-    # but ensure text colors contrast with BACKGROUND_COLOR if it's changed)
-    ticket = Image.new("RGB", (TICKET_WIDTH_PX, TICKET_HEIGHT_PX), BACKGROUND_COLOR)
+def create_ticket_front(number_str, image_path, current_stub_bg_color, event_title=None, variable_fields=None, overflow_report=None,
+                        underlay=None):
+    """image_path may also be a directory, a list of images or a BackgroundRotation; the
+    background for this ticket is then picked from it by number (see BackgroundRotation).
+    With SECURITY_UNDERLAY on, pass the ticket's mask from a batch (iter_security_underlays);
+    otherwise it is rendered here as a batch of one."""
+    image_path = ticket_background(resolve_background_source(image_path), number_str)
+    template = build_front_template(image_path, tuple(current_stub_bg_color), event_title or EVENT_TITLE)
+    if underlay is None and SECURITY_UNDERLAY:
+        underlay = security_underlays([number_str])[0]
+    return render_front_from_template(template, number_str, variable_fields, overflow_report, underlay)
+
+@functools.lru_cache(maxsize=1)
+def build_back_template():
+    """Renders the static part of the ticket back (border, heading, terms) once per run."""
+    # Ensure text colors contrast with BACKGROUND_COLOR if it's changed
+    ticket = Image.new(OUTPUT_COLOR_MODE, (TICKET_WIDTH_PX, TICKET_HEIGHT_PX), ink(BACKGROUND_COLOR))
     draw = ImageDraw.Draw(ticket)
 
     if TICKET_BORDER_WIDTH > 0:
         draw.rectangle(
             [(0,0), (TICKET_WIDTH_PX - 1, TICKET_HEIGHT_PX - 1)],
-            outline=TICKET_BORDER_COLOR,
+            outline=ink(TICKET_BORDER_COLOR),
             width=TICKET_BORDER_WIDTH
         )
 
@@ -305,7 +1109,7 @@ def create_ticket_back(number_str):
     text_y_spacing = TEXT_FONT_SIZE + BACK_TEXT_LINE_SPACING_ADDON_PX
     
     # Determine text color for back based on general BACKGROUND_COLOR
-    back_text_color = get_text_color_for_background(BACKGROUND_COLOR)
+    back_text_color = ink(get_text_color_for_background(BACKGROUND_COLOR))
 
     try:
         draw.text((TICKET_WIDTH_PX // 2, current_y), "TICKET BACK", font=text_font, fill=back_text_color, anchor="mt")
@@ -333,76 +1137,2078 @@ def create_ticket_back(number_str):
 
     x_terms = (TICKET_WIDTH_PX - multiline_width) // 2
     draw.multiline_text((x_terms, current_y), terms_text, font=text_font, fill=back_text_color, align="center", spacing=BACK_MULTILINE_SPACING_PX)
+    return ticket
+
+def create_ticket_back(number_str, variable_fields=None, overflow_report=None, verification_code=None):
+    """With VERIFICATION_KEY set, pass the ticket's code from the run's batch
+    (see ticket_verification_codes); otherwise it is computed here."""
+    if verification_code is None and VERIFICATION_KEY:
+        verification_code = tkt_verify.verification_code(VERIFICATION_KEY, VERIFICATION_EVENT_ID, number_str, VERIFICATION_CODE_LENGTH)
+    with trace_span("back_render"):
+        return _render_back_from_template(number_str, variable_fields, overflow_report, verification_code)
+
+def _render_back_from_template(number_str, variable_fields, overflow_report, verification_code=None):
+    ticket = build_back_template().copy()
+    draw = ImageDraw.Draw(ticket)
+    back_text_color = get_text_color_for_background(BACKGROUND_COLOR)
 
+    serial_text = f"Serial: {number_str}"
+    serial_shape = f"Serial: {number_shape(number_str, TEXT_FONT_SIZE)}"
+    if verification_code:
+        serial_text += f"   Code: {verification_code}"
+        serial_shape += f"   Code: {widest_character(tkt_verify.CODE_ALPHABET, TEXT_FONT_SIZE) * len(verification_code)}"
+    serial_size, _ = fit_text(serial_shape, TEXT_FONT_SIZE, TICKET_WIDTH_PX - 2 * MAIN_BODY_MARGIN_PX, TICKET_HEIGHT_PX)
+    text_font = load_font(serial_size)
     serial_y_pos_from_bottom = TICKET_HEIGHT_PX - BACK_SERIAL_BOTTOM_MARGIN_PX
     try:
-        draw.text((TICKET_WIDTH_PX // 2, serial_y_pos_from_bottom), f"Serial: {number_str}", font=text_font, fill=back_text_color, anchor="mb")
+        draw.text((TICKET_WIDTH_PX // 2, serial_y_pos_from_bottom), serial_text, font=text_font, fill=ink(back_text_color), anchor="mb")
     except TypeError:
-        sn_w, sn_h = draw.textsize(f"Serial: {number_str}", font=text_font)
-        draw.text(((TICKET_WIDTH_PX - sn_w) // 2, serial_y_pos_from_bottom - sn_h), f"Serial: {number_str}", font=text_font, fill=back_text_color)
+        sn_w, sn_h = draw.textsize(serial_text, font=text_font)
+        draw.text(((TICKET_WIDTH_PX - sn_w) // 2, serial_y_pos_from_bottom - sn_h), serial_text, font=text_font, fill=ink(back_text_color))
+
+    if variable_fields:
+        draw_variable_text_slots(draw, "back", variable_fields, back_text_color, number_str, overflow_report)
     
     return ticket
 
-# --- PDF Generation Function (generate_pdf_from_images - unchanged from previous) ---
+# --- Variable Data Merge ---
+
+def fit_text_to_width(text, font, max_width):
+    """Returns text, truncated with '...' if needed so it fits max_width. Second value is True if it was truncated."""
+    if font.getlength(text) <= max_width:
+        return text, False
+    while text and font.getlength(text + "...") > max_width:
+        text = text[:-1]
+    return text + "...", True
+
+def draw_variable_text_slots(draw, side, variable_fields, text_color, number_str, overflow_report=None):
+    """Draws each field whose slot is on `side`, centered in the slot box and shrunk to fit
+    (see fit_text). Text too wide or tall for its box even at MIN_FIT_FONT_SIZE is truncated
+    and recorded in overflow_report rather than aborting the run."""
+    for slot_name, text in variable_fields.items():
+        slot = VARIABLE_TEXT_SLOTS[slot_name]
+        if slot["side"] != side:
+            continue
+        left, top, right, bottom = (int(v * SCALE_FACTOR) for v in slot["orig_box"])
+        font = load_font(fit_text(text, TEXT_FONT_SIZE, right - left, bottom - top)[0])
+        fitted_text, truncated = fit_text_to_width(text, font, right - left)
+        text_bbox = font.getbbox(fitted_text)
+        if truncated or (text_bbox[3] - text_bbox[1]) > (bottom - top):
+            if overflow_report is not None:
+                overflow_report.add(number_str, slot_name, text)
+        draw.text(((left + right) // 2, (top + bottom) // 2), fitted_text, font=font, fill=ink(text_color), anchor="mm")
+
+def iter_variable_data_rows(csv_path):
+    """Streams rows of a variable-data CSV as {slot_name: text} dicts, one row at a time.
+
+    Columns named after a slot in VARIABLE_TEXT_SLOTS (or renamed through
+    VARIABLE_DATA_COLUMN_MAP) are merged; the VARIABLE_DATA_NUMBER_COLUMN value, if
+    present, is passed through under that key for checking.
+    """
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        column_to_slot = {}
+        for column in reader.fieldnames or []:
+            slot_name = VARIABLE_DATA_COLUMN_MAP.get(column, column)
+            if slot_name in VARIABLE_TEXT_SLOTS or column == VARIABLE_DATA_NUMBER_COLUMN:
+                column_to_slot[column] = slot_name
+            else:
+                print(f"Warning: Variable-data column '{column}' does not match a text slot and will be ignored.")
+        for row in reader:
+            yield {slot_name: row[column] for column, slot_name in column_to_slot.items() if row.get(column)}
+
+def variable_row_number_problem(row_number, number):
+    """Checks a row's VARIABLE_DATA_NUMBER_COLUMN value against the ticket it lands on,
+    numerically, so "42" matches ticket 00042. Returns the report slot name of the problem,
+    or None if the row matches (or has no number)."""
+    if row_number is None:
+        return None
+    try:
+        row_value = int(row_number.strip())
+    except ValueError:
+        return f"{VARIABLE_DATA_NUMBER_COLUMN} (not a number)"
+    return None if row_value == number else VARIABLE_DATA_NUMBER_COLUMN
+
+class VariableDataOverflowReport:
+    """Collects variable-data problems (text overflowing its slot, rows for the wrong ticket)
+    and streams them to a CSV, so a run with many bad rows keeps constant memory."""
+
+    def __init__(self, output_filename):
+        self.output_filename = output_filename
+        self.issue_count = 0
+        self._file = None
+        self._writer = None
+
+    def add(self, number_str, slot_name, text):
+        if self._file is None:
+            self._file = open(self.output_filename, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(("ticket_number", "slot", "text"))
+        self._writer.writerow((number_str, slot_name, text))
+        self.issue_count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            print(f"Warning: {self.issue_count} variable-data fields did not fit or did not match their ticket. See {self.output_filename}")
+
+# --- Sheet Packing ---
+
+class SheetLayout:
+    """Ticket slots on one side of a sheet, in points from the top-left page corner.
+
+    Each slot is (x_pt, y_pt, rotated); a rotated slot holds the ticket turned 90 degrees,
+    so it is ticket_height_pt wide. Backs go to the mirror image of their front slot (the
+    sheet turns over around its vertical axis), which keeps duplex registration exact for
+    any arrangement, not only for symmetric grids.
+    """
+
+    def __init__(self, page_width_pt, page_height_pt, ticket_width_pt, ticket_height_pt, slots, description):
+        self.page_width_pt = page_width_pt
+        self.page_height_pt = page_height_pt
+        self.ticket_width_pt = ticket_width_pt
+        self.ticket_height_pt = ticket_height_pt
+        self.slots = list(slots)
+        self.description = description
+        self.tickets_per_sheet = len(self.slots)
+        self.orientation = 'L' if page_width_pt > page_height_pt else 'P'
+        # (row, col) of every slot on the front and on the back page, counted from the top-left
+        self.slot_labels = _slot_labels([self.placement(i)[:2] for i in range(len(self.slots))])
+        self.back_slot_labels = _slot_labels([self.placement(i, back=True)[:2] for i in range(len(self.slots))])
+
+    def placement(self, slot_index, back=False):
+        """(x_pt, y_pt, width_pt, height_pt, angle) of the box a ticket image fills.
+        angle is the counter-clockwise rotation of the image, reversed on the back."""
+        x_pt, y_pt, rotated = self.slots[slot_index]
+        width_pt, height_pt = (self.ticket_height_pt, self.ticket_width_pt) if rotated else (self.ticket_width_pt, self.ticket_height_pt)
+        angle = 90 if rotated else 0
+        if back:
+            x_pt = self.page_width_pt - x_pt - width_pt
+            angle = -angle
+        return x_pt, y_pt, width_pt, height_pt, angle
+
+    def rotated_count(self):
+        return sum(1 for _, _, rotated in self.slots if rotated)
+
+def _slot_labels(positions):
+    """Row = rank of the slot's top edge, col = rank of its left edge within that row."""
+    row_tops = sorted({round(y_pt, 2) for _, y_pt in positions})
+    labels = []
+    for x_pt, y_pt in positions:
+        row_top = round(y_pt, 2)
+        same_row_lefts = sorted(round(other_x, 2) for other_x, other_y in positions if round(other_y, 2) == row_top)
+        labels.append((row_tops.index(row_top), same_row_lefts.index(round(x_pt, 2))))
+    return labels
+
+def page_size_pt(page_format=None, orientation=None):
+    """(width, height) in points of a PDF_PAGE_SIZES_PT name or a (width, height) tuple."""
+    page_format = page_format or PDF_PAGE_FORMAT
+    short_pt, long_pt = sorted(PDF_PAGE_SIZES_PT[page_format.lower()] if isinstance(page_format, str) else page_format)
+    return (long_pt, short_pt) if (orientation or PDF_PAGE_ORIENTATION) == 'L' else (short_pt, long_pt)
+
+def ticket_size_pt():
+    return TICKET_WIDTH_PX * 72.0 / EFFECTIVE_DPI_FOR_CONVERSION, TICKET_HEIGHT_PX * 72.0 / EFFECTIVE_DPI_FOR_CONVERSION
+
+def grid_sheet_layout():
+    """The fixed PDF_TICKETS_PER_ROW x PDF_TICKETS_PER_COL grid: rows centered, top-aligned."""
+    page_width_pt, page_height_pt = page_size_pt()
+    ticket_width_pt, ticket_height_pt = ticket_size_pt()
+    page_content_width_pt = page_width_pt - 2 * PDF_MARGIN_PT
+    page_content_height_pt = page_height_pt - 2 * PDF_MARGIN_PT
+    total_width_of_row_pt = (PDF_TICKETS_PER_ROW * ticket_width_pt) + \
+                            ((PDF_TICKETS_PER_ROW - 1) * PDF_SPACING_PT if PDF_TICKETS_PER_ROW > 1 else 0)
+    total_height_of_block_pt = (PDF_TICKETS_PER_COL * ticket_height_pt) + \
+                               ((PDF_TICKETS_PER_COL - 1) * PDF_SPACING_PT if PDF_TICKETS_PER_COL > 1 else 0)
+    if total_width_of_row_pt > page_content_width_pt:
+        print(f"Warning: Ticket block width ({total_width_of_row_pt:.2f}pt) exceeds PDF content width ({page_content_width_pt:.2f}pt).")
+    if total_height_of_block_pt > page_content_height_pt:
+        print(f"Warning: Ticket block height ({total_height_of_block_pt:.2f}pt) exceeds PDF content height ({page_content_height_pt:.2f}pt).")
+
+    x_offset_for_centering_pt = (page_content_width_pt - total_width_of_row_pt) / 2
+    slots = [
+        (PDF_MARGIN_PT + x_offset_for_centering_pt + col_num * (ticket_width_pt + PDF_SPACING_PT),
+         PDF_MARGIN_PT + row_num * (ticket_height_pt + PDF_SPACING_PT), False)
+        for row_num in range(PDF_TICKETS_PER_COL) for col_num in range(PDF_TICKETS_PER_ROW)
+    ]
+    return SheetLayout(page_width_pt, page_height_pt, ticket_width_pt, ticket_height_pt, slots,
+                       f"fixed {PDF_TICKETS_PER_ROW}x{PDF_TICKETS_PER_COL} grid")
+
+def _grid_fit(region_width_pt, region_height_pt, item_width_pt, item_height_pt, spacing_pt):
+    """(cols, rows) of item-sized boxes that fit in a region with spacing between them."""
+    if item_width_pt > region_width_pt or item_height_pt > region_height_pt:
+        return 0, 0
+    return (int((region_width_pt + spacing_pt) // (item_width_pt + spacing_pt)),
+            int((region_height_pt + spacing_pt) // (item_height_pt + spacing_pt)))
+
+def _best_region_grid(region_width_pt, region_height_pt, ticket_width_pt, ticket_height_pt, spacing_pt, allow_rotation):
+    """Best single-orientation grid for a free region: (count, rotated, cols, rows)."""
+    best = (0, False, 0, 0)
+    for rotated in ((False, True) if allow_rotation else (False,)):
+        item_width_pt, item_height_pt = (ticket_height_pt, ticket_width_pt) if rotated else (ticket_width_pt, ticket_height_pt)
+        cols, rows = _grid_fit(region_width_pt, region_height_pt, item_width_pt, item_height_pt, spacing_pt)
+        if cols * rows > best[0]:
+            best = (cols * rows, rotated, cols, rows)
+    return best
+
+def plan_sheet_layout(page_format=None, margin_pt=None, spacing_pt=None, ticket_size=None,
+                      allow_rotation=None, allow_page_rotation=None):
+    """Finds the arrangement with the most tickets per sheet (and so the fewest sheets).
+
+    Tries both page orientations and, for each, a main grid of upright or rotated tickets
+    of every size that fits, with the leftover strips to its right and below filled by
+    whichever orientation fits more (both guillotine cuts: right strip full height, or
+    bottom strip full width). Ties go to the configured PDF_PAGE_ORIENTATION, then to fewer
+    rotated tickets, then to the largest main grid. Spacing between tickets is kept
+    everywhere, including strips. Slots are numbered in reading order.
+    """
+    margin_pt = PDF_MARGIN_PT if margin_pt is None else margin_pt
+    spacing_pt = PDF_SPACING_PT if spacing_pt is None else spacing_pt
+    ticket_width_pt, ticket_height_pt = ticket_size or ticket_size_pt()
+    allow_rotation = PDF_LAYOUT_ALLOW_ROTATED_TICKETS if allow_rotation is None else allow_rotation
+    allow_page_rotation = PDF_LAYOUT_ALLOW_PAGE_ROTATION if allow_page_rotation is None else allow_page_rotation
+    orientations = [PDF_PAGE_ORIENTATION] + ([('L' if PDF_PAGE_ORIENTATION == 'P' else 'P')] if allow_page_rotation else [])
+
+    best_key, best_plan = None, None
+    for orientation_rank, orientation in enumerate(orientations):
+        page_width_pt, page_height_pt = page_size_pt(page_format, orientation)
+        content_width_pt = page_width_pt - 2 * margin_pt
+        content_height_pt = page_height_pt - 2 * margin_pt
+        for main_rotated in ((False, True) if allow_rotation else (False,)):
+            main_width_pt, main_height_pt = (ticket_height_pt, ticket_width_pt) if main_rotated else (ticket_width_pt, ticket_height_pt)
+            max_cols, max_rows = _grid_fit(content_width_pt, content_height_pt, main_width_pt, main_height_pt, spacing_pt)
+            for cols in range(1, max_cols + 1):
+                for rows in range(1, max_rows + 1):
+                    block_width_pt = cols * main_width_pt + (cols - 1) * spacing_pt
+                    block_height_pt = rows * main_height_pt + (rows - 1) * spacing_pt
+                    right_width_pt = content_width_pt - block_width_pt - spacing_pt
+                    bottom_height_pt = content_height_pt - block_height_pt - spacing_pt
+                    for right_strip_full_height in (True, False):
+                        right_region = (block_width_pt + spacing_pt, 0, right_width_pt,
+                                        content_height_pt if right_strip_full_height else block_height_pt)
+                        bottom_region = (0, block_height_pt + spacing_pt,
+                                         block_width_pt if right_strip_full_height else content_width_pt, bottom_height_pt)
+                        regions = [((0, 0), (cols * rows, main_rotated, cols, rows))]
+                        for region_x, region_y, region_w, region_h in (right_region, bottom_region):
+                            regions.append(((region_x, region_y), _best_region_grid(
+                                region_w, region_h, ticket_width_pt, ticket_height_pt, spacing_pt, allow_rotation)))
+                        count = sum(grid[0] for _, grid in regions)
+                        rotated = sum(grid[0] for _, grid in regions if grid[1])
+                        key = (count, -orientation_rank, -rotated, cols * rows)
+                        if best_key is None or key > best_key:
+                            best_key, best_plan = key, (orientation, content_width_pt, regions)
+
+    if best_key is None or best_key[0] == 0:
+        print("Warning: The ticket does not fit on the page in any orientation. Using the fixed grid.")
+        return grid_sheet_layout()
+    orientation, content_width_pt, regions = best_plan
+    page_width_pt, page_height_pt = page_size_pt(page_format, orientation)
+    slots = []
+    for (region_x, region_y), (count, rotated, cols, rows) in regions:
+        item_width_pt, item_height_pt = (ticket_height_pt, ticket_width_pt) if rotated else (ticket_width_pt, ticket_height_pt)
+        for row_num in range(rows):
+            for col_num in range(cols):
+                slots.append((region_x + col_num * (item_width_pt + spacing_pt),
+                              region_y + row_num * (item_height_pt + spacing_pt), rotated))
+
+    # Center the packed block horizontally like the fixed grid, top-aligned at the margin
+    block_right_pt = max(x_pt + (ticket_height_pt if rotated else ticket_width_pt) for x_pt, _, rotated in slots)
+    x_offset_pt = margin_pt + (content_width_pt - block_right_pt) / 2
+    slots = sorted(((x_pt + x_offset_pt, y_pt + margin_pt, rotated) for x_pt, y_pt, rotated in slots),
+                   key=lambda slot: (round(slot[1], 2), round(slot[0], 2)))
+    main_count, main_rotated, main_cols, main_rows = regions[0][1]
+    description = f"optimized {main_cols}x{main_rows}{' rotated' if main_rotated else ''}"
+    if len(slots) > main_count:
+        description += f" + {len(slots) - main_count} in leftover strips"
+    description += f", {'landscape' if orientation == 'L' else 'portrait'} page"
+    return SheetLayout(page_width_pt, page_height_pt, ticket_width_pt, ticket_height_pt, slots, description)
+
+def active_sheet_layout():
+    """The layout every writer and the manifest use; the fixed grid unless use_sheet_layout() was called."""
+    global ACTIVE_SHEET_LAYOUT
+    if ACTIVE_SHEET_LAYOUT is None:
+        ACTIVE_SHEET_LAYOUT = grid_sheet_layout()
+    return ACTIVE_SHEET_LAYOUT
+
+def use_sheet_layout(layout):
+    global ACTIVE_SHEET_LAYOUT
+    ACTIVE_SHEET_LAYOUT = layout
+
+def tickets_per_sheet():
+    return active_sheet_layout().tickets_per_sheet
+
+def report_sheet_layout(layout, grid_layout, total_tickets):
+    """Prints the chosen layout and how many sheets it saves over the fixed grid."""
+    sheets = math.ceil(total_tickets / layout.tickets_per_sheet)
+    grid_sheets = math.ceil(total_tickets / grid_layout.tickets_per_sheet)
+    print(f"Sheet layout: {layout.description}: {layout.tickets_per_sheet} tickets per sheet, {sheets} sheets "
+          f"({grid_layout.description}: {grid_layout.tickets_per_sheet} per sheet, {grid_sheets} sheets; "
+          f"{grid_sheets - sheets} sheets saved)")
+    if layout.orientation == 'L':
+        print("  Note: landscape pages - set the printer to flip on the short edge so backs register.")
+
+# --- PDF Generation ---
+
+class TilePalette:
+    """An exact palette for the RGB tiles rendered from one template, built once per
+    template (see build_front_template and back_tile_palette) so reduce_tile_mode neither
+    counts each tile's colors nor maps every pixel.
+
+    The template's pixels are mapped to palette indices here; a tile only has its pixels
+    that differ from the template (the number, border and slots) looked up, by binary
+    search in the sorted color keys. Colors a ticket adds are appended to the palette (each
+    tile's own palette carries only the ones it uses); once it is full, a tile is mapped to
+    the template's colors plus its own. A tile that needs more than 256 stays RGB, as does
+    every tile of a photo template.
+    Tiles with a security underlay differ from the template everywhere, so they are
+    reduced without one (see front_tile_palette).
+    """
+
+    def __init__(self, template_image):
+        self._lock = threading.Lock()
+        self._state = None # (palette keys, the same sorted, palette index of each sorted key)
+        colors = template_image.getcolors(256) if np is not None and template_image.mode == "RGB" else None
+        if colors is None:
+            return
+        self._template_keys = packed_rgb(template_image)
+        palette_keys, template_indices = np.unique(self._template_keys, return_inverse=True)
+        self._template_indices = template_indices.reshape(self._template_keys.shape).astype(np.uint8)
+        self._template_color_count = len(palette_keys)
+        self._template_gray, self._template_bilevel = gray_levels(palette_keys)
+        self._state = self._lookup_state(palette_keys)
+
+    @staticmethod
+    def _lookup_state(palette_keys):
+        order = np.argsort(palette_keys)
+        return palette_keys, palette_keys[order], order.astype(np.uint8)
+
+    def reduce(self, pil_image):
+        state = self._state
+        if state is None:
+            return pil_image
+        pixel_keys = packed_rgb(pil_image)
+        changed = pixel_keys != self._template_keys
+        changed_keys = pixel_keys[changed]
+        palette_keys, sorted_keys, sorted_indices = state
+        positions = np.minimum(np.searchsorted(sorted_keys, changed_keys), len(sorted_keys) - 1)
+        missing = sorted_keys[positions] != changed_keys
+        if missing.any():
+            with self._lock: # Another tile may have grown the palette meanwhile
+                palette_keys = self._state[0]
+                new_keys = np.setdiff1d(changed_keys[missing], palette_keys)
+                if len(palette_keys) + len(new_keys) <= 256:
+                    self._state = state = self._lookup_state(np.concatenate((palette_keys, new_keys)))
+            if len(palette_keys) + len(new_keys) > 256: # Full; this tile gets the template's colors plus its own
+                template_keys = palette_keys[:self._template_color_count]
+                tile_keys = np.concatenate((template_keys, np.setdiff1d(changed_keys, template_keys)))
+                if len(tile_keys) > 256:
+                    return pil_image
+                state = self._lookup_state(tile_keys)
+            palette_keys, sorted_keys, sorted_indices = state
+            positions = np.searchsorted(sorted_keys, changed_keys)
+        changed_gray, changed_bilevel = gray_levels(changed_keys)
+        if self._template_gray and changed_gray:
+            if self._template_bilevel and changed_bilevel:
+                return pil_image.convert("1", dither=Image.Dither.NONE)
+            return pil_image.convert("L")
+        # The tile's palette is the template's colors followed by only the added colors it uses, in
+        # key order, so it does not depend on which tickets were rendered before (sharded runs match)
+        changed_indices = sorted_indices[positions]
+        template_color_count = self._template_color_count
+        added_indices = np.unique(changed_indices[changed_indices >= template_color_count])
+        added_indices = added_indices[np.argsort(palette_keys[added_indices])]
+        tile_indices = np.arange(256, dtype=np.uint8)
+        tile_indices[added_indices] = np.arange(template_color_count, template_color_count + len(added_indices))
+        indices = self._template_indices.copy()
+        indices[changed] = tile_indices[changed_indices]
+        tile_keys = np.concatenate((palette_keys[:template_color_count], palette_keys[added_indices]))
+        paletted = Image.fromarray(indices, "P")
+        paletted.putpalette(np.stack([tile_keys & 0xFF, (tile_keys >> 8) & 0xFF, tile_keys >> 16], axis=1).astype(np.uint8).tobytes())
+        return paletted
+
+def packed_rgb(pil_image):
+    """Each pixel's R | G<<8 | B<<16 as a uint32 array."""
+    return np.asarray(pil_image.convert("RGBX")).view("<u4")[..., 0] & 0xFFFFFF
+
+def gray_levels(keys):
+    """(all gray, all black or white) for packed RGB keys."""
+    red, green, blue = keys & 0xFF, (keys >> 8) & 0xFF, keys >> 16
+    gray = bool((red == green).all() and (green == blue).all())
+    return gray, gray and bool(((red == 0) | (red == 255)).all())
+
+@functools.lru_cache(maxsize=1)
+def back_tile_palette():
+    return TilePalette(build_back_template())
+
+def reduce_tile_mode(pil_image, tile_palette=None):
+    """Returns pil_image in the smallest pixel mode that reproduces it exactly.
+
+    Backs (white, black/gray text and border) come out as 8-bit grayscale, or 1-bit when
+    they are purely black and white; flat-color fronts without a photo become a palette
+    image. Anything with more than 256 colors (a photo) stays RGB. CMYK tiles printed with
+    black ink only (the backs) become grayscale, everything else stays CMYK. Pass the
+    TilePalette of the tile's template; without one (or numpy) the tile's colors are
+    counted with getcolors() and only the grayscale modes are tried.
+    """
+    if pil_image.mode == "CMYK":
+        cyan, magenta, yellow, black = pil_image.split()
+        if cyan.getextrema() == magenta.getextrema() == yellow.getextrema() == (0, 0):
+            gray = black.point(lambda k: 255 - k)
+            if all(value in (0, 255) for _, value in gray.getcolors(256)):
+                return gray.convert("1", dither=Image.Dither.NONE)
+            return gray
+        return pil_image
+    if pil_image.mode != "RGB":
+        return pil_image
+    if tile_palette is not None and np is not None:
+        return tile_palette.reduce(pil_image)
+    colors = pil_image.getcolors(256)
+    if colors is not None and all(r == g == b for _, (r, g, b) in colors):
+        if all(r in (0, 255) for _, (r, _, _) in colors):
+            return pil_image.convert("1", dither=Image.Dither.NONE)
+        return pil_image.convert("L")
+    return pil_image
+
+def compress_image_stream(pil_image, level):
+    """Deflates a tile into a ready-to-embed PDF image stream (each row prefixed with PNG
+    filter byte 0, /Predictor 15) at a chosen level; safe to run in a worker
+    thread. RGB, CMYK, L, 1 and P tiles are embedded as DeviceRGB, DeviceCMYK, 8-bit
+    DeviceGray, 1-bit DeviceGray and Indexed images respectively.
+
+    Returns (image, raw_bytes, compressed_bytes, seconds), where image is a dict with
+    data, width, height, color_space, bits_per_component, colors and palette.
+    """
+    with trace_span("encode"):
+        return _deflate_tile(pil_image, level)
+
+def _deflate_tile(pil_image, level):
+    start_time = time.perf_counter()
+    if pil_image.mode not in ("RGB", "CMYK", "L", "1", "P"):
+        pil_image = pil_image.convert("RGB")
+    width, height = pil_image.size
+    palette = None
+    if pil_image.mode == "RGB":
+        color_space, colors, bits_per_component, row_size = "DeviceRGB", 3, 8, width * 3
+    elif pil_image.mode == "CMYK":
+        color_space, colors, bits_per_component, row_size = "DeviceCMYK", 4, 8, width * 4
+    elif pil_image.mode == "L":
+        color_space, colors, bits_per_component, row_size = "DeviceGray", 1, 8, width
+    elif pil_image.mode == "1":
+        color_space, colors, bits_per_component, row_size = "DeviceGray", 1, 1, (width + 7) // 8
+    else:
+        color_space, colors, bits_per_component, row_size = "Indexed", 1, 8, width
+        palette = bytes(pil_image.getpalette()[:3 * 256])
+    raw = pil_image.tobytes()
+    rows = b"".join(b"\0" + raw[i:i + row_size] for i in range(0, len(raw), row_size))
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 9)
+    data = compressor.compress(rows) + compressor.flush()
+    image = {
+        "data": data, "width": width, "height": height, "color_space": color_space,
+        "bits_per_component": bits_per_component, "colors": colors, "palette": palette,
+    }
+    return image, len(rows), len(data), time.perf_counter() - start_time
+
+def pdf_image_dictionary(image, color_space=None, pdf=None):
+    """The image XObject dictionary entries (without /Length) for a compress_image_stream image.
+    `color_space` overrides the device color space, e.g. with an ICCBased reference. With a
+    compact `pdf` the decode parameters, identical for every tile of a run, are one shared
+    object and the optional /Type is left out."""
+    if color_space is None and image["palette"] is not None:
+        color_space = f"[/Indexed /DeviceRGB {len(image['palette']) // 3 - 1} <{image['palette'].hex()}>]"
+    elif color_space is None:
+        color_space = "/" + image["color_space"]
+    decode_parms = (f"<< /Predictor 15 /Colors {image['colors']} /BitsPerComponent {image['bits_per_component']} "
+                    f"/Columns {image['width']} >>")
+    if pdf is not None and pdf.compact:
+        return (f"/Subtype /Image /Width {image['width']} /Height {image['height']} /ColorSpace {color_space} "
+                f"/BitsPerComponent {image['bits_per_component']} /Filter /FlateDecode "
+                f"/DecodeParms {pdf.shared_object(decode_parms)} 0 R")
+    return (f"/Type /XObject /Subtype /Image /Width {image['width']} /Height {image['height']} "
+            f"/ColorSpace {color_space} /BitsPerComponent {image['bits_per_component']} /Filter /FlateDecode "
+            f"/DecodeParms {decode_parms}")
+
+def image_placement_matrix(placement, page_height_pt, image_width_pt, image_height_pt):
+    """PDF `cm` operands that draw the unit-square image into a SheetLayout placement.
+
+    Layout coordinates are from the top-left; PDF user space is from the bottom-left. A
+    rotated slot gets the upright image centered on the slot and turned about that center.
+    """
+    x_pt, y_pt, width_pt, height_pt, angle = placement
+    center_x_pt = x_pt + width_pt / 2
+    center_y_pt = page_height_pt - (y_pt + height_pt / 2)
+    cos_a, sin_a = round(math.cos(math.radians(angle)), 9), round(math.sin(math.radians(angle)), 9)
+    return (
+        image_width_pt * cos_a, image_width_pt * sin_a, -image_height_pt * sin_a, image_height_pt * cos_a,
+        center_x_pt - (image_width_pt * cos_a - image_height_pt * sin_a) / 2,
+        center_y_pt - (image_width_pt * sin_a + image_height_pt * cos_a) / 2,
+    )
+
+def pdf_cmyk_color_space(pdf, image):
+    """The output ICC profile's color space for CMYK images when one is configured, else None (DeviceCMYK)."""
+    if image["color_space"] == "DeviceCMYK" and CMYK_ICC_PROFILE_PATH:
+        return pdf.icc_color_space(CMYK_ICC_PROFILE_PATH)
+    return None
+
+class StreamingPdfFile:
+    """Minimal PDF writer that puts every object on disk as soon as it is complete.
+
+    Only the byte offset of each object (and the object number of each page, for the page
+    tree) stays in memory, 8 bytes apiece in an array; the xref table and trailer are
+    written by close(). Object numbers can be reserved before the object is written, so
+    pages can point at the page tree that is only written at the end. `output` is a
+    filename or an already open binary file (e.g. BytesIO), which close() leaves open.
+
+    With compact=True (see PDF_COMPACT_STRUCTURE) non-stream objects are collected into
+    compressed object streams of PDF_OBJECT_STREAM_SIZE, close() writes a cross-reference
+    stream, and pages are grouped page_group_size at a time under page tree leaves that
+    hold the group's shared resources (image names must be unique within a group). The
+    leaves are written as they fill; only the small upper levels wait for close().
+
+    With first_object set the file is a chunk of a sharded run: no header, object numbers
+    start at first_object (object 1 stays the page tree, written by the merge), and
+    close() writes the chunk's object offsets and page ids to <output>.idx instead of the
+    page tree and xref. append_chunk() on the merged file picks them up, so the merged
+    bytes are the same as one writer producing every page.
+    """
+
+    def __init__(self, output, compact=False, page_group_size=1, first_object=None):
+        self._owns_file = isinstance(output, str)
+        self._file = open(output, "wb", buffering=1024 * 1024) if self._owns_file else output
+        self.compact = compact
+        self.chunk_filename = output if first_object is not None else None
+        if first_object is not None:
+            if compact or not self._owns_file:
+                raise ValueError("PDF chunks are written to a file with the classic structure.")
+            self._object_base = first_object
+            self._offsets = array.array("q") # Index = object number - first_object
+        else:
+            self._object_base = 0
+            self._offsets = array.array("q", [0]) # Index = object number; object 0 is the free-list head
+            self._file.write(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n" if compact else b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self.page_ids = array.array("q")
+        if compact:
+            # Per object: 0 if written directly, else the object stream holding it (its index is in _offsets)
+            self._containers = array.array("q", [0])
+            self._pending_objects = []
+            self.page_group_size = page_group_size
+            self._leaf = None # Page tree leaf being filled: {"id", "parent", "kids", "xobjects"}
+            self._upper_nodes = [] # [node id, kid ids, page count] of the level above the leaves
+            self.page_count = 0
+        if compact:
+            self.pages_id = None
+        else:
+            self.pages_id = 1 if first_object is not None else self.reserve_object()
+        self._icc_color_spaces = {}
+        self._shared_objects = {}
+
+    def reserve_object(self):
+        self._offsets.append(0)
+        if self.compact:
+            self._containers.append(0)
+        return self._object_base + len(self._offsets) - 1
+
+    def write_object(self, obj_id, body):
+        if self.compact:
+            self._pending_objects.append((obj_id, body))
+            if len(self._pending_objects) >= PDF_OBJECT_STREAM_SIZE:
+                self._flush_object_stream()
+            return
+        self._offsets[obj_id - self._object_base] = self._file.tell()
+        self._file.write(f"{obj_id} 0 obj\n".encode("ascii"))
+        self._file.write(body)
+        self._file.write(b"\nendobj\n")
+
+    def _flush_object_stream(self):
+        if not self._pending_objects:
+            return
+        stream_id = self.reserve_object()
+        index_entries, bodies, offset = [], [], 0
+        for index, (obj_id, body) in enumerate(self._pending_objects):
+            index_entries.append(f"{obj_id} {offset}")
+            bodies.append(body)
+            offset += len(body) + 1
+            self._offsets[obj_id] = index
+            self._containers[obj_id] = stream_id
+        index_bytes = " ".join(index_entries).encode("ascii") + b"\n"
+        self.write_stream(stream_id, f"/Type /ObjStm /N {len(self._pending_objects)} /First {len(index_bytes)} /Filter /FlateDecode",
+                          zlib.compress(index_bytes + b"\n".join(bodies) + b"\n"))
+        self._pending_objects = []
+
+    def write_stream(self, obj_id, dictionary, data):
+        self._offsets[obj_id - self._object_base] = self._file.tell()
+        self._file.write(f"{obj_id} 0 obj\n<< {dictionary} /Length {len(data)} >>\nstream\n".encode("ascii"))
+        self._file.write(data)
+        self._file.write(b"\nendstream\nendobj\n")
+
+    def add_stream(self, dictionary, data):
+        obj_id = self.reserve_object()
+        self.write_stream(obj_id, dictionary, data)
+        return obj_id
+
+    def shared_object(self, body):
+        """The object number of a small object with this body (a str), written once per file."""
+        if body not in self._shared_objects:
+            obj_id = self.reserve_object()
+            self.write_object(obj_id, body.encode("ascii"))
+            self._shared_objects[body] = obj_id
+        return self._shared_objects[body]
+
+    def icc_color_space(self, icc_path, components=4):
+        """An ICCBased color space for icc_path; the profile is embedded once per file."""
+        if icc_path not in self._icc_color_spaces:
+            with open(icc_path, "rb") as f:
+                icc_data = zlib.compress(f.read())
+            alternate = {1: "DeviceGray", 3: "DeviceRGB", 4: "DeviceCMYK"}[components]
+            icc_id = self.add_stream(f"/N {components} /Alternate /{alternate} /Filter /FlateDecode", icc_data)
+            self._icc_color_spaces[icc_path] = f"[/ICCBased {icc_id} 0 R]"
+        return self._icc_color_spaces[icc_path]
+
+    def add_page(self, width_pt, height_pt, content, xobjects):
+        """Writes a finished page: its content stream and the page object. xobjects maps
+        resource names to image object numbers."""
+        content_id = self.add_stream("/Filter /FlateDecode", zlib.compress(content))
+        page_id = self.reserve_object()
+        if self.compact:
+            parent_id = self._add_to_page_group(page_id, xobjects)
+            resources = "" # Inherited from the page tree leaf
+        else:
+            parent_id = self.pages_id
+            names = " ".join(f"/{name} {obj_id} 0 R" for name, obj_id in xobjects.items())
+            resources = f"/Resources << /XObject << {names} >> >> "
+        self.write_object(page_id, (
+            f"<< /Type /Page /Parent {parent_id} 0 R /MediaBox [0 0 {width_pt:.2f} {height_pt:.2f}] "
+            f"{resources}/Contents {content_id} 0 R >>").encode("ascii"))
+        self.page_ids.append(page_id)
+
+    def _add_to_page_group(self, page_id, xobjects):
+        if self._leaf is None:
+            if not self._upper_nodes or len(self._upper_nodes[-1][1]) >= PDF_PAGE_TREE_FANOUT:
+                self._upper_nodes.append([self.reserve_object(), [], 0])
+            self._leaf = {"id": self.reserve_object(), "parent": self._upper_nodes[-1][0], "kids": [], "xobjects": {}}
+            self._upper_nodes[-1][1].append(self._leaf["id"])
+        leaf = self._leaf
+        for name, obj_id in xobjects.items():
+            if leaf["xobjects"].setdefault(name, obj_id) != obj_id:
+                raise ValueError(f"Image name /{name} is used twice in one page group.")
+        leaf["kids"].append(page_id)
+        self._upper_nodes[-1][2] += 1
+        self.page_count += 1
+        if len(leaf["kids"]) >= self.page_group_size:
+            self._finish_page_group()
+        return leaf["id"]
+
+    def _finish_page_group(self):
+        leaf, self._leaf = self._leaf, None
+        if leaf is None:
+            return
+        kids = " ".join(f"{kid} 0 R" for kid in leaf["kids"])
+        names = " ".join(f"/{name} {obj_id} 0 R" for name, obj_id in leaf["xobjects"].items())
+        self.write_object(leaf["id"], (
+            f"<< /Type /Pages /Parent {leaf['parent']} 0 R /Kids [{kids}] /Count {len(leaf['kids'])} "
+            f"/Resources << /XObject << {names} >> >> >>").encode("ascii"))
+
+    def _write_upper_page_tree(self):
+        """Writes the levels above the leaves, PDF_PAGE_TREE_FANOUT kids per node, and returns the root's id."""
+        self._finish_page_group()
+        if not self._upper_nodes:
+            root_id = self.reserve_object()
+            self.write_object(root_id, b"<< /Type /Pages /Kids [] /Count 0 >>")
+            return root_id
+        level = self._upper_nodes
+        parents = {}
+        levels = [level]
+        while len(level) > 1:
+            next_level = []
+            for i in range(0, len(level), PDF_PAGE_TREE_FANOUT):
+                group = level[i:i + PDF_PAGE_TREE_FANOUT]
+                node = [self.reserve_object(), [node_id for node_id, _, _ in group], sum(count for _, _, count in group)]
+                for node_id, _, _ in group:
+                    parents[node_id] = node[0]
+                next_level.append(node)
+            levels.append(next_level)
+            level = next_level
+        for level in levels:
+            for node_id, kid_ids, count in level:
+                parent = f"/Parent {parents[node_id]} 0 R " if node_id in parents else ""
+                kids = " ".join(f"{kid} 0 R" for kid in kid_ids)
+                self.write_object(node_id, f"<< /Type /Pages {parent}/Kids [{kids}] /Count {count} >>".encode("ascii"))
+        return level[0][0]
+
+    def _write_xref_stream(self, catalog_id):
+        xref_id = self.reserve_object()
+        xref_offset = self._file.tell()
+        self._offsets[xref_id] = xref_offset
+        # W [1 5 2]: type, then offset / object stream number, then generation / index in the stream
+        rows = bytearray(b"\x00\x00\x00\x00\x00\x00\xff\xff")
+        for obj_id in range(1, len(self._offsets)):
+            container = self._containers[obj_id]
+            if container:
+                rows += b"\x02" + container.to_bytes(5, "big") + self._offsets[obj_id].to_bytes(2, "big")
+            else:
+                rows += b"\x01" + self._offsets[obj_id].to_bytes(5, "big") + b"\x00\x00"
+        decode_parms = ""
+        if np is not None: # PNG "Up" predictor: consecutive offsets differ in their low bytes only, which deflates far better
+            table = np.frombuffer(bytes(rows), dtype=np.uint8).reshape(-1, 8)
+            predicted = np.empty((table.shape[0], 9), dtype=np.uint8)
+            predicted[:, 0] = 2
+            predicted[0, 1:] = table[0]
+            predicted[1:, 1:] = table[1:] - table[:-1]
+            rows = predicted.tobytes()
+            decode_parms = " /DecodeParms << /Predictor 12 /Columns 8 >>"
+        self.write_stream(xref_id, f"/Type /XRef /Size {len(self._offsets)} /W [1 5 2] /Root {catalog_id} 0 R "
+                                   f"/Filter /FlateDecode{decode_parms}", zlib.compress(bytes(rows), 9))
+        self._file.write(f"startxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+
+    def append_chunk(self, chunk_filename):
+        """Copies a chunk written with first_object (see above) into this file. Chunks must
+        be appended in order, each starting at the object number the previous one ended at."""
+        with open(chunk_filename + ".idx", "rb") as f:
+            magic, first_object, object_count, page_count = struct.unpack(PDF_CHUNK_HEADER_FORMAT, f.read(PDF_CHUNK_HEADER_SIZE))
+            if magic != PDF_CHUNK_MAGIC:
+                raise ValueError(f"'{chunk_filename}.idx' is not a PDF chunk index.")
+            if first_object != len(self._offsets):
+                raise ValueError(f"'{chunk_filename}' starts at object {first_object}, expected {len(self._offsets)}. "
+                                 "Is a shard missing or out of order?")
+            chunk_offsets = array.array("q")
+            chunk_offsets.frombytes(f.read(8 * object_count))
+            chunk_page_ids = array.array("q")
+            chunk_page_ids.frombytes(f.read(8 * page_count))
+        if sys.byteorder != "little":
+            chunk_offsets.byteswap()
+            chunk_page_ids.byteswap()
+        chunk_start = self._file.tell()
+        with open(chunk_filename, "rb") as f:
+            shutil.copyfileobj(f, self._file, 1024 * 1024)
+        self._offsets.extend(chunk_start + offset for offset in chunk_offsets)
+        self.page_ids.extend(chunk_page_ids)
+
+    def _close_chunk(self):
+        chunk_offsets, chunk_page_ids = array.array("q", self._offsets), array.array("q", self.page_ids)
+        if sys.byteorder != "little":
+            chunk_offsets.byteswap()
+            chunk_page_ids.byteswap()
+        with open(self.chunk_filename + ".idx", "wb") as f:
+            f.write(struct.pack(PDF_CHUNK_HEADER_FORMAT, PDF_CHUNK_MAGIC, self._object_base, len(self._offsets), len(self.page_ids)))
+            f.write(chunk_offsets.tobytes())
+            f.write(chunk_page_ids.tobytes())
+        self._file.close()
+
+    def close(self):
+        if self.chunk_filename is not None:
+            self._close_chunk()
+            return
+        if self.compact:
+            root_id = self._write_upper_page_tree()
+            catalog_id = self.reserve_object()
+            self.write_object(catalog_id, f"<< /Type /Catalog /Pages {root_id} 0 R >>".encode("ascii"))
+            self._flush_object_stream()
+            self._write_xref_stream(catalog_id)
+            if self._owns_file:
+                self._file.close()
+            return
+
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self.write_object(self.pages_id, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode("ascii"))
+        catalog_id = self.reserve_object()
+        self.write_object(catalog_id, f"<< /Type /Catalog /Pages {self.pages_id} 0 R >>".encode("ascii"))
+
+        xref_offset = self._file.tell()
+        self._file.write(f"xref\n0 {len(self._offsets)}\n0000000000 65535 f \n".encode("ascii"))
+        for offset in self._offsets[1:]:
+            self._file.write(b"%010d 00000 n \n" % offset)
+        self._file.write(f"trailer\n<< /Size {len(self._offsets)} /Root {catalog_id} 0 R >>\n"
+                         f"startxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+        if self._owns_file:
+            self._file.close()
+
+def linearize_pdf(filename):
+    """Rewrites a finished PDF linearized, so viewers and RIPs can show page 1 before the
+    whole file has arrived. Needs pikepdf (qpdf); returns False if it is not installed."""
+    try:
+        import pikepdf
+    except ImportError:
+        print("pikepdf library not found. Please install it: pip install pikepdf")
+        print(f"'{filename}' was left unlinearized.")
+        return False
+    linearized_filename = filename + ".linearizing"
+    with pikepdf.open(filename) as pdf:
+        pdf.save(linearized_filename, linearize=True, object_stream_mode=pikepdf.ObjectStreamMode.preserve)
+    os.replace(linearized_filename, filename)
+    return True
+
+class SheetPdfWriter:
+    """Places ticket images onto PDF pages in the slots of a SheetLayout (the active one by default).
+
+    Images are added one at a time, so several writers (e.g. a print PDF and its preview)
+    can be fed from a single render pass. Each image is placed at the ticket's physical
+    size regardless of its pixel size, so a downsampled preview lines up with the print.
+    `sides` is "duplex" (pages alternate front/back), "fronts" or "backs"; back pages use
+    the mirrored slots.
+
+    Image streams are compressed on `executor` (a thread pool) while rendering continues;
+    placement happens in order, at most PDF_COMPRESSION_MAX_PENDING tiles behind. Each
+    image is written to disk as soon as it is placed and each page as soon as it is full
+    (see StreamingPdfFile), so memory stays flat however many pages the run has.
+    With PDF_COMPACT_STRUCTURE a sheet's front and back share one resource dictionary.
+
+    With chunk_first_sheet set, the writer produces the PDF chunk of a shard starting at
+    that sheet (<output_filename>.chunk, see StreamingPdfFile and tkt_shard.py). Every
+    sheet before it is full, so its first object number is known without the other shards.
+    """
+
+    def __init__(self, output_filename="ticket_sheet.pdf", compression_preset=DEFAULT_PDF_COMPRESSION_PRESET, executor=None,
+                 layout=None, sides="duplex", chunk_first_sheet=None):
+        self.output_filename = output_filename
+        self.layout = layout or active_sheet_layout()
+        self.sides = sides
+        self.ticket_width_pt = self.layout.ticket_width_pt
+        self.ticket_height_pt = self.layout.ticket_height_pt
+        self.tickets_per_page = self.layout.tickets_per_sheet
+        pages_per_sheet = 2 if sides == "duplex" else 1
+        if chunk_first_sheet is None:
+            self.pdf = StreamingPdfFile(output_filename, compact=PDF_COMPACT_STRUCTURE, page_group_size=pages_per_sheet)
+        else:
+            if PDF_COMPACT_STRUCTURE:
+                raise ValueError("Sharded runs write the classic PDF structure; set PDF_COMPACT_STRUCTURE = False.")
+            if OUTPUT_COLOR_MODE == "CMYK" and CMYK_ICC_PROFILE_PATH:
+                raise ValueError("Sharded runs cannot embed an ICC profile (its object number depends on the first CMYK tile).")
+            # Object 1 is the page tree; a full page is its images, its content stream and the page object
+            first_object = 2 + chunk_first_sheet * pages_per_sheet * (self.tickets_per_page + 2)
+            self.pdf = StreamingPdfFile(output_filename + ".chunk", first_object=first_object)
+        self.ticket_index_on_page = 0
+        self.page_index = 0
+        self.images_added = 0
+        self._page_content = None # Drawing operators of the page being filled
+        self._page_xobjects = None
+        self._images_in_group = 0 # Image names are unique per page group (the shared resources of a compact PDF)
+
+        self.compression = PDF_COMPRESSION_PRESETS[compression_preset]
+        self.compression_preset = compression_preset
+        self._owns_executor = executor is None
+        self.executor = concurrent.futures.ThreadPoolExecutor(PDF_COMPRESSION_WORKERS) if self._owns_executor else executor
+        self._pending = collections.deque() # (new_page, placement, future or None), in placement order
+        self.compression_stats = {"streams": 0, "raw_bytes": 0, "compressed_bytes": 0, "seconds": 0.0, "max_seconds": 0.0}
+        self._stream_log_file = None
+        self._stream_log = None
+        if PDF_COMPRESSION_STREAM_LOG:
+            self._stream_log_file = open(os.path.splitext(output_filename)[0] + "_compression.csv", "w", newline="", encoding="utf-8")
+            self._stream_log = csv.writer(self._stream_log_file)
+            self._stream_log.writerow(("stream_index", "raw_bytes", "compressed_bytes", "ratio", "seconds"))
+
+    def add_image(self, pil_image, encoded=None):
+        """Queues pil_image for the next slot. None leaves the slot intentionally blank
+        (e.g. padding out a partial last sheet). `encoded` is a compress_image_stream future
+        for pil_image that is already running (see encode_tile), so writers fed the same
+        tile share one deflate."""
+        back_page = self.sides == "backs" or (self.sides == "duplex" and self.page_index % 2 == 1)
+        placement = self.layout.placement(self.ticket_index_on_page, back=back_page)
+
+        if pil_image is None:
+            future = None
+        else:
+            future = encoded or self.encode_tile(pil_image)
+        self._pending.append((self.ticket_index_on_page == 0, placement, future))
+        while len(self._pending) > PDF_COMPRESSION_MAX_PENDING:
+            self._place_next()
+
+        self.images_added += 1
+        self.ticket_index_on_page += 1
+        if self.ticket_index_on_page >= self.tickets_per_page:
+            self.ticket_index_on_page = 0
+            self.page_index += 1
+
+    def encode_tile(self, pil_image):
+        """Starts deflating pil_image with this writer's preset; returns the future."""
+        return self.executor.submit(compress_image_stream, pil_image, self.compression["level"])
+
+    def _place_next(self):
+        with trace_span("pdf_place"):
+            self._place_next_untraced()
+
+    def _place_next_untraced(self):
+        new_page, placement, future = self._pending.popleft()
+        if new_page:
+            self._finish_page()
+            self._page_content = []
+            self._page_xobjects = {}
+            if not self.pdf.compact or len(self.pdf.page_ids) % self.pdf.page_group_size == 0:
+                self._images_in_group = 0
+        if future is None:
+            return
+
+        image, raw_bytes, compressed_bytes, seconds = future.result()
+        stats = self.compression_stats
+        stats["streams"] += 1
+        stats["raw_bytes"] += raw_bytes
+        stats["compressed_bytes"] += compressed_bytes
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        if self._stream_log is not None:
+            self._stream_log.writerow((stats["streams"], raw_bytes, compressed_bytes,
+                                       f"{raw_bytes / max(1, compressed_bytes):.2f}", f"{seconds:.6f}"))
+
+        image_id = self.pdf.add_stream(pdf_image_dictionary(image, pdf_cmyk_color_space(self.pdf, image), self.pdf), image["data"])
+        self._images_in_group += 1
+        image_name = f"I{self._images_in_group}"
+        self._page_xobjects[image_name] = image_id
+        matrix = image_placement_matrix(placement, self.layout.page_height_pt, self.ticket_width_pt, self.ticket_height_pt)
+        self._page_content.append("q {:.2f} {:.2f} {:.2f} {:.2f} {:.2f} {:.2f} cm /{} Do Q".format(*matrix, image_name))
+
+    def _finish_page(self):
+        if self._page_content is None:
+            return
+        self.pdf.add_page(self.layout.page_width_pt, self.layout.page_height_pt,
+                          "\n".join(self._page_content).encode("ascii"), self._page_xobjects)
+        self._page_content = None
+        self._page_xobjects = None
+
+    def close(self):
+        while self._pending:
+            self._place_next()
+        self._finish_page()
+        if self._owns_executor:
+            self.executor.shutdown()
+        if self._stream_log_file is not None:
+            self._stream_log_file.close()
+        self.pdf.close()
+        if PDF_LINEARIZE and self.pdf.chunk_filename is None:
+            linearize_pdf(self.output_filename)
+        stats = self.compression_stats
+        saved = f"PDF chunk: {self.pdf.chunk_filename}" if self.pdf.chunk_filename else f"PDF: {self.output_filename}"
+        if stats["streams"]:
+            print(f"Saved {saved} ({stats['streams']} image streams, '{self.compression_preset}' compression, "
+                  f"ratio {stats['raw_bytes'] / max(1, stats['compressed_bytes']):.2f}, {stats['seconds']:.2f}s total deflate time)")
+        else:
+            print(f"Saved {saved}")
+
 def generate_pdf_from_images(ticket_pil_images, output_filename="ticket_sheet.pdf"):
-    if FPDF is None:
-        print("FPDF library not available. Cannot generate PDF.")
+    writer = SheetPdfWriter(output_filename, DEFAULT_PDF_COMPRESSION_PRESET)
+    for pil_image in ticket_pil_images:
+        writer.add_image(pil_image)
+    writer.close()
+
+
+# --- Per-ticket Export ---
+
+def encode_ticket_image(pil_image, export_format):
+    """Encodes one tile with the EXPORT_FORMATS settings and returns the file bytes.
+    Safe to run in a worker thread (Pillow's encoders and zlib release the GIL)."""
+    with trace_span("export_encode"):
+        settings = EXPORT_FORMATS[export_format]
+        if export_format == "pdf":
+            return _single_page_pdf(pil_image, settings)
+        flat_tile = pil_image.mode in ("1", "L", "P")
+        params = dict(settings["flat_params"] if flat_tile else settings["params"])
+        if export_format == "jpeg" and pil_image.mode not in ("RGB", "L"):
+            pil_image = pil_image.convert("RGB") # No palette or 1-bit JPEGs
+        elif export_format == "webp" and pil_image.mode in ("1", "P"):
+            pil_image = pil_image.convert("RGB" if pil_image.mode == "P" else "L")
+        elif pil_image.mode == "CMYK" and export_format != "jpeg":
+            pil_image = pil_image.convert("RGB") # PNG and WebP have no CMYK; screen delivery anyway
+        with io.BytesIO() as encoded:
+            pil_image.save(encoded, format=settings["pil_format"], **params)
+            return encoded.getvalue()
+
+def _single_page_pdf(pil_image, settings):
+    """A PDF with one page the size of the ticket, holding the tile as a deflated image."""
+    image, _, _, _ = _deflate_tile(pil_image, settings["level"])
+    width_pt, height_pt = ticket_size_pt()
+    with io.BytesIO() as encoded:
+        pdf = StreamingPdfFile(encoded)
+        image_id = pdf.add_stream(pdf_image_dictionary(image, pdf_cmyk_color_space(pdf, image)), image["data"])
+        pdf.add_page(width_pt, height_pt, f"q {width_pt:.2f} 0 0 {height_pt:.2f} 0 0 cm /I1 Do Q".encode("ascii"), {"I1": image_id})
+        pdf.close()
+        return encoded.getvalue()
+
+class TicketImageExporter:
+    """Writes every ticket as its own image file (or one-page PDF) for digital delivery.
+
+    Tiles are encoded on a thread pool while rendering continues, at most
+    EXPORT_MAX_PENDING files behind. Files go into a directory sharded by ticket number
+    (EXPORT_FILES_PER_SHARD numbers per subdirectory, so no directory holds 100k files),
+    or are streamed in order into a single zip (stored, the images are already compressed)
+    or tar archive.
+    """
+
+    def __init__(self, output_path, export_format, container="dir", executor=None, include_backs=None):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{export_format}'. Use one of: {', '.join(EXPORT_FORMATS)}.")
+        if container not in ("dir", "zip", "tar"):
+            raise ValueError(f"Unknown export container '{container}'. Use 'dir', 'zip' or 'tar'.")
+        self.export_format = export_format
+        self.container = container
+        self.include_backs = EXPORT_INCLUDE_BACKS if include_backs is None else include_backs
+        self.extension = EXPORT_FORMATS[export_format]["extension"]
+        self.output_path = output_path if container == "dir" else f"{output_path}.{container}"
+        self._owns_executor = executor is None
+        self.executor = concurrent.futures.ThreadPoolExecutor(EXPORT_WORKERS) if self._owns_executor else executor
+        self._pending = collections.deque() # (name, future), in ticket order
+        self._created_shards = set()
+        self.files_written = 0
+        self.bytes_written = 0
+        self.start_time = time.perf_counter()
+        if container == "zip":
+            self._archive = zipfile.ZipFile(self.output_path, "w", zipfile.ZIP_STORED)
+        elif container == "tar":
+            self._archive = tarfile.open(self.output_path, "w")
+        else:
+            os.makedirs(self.output_path, exist_ok=True)
+
+    def add_ticket(self, number_str, front_pil, back_pil):
+        shard = str(int(number_str) // EXPORT_FILES_PER_SHARD).zfill(EXPORT_SHARD_DIGITS)
+        sides = [("front", front_pil)] + ([("back", back_pil)] if self.include_backs else [])
+        for side, pil_image in sides:
+            name = f"{shard}/{number_str}_{side}{self.extension}"
+            self._pending.append((name, self.executor.submit(encode_ticket_image, pil_image, self.export_format)))
+        while len(self._pending) > EXPORT_MAX_PENDING:
+            self._write_next()
+
+    def _write_next(self):
+        name, future = self._pending.popleft()
+        data = future.result()
+        with trace_span("export_write"):
+            if self.container == "zip":
+                self._archive.writestr(name, data)
+            elif self.container == "tar":
+                tar_info = tarfile.TarInfo(name)
+                tar_info.size = len(data)
+                tar_info.mtime = int(time.time())
+                self._archive.addfile(tar_info, io.BytesIO(data))
+            else:
+                shard_dir = os.path.join(self.output_path, os.path.dirname(name))
+                if shard_dir not in self._created_shards:
+                    os.makedirs(shard_dir, exist_ok=True)
+                    self._created_shards.add(shard_dir)
+                with open(os.path.join(self.output_path, name), "wb") as f:
+                    f.write(data)
+        self.files_written += 1
+        self.bytes_written += len(data)
+
+    def stats(self):
+        seconds = time.perf_counter() - self.start_time
+        return {"files": self.files_written, "bytes": self.bytes_written, "seconds": round(seconds, 3),
+                "files_per_second": round(self.files_written / max(seconds, 1e-9), 1),
+                "format": self.export_format, "container": self.container, "workers": EXPORT_WORKERS}
+
+    def close(self):
+        while self._pending:
+            self._write_next()
+        if self._owns_executor:
+            self.executor.shutdown()
+        if self.container != "dir":
+            self._archive.close()
+        stats = self.stats()
+        print(f"Saved export: {self.output_path} ({stats['files']} {self.export_format} files, "
+              f"{stats['bytes'] / (1024 * 1024):.1f} MB, {stats['files_per_second']} files/s)")
+
+# --- Output Profiles ---
+
+def apply_output_profile(profile_name):
+    """Switches the scaled layout constants to a named OUTPUT_PROFILES entry, keeping the
+    physical ticket size unchanged. Returns the profile dict."""
+    global EFFECTIVE_DPI_FOR_CONVERSION
+    profile = OUTPUT_PROFILES[profile_name]
+    apply_scale_factor(TICKET_WIDTH_IN * profile["dpi"] / ORIG_TICKET_WIDTH_PX)
+    EFFECTIVE_DPI_FOR_CONVERSION = float(profile["dpi"])
+    clear_render_caches() # Templates were rendered at the old size
+    use_sheet_layout(None) # Ticket size in points can shift by rounding
+    apply_color_mode(profile.get("color_mode", "RGB"))
+    return profile
+
+def size_render_caches(variants):
+    """Grows the front template and prepared background caches to hold every template and
+    background of the run. A round-robin rotation revisits its images in a cycle, so an LRU
+    shorter than the rotation would miss (re-decode and re-render) on every ticket. If the
+    whole set does not fit in RENDER_CACHE_MEMORY_MB the configured sizes are kept."""
+    global build_front_template
+    template_keys, background_paths = set(), set()
+    for variant in variants:
+        background = variant["background"]
+        image_paths = background.image_paths if isinstance(background, BackgroundRotation) else (background,)
+        for image_path in image_paths:
+            template_keys.add((image_path, variant["stub_color"], variant["title"]))
+            if image_path:
+                background_paths.add(image_path)
+    bytes_per_pixel = 4 if OUTPUT_COLOR_MODE == "CMYK" else 3
+    main_body_width, main_body_height = main_body_size()
+    needed_mb = (len(template_keys) * TICKET_WIDTH_PX * TICKET_HEIGHT_PX
+                 + len(background_paths) * main_body_width * main_body_height) * bytes_per_pixel / (1024 * 1024)
+    template_cache_size, background_cache_size = TEMPLATE_CACHE_SIZE, PREPARED_BACKGROUND_CACHE_SIZE
+    if needed_mb <= RENDER_CACHE_MEMORY_MB:
+        template_cache_size = max(template_cache_size, len(template_keys))
+        background_cache_size = max(background_cache_size, len(background_paths))
+    elif len(template_keys) > template_cache_size:
+        print(f"Warning: the run's {len(template_keys)} front templates need ~{needed_mb:.0f} MB, above RENDER_CACHE_MEMORY_MB; "
+              "rotating backgrounds will be decoded and rendered again each time they come round.")
+    if build_front_template.cache_info().maxsize != template_cache_size:
+        build_front_template = functools.lru_cache(maxsize=template_cache_size)(build_front_template.__wrapped__)
+    PREPARED_BACKGROUNDS.resize(background_cache_size)
+
+def clear_render_caches():
+    build_front_template.cache_clear()
+    build_back_template.cache_clear()
+    back_tile_palette.cache_clear()
+    build_thermal_template.cache_clear()
+    PREPARED_BACKGROUNDS.clear()
+
+def apply_color_mode(color_mode):
+    """Switches tile rendering to "RGB" or "CMYK". Templates and prepared backgrounds are
+    rebuilt in the new mode; the ICC transform is built once here instead of per ticket."""
+    global OUTPUT_COLOR_MODE
+    if color_mode not in ("RGB", "CMYK"):
+        raise ValueError(f"Unknown color mode '{color_mode}'. Use 'RGB' or 'CMYK'.")
+    if color_mode == OUTPUT_COLOR_MODE:
         return
+    OUTPUT_COLOR_MODE = color_mode
+    clear_render_caches()
+    _cmyk_ink.cache_clear()
+    cmyk_transform.cache_clear()
+    if color_mode == "CMYK":
+        if CMYK_ICC_PROFILE_PATH and ImageCms is None:
+            print("Pillow was built without littlecms (ImageCms); using its plain RGB -> CMYK conversion.")
+        elif not CMYK_ICC_PROFILE_PATH:
+            print("Warning: CMYK output without CMYK_ICC_PROFILE_PATH uses Pillow's plain RGB -> CMYK conversion "
+                  "(no ink limits or dot gain); set a press profile for production runs.")
+        elif cmyk_transform() is not None:
+            print(f"CMYK output through ICC profile '{CMYK_ICC_PROFILE_PATH}' (intent {CMYK_RENDERING_INTENT}).")
+
+def estimate_sheet_memory_mb():
+    """Memory held for one sheet of fronts and backs, which is what the render loop keeps at once."""
+    bytes_per_pixel = 4 if OUTPUT_COLOR_MODE == "CMYK" else 3
+    return 2 * tickets_per_sheet() * TICKET_WIDTH_PX * TICKET_HEIGHT_PX * bytes_per_pixel / (1024 * 1024)
+
+def preview_image(pil_image, reduce_factor):
+    """Derives a low-res preview tile from a print tile with a fast integer box reduce (no re-render)."""
+    if pil_image is None:
+        return None
+    if pil_image.mode in ("P", "1"): # reduce() works on RGB/L, not on palette or 1-bit tiles
+        pil_image = pil_image.convert("RGB" if pil_image.mode == "P" else "L")
+    return pil_image.reduce(reduce_factor)
+
+def write_run_metrics(output_filename, run_metrics):
+    with open(output_filename, "w", encoding="utf-8") as f:
+        json.dump(run_metrics, f, indent=2)
+    print(f"Saved run metrics: {output_filename}")
+
+# --- Sheet Layout Helpers ---
+
+def ticket_sheet_position(ticket_index):
+    """Returns (sheet_index, slot_index) for the ticket at ticket_index (0-based). Its back
+    is printed in the same slot of the back page, mirrored (see SheetLayout.placement)."""
+    return divmod(ticket_index, tickets_per_sheet())
+
+def ticket_page_indexes(sheet_index, output_sides):
+    """(front page, back page) of a sheet's tickets in the PDFs a run writes with
+    `output_sides`: pages 2N and 2N + 1 of the interleaved duplex PDF when it is written,
+    otherwise page N of the _fronts and _backs PDFs. None for a side no PDF holds (a
+    fronts-only or backs-only run, or a per-ticket export)."""
+    if "duplex" in output_sides:
+        return 2 * sheet_index, 2 * sheet_index + 1
+    return (sheet_index if "fronts" in output_sides else None), (sheet_index if "backs" in output_sides else None)
+
+def render_ticket_sheets(variants, num_leading_zeros, manifest_writer=None, variable_rows=None, overflow_report=None, profiler=None,
+                         verification_codes=None, first_ticket_index=0):
+    """Renders tickets one sheet at a time, yielding (sheet_index, front_images, back_images).
+
+    `variants` is the contiguous list from build_ticket_variants; tickets of consecutive
+    variants share sheets. Only the current sheet's images are held in memory. If a
+    manifest_writer is given, a row is recorded for every ticket as soon as it is rendered.
+    `variable_rows` (see iter_variable_data_rows) supplies per-ticket slot text in ticket
+    order, one row consumed per ticket. If a cProfile `profiler` is given, every
+    PROFILE_SAMPLE_EVERY_N_TICKETS-th ticket is rendered under it. Variants with a
+    rotating background are served by a BackgroundPrefetcher reading ahead of the loop,
+    and security underlays (SECURITY_UNDERLAY) are evaluated in batches ahead of it.
+    `verification_codes` (from ticket_verification_codes) holds one printed code per ticket, in ticket order.
+    A shard of a run passes the run-wide index of its first ticket, so manifest rows keep their run positions.
+    """
+    sheet_capacity = tickets_per_sheet()
+    total_tickets = sum(variant["last"] - variant["first"] + 1 for variant in variants)
+    size_render_caches(variants)
+    # Rotating backgrounds are decoded ahead of the render loop; a single image per variant
+    # is decoded once anyway, so the thread is only started when a variant rotates.
+    prefetcher = None
+    if any(isinstance(variant["background"], BackgroundRotation) for variant in variants):
+        prefetcher = BackgroundPrefetcher(iter_ticket_backgrounds(variants, num_leading_zeros))
+    underlays = iter_security_underlays(variants, num_leading_zeros) if SECURITY_UNDERLAY else None
+    try:
+        fronts, backs = [], []
+        count = 0
+        for variant in variants:
+            for i in range(variant["first"], variant["last"] + 1):
+                number_string = str(i).zfill(num_leading_zeros)
+                background_path = ticket_background(variant["background"], number_string)
+                if (count + 1) % 10 == 0 or (count + 1) == 1 or (count + 1) == total_tickets :
+                     print(f"  Creating ticket No. {number_string} ({(count + 1)} of {total_tickets})")
+
+                variable_fields = next(variable_rows, None) if variable_rows is not None else None
+                if variable_fields:
+                    row_number = variable_fields.pop(VARIABLE_DATA_NUMBER_COLUMN, None)
+                    problem = variable_row_number_problem(row_number, i)
+                    if problem is not None and overflow_report is not None:
+                        overflow_report.add(number_string, problem, row_number)
+
+                profile_this_ticket = profiler is not None and count % PROFILE_SAMPLE_EVERY_N_TICKETS == 0
+                if profile_this_ticket:
+                    profiler.enable()
+                with trace_span("ticket", {"number": number_string} if ACTIVE_TRACER is not None else None):
+                    underlay = next(underlays) if underlays is not None else None
+                    front_pil = create_ticket_front(number_string, background_path, variant["stub_color"], variant["title"],
+                                                    variable_fields, overflow_report, underlay)
+                    verification_code = None
+                    if verification_codes is not None:
+                        verification_code = tkt_verify.format_code(verification_codes[count], VERIFICATION_CODE_LENGTH)
+                    back_pil = create_ticket_back(number_string, variable_fields, overflow_report, verification_code)
+                    if REDUCE_TILE_BIT_DEPTH:
+                        with trace_span("reduce_bit_depth"):
+                            front_pil = reduce_tile_mode(front_pil, front_tile_palette(background_path, variant["stub_color"], variant["title"]))
+                            back_pil = reduce_tile_mode(back_pil, back_tile_palette())
+                    fronts.append(front_pil)
+                    backs.append(back_pil)
+
+                    if manifest_writer is not None:
+                        manifest_writer.add_ticket(number_string, first_ticket_index + count, front_pil, back_pil, variant["title"],
+                                                   background_path, variant.get("event"))
+                if profile_this_ticket:
+                    profiler.disable()
+                if prefetcher is not None:
+                    prefetcher.ticket_done()
+
+                count += 1
+                if len(fronts) == sheet_capacity or count == total_tickets:
+                    yield (count - 1) // sheet_capacity, fronts, backs
+                    fronts, backs = [], []
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+            print(f"Background cache: {PREPARED_BACKGROUNDS.hits} hits, {PREPARED_BACKGROUNDS.misses} misses")
+
+def duplex_page_images(sheets):
+    """Flattens (sheet_index, fronts, backs) into the interleaved page order used by
+    generate_pdf_from_images: a front page followed by its back page, with None padding so
+    every sheet starts a new page. Backs are in front slot order; the writer mirrors them."""
+    for _, fronts, backs in sheets:
+        yield from sheet_page_images(fronts, backs, "duplex")
+
+def sheet_page_images(fronts, backs, sides):
+    """One sheet's tiles in the page order of a SheetPdfWriter with these `sides`."""
+    if sides == "fronts":
+        return fronts
+    if sides == "backs":
+        return backs
+    return fronts + [None] * (tickets_per_sheet() - len(fronts)) + backs
+
+def side_pdf_filename(output_pdf_filename, sides):
+    return output_pdf_filename if sides == "duplex" else f"{os.path.splitext(output_pdf_filename)[0]}_{sides}.pdf"
+
+def run_pdf_outputs(output_pdf_filename, output_sides, preview_reduce=None):
+    """(filename, sides, preview reduce factor or None) of every PDF a full run writes:
+    one per output side, plus a preview of the first side when the profile has one."""
+    outputs = [(side_pdf_filename(output_pdf_filename, sides), sides, None) for sides in output_sides]
+    if preview_reduce:
+        outputs.append((os.path.splitext(outputs[0][0])[0] + "_preview.pdf", output_sides[0], preview_reduce))
+    return outputs
+
+def ticket_verification_codes(start_number, end_number, num_leading_zeros, index_filename, event_id=None):
+    """Computes every ticket's verification code in one batch and writes the index that
+    tkt_verify.py checks scans against (unless index_filename is None, as for a shard, whose
+    index is written by the merge). Returns the codes (ints, 4 bytes each) in ticket order."""
+    event_id = event_id or VERIFICATION_EVENT_ID
+    codes = tkt_verify.verification_codes(VERIFICATION_KEY, event_id, start_number, end_number, VERIFICATION_CODE_LENGTH)
+    if index_filename is None:
+        return codes
+    tkt_verify.write_verification_index(index_filename, VERIFICATION_KEY, event_id, start_number, end_number,
+                                        num_leading_zeros, codes, VERIFICATION_CODE_LENGTH)
+    print(f"Saved verification index: {index_filename} (event '{event_id}', {len(codes)} codes)")
+    return codes
+
+def variant_verification_code(variant, number_string):
+    """The printed code of one ticket of `variant`, with the event id its run's index uses
+    (the gang event name, see variants_verification_codes), or None without VERIFICATION_KEY."""
+    if not VERIFICATION_KEY:
+        return None
+    return tkt_verify.verification_code(VERIFICATION_KEY, variant.get("event") or VERIFICATION_EVENT_ID, number_string,
+                                        VERIFICATION_CODE_LENGTH)
+
+def variants_verification_codes(variants, num_leading_zeros, output_pdf_filename):
+    """Codes for every ticket of `variants` in render order. Ganged events (variants with
+    an "event", see load_gang_events) each get their own index, <output>_<event>_codes.idx,
+    with the event name as event id, since their numbers overlap. No index is written if
+    output_pdf_filename is None."""
+    output_base = os.path.splitext(output_pdf_filename)[0] if output_pdf_filename else None
+    if "event" not in variants[0]:
+        return ticket_verification_codes(variants[0]["first"], variants[-1]["last"], num_leading_zeros,
+                                         output_base and output_base + "_codes.idx")
+    codes = None
+    for event, event_variants in itertools.groupby(variants, key=lambda variant: variant["event"]):
+        event_variants = list(event_variants)
+        event_codes = ticket_verification_codes(event_variants[0]["first"], event_variants[-1]["last"], num_leading_zeros,
+                                                output_base and f"{output_base}_{event}_codes.idx", event)
+        if codes is None:
+            codes = event_codes
+        else:
+            codes.extend(event_codes)
+    return codes
+
+# --- Color-coded Range Variants ---
+
+def parse_rgb(color_value):
+    """Accepts 'R,G,B' or [R, G, B] and returns an (R, G, B) tuple, validating 0-255."""
+    if isinstance(color_value, str):
+        color_value = color_value.split(',')
+    r, g, b = map(int, color_value)
+    if not (0 <= r <= 255 and 0 <= g <= 255 and 0 <= b <= 255):
+        raise ValueError("RGB values must be between 0 and 255.")
+    return (r, g, b)
+
+def load_range_style_map(path):
+    """Loads a JSON range->style map, e.g.
+
+        {"1-500":    {"stub_color": "255,0,0", "title": "RAFFLE $5"},
+         "501-1000": {"stub_color": [0,0,255], "title": "RAFFLE $10", "background": "blue.jpg"},
+         "1001-2000": {"background": "sponsors/"}}
+
+    Returns a list of (first, last, style) sorted by first number. Any style key may be
+    omitted to fall back to the run's default. A background that is a directory or a list
+    of images is rotated across the range's tickets.
+    """
+    with open(path, encoding="utf-8") as f:
+        raw_map = json.load(f)
+    ranges = []
+    for range_str, style in raw_map.items():
+        first_str, _, last_str = range_str.partition("-")
+        first = int(first_str)
+        last = int(last_str) if last_str else first
+        if first > last:
+            raise ValueError(f"Invalid range '{range_str}' in '{path}'.")
+        if "stub_color" in style:
+            style = dict(style, stub_color=parse_rgb(style["stub_color"]))
+        ranges.append((first, last, style))
+    ranges.sort(key=lambda entry: entry[0])
+    for (_, prev_last, _), (first, _, _) in zip(ranges, ranges[1:]):
+        if first <= prev_last:
+            raise ValueError(f"Overlapping ranges in '{path}' at ticket {first}.")
+    return ranges
+
+def build_ticket_variants(start_number, end_number, default_style, range_styles=()):
+    """Splits start..end into contiguous variants. Numbers covered by an entry of
+    range_styles (see load_range_style_map) use that entry's style; gaps use default_style.
+    Each variant is a dict with first, last, title, stub_color and background (None, an
+    image path, or a BackgroundRotation when the style names a directory or list of images)."""
+    variants = []
+
+    def add_variant(first, last, style):
+        if first > last:
+            return
+        merged_style = dict(default_style, **style)
+        variants.append({
+            "first": first,
+            "last": last,
+            "title": merged_style["title"],
+            "stub_color": tuple(merged_style["stub_color"]),
+            "background": resolve_background_source(merged_style["background"]),
+        })
+
+    next_number = start_number
+    for first, last, style in range_styles:
+        first, last = max(first, start_number), min(last, end_number)
+        if first > last:
+            continue
+        add_variant(next_number, first - 1, {})
+        add_variant(first, last, style)
+        next_number = last + 1
+    add_variant(next_number, end_number, {})
+    return variants
+
+def report_variant_boundaries(variants, num_leading_zeros, output_filename):
+    """Prints where each variant starts and ends in the interleaved duplex PDF and writes the same table as CSV."""
+    sheet_capacity = tickets_per_sheet()
+    total_tickets = sum(variant["last"] - variant["first"] + 1 for variant in variants)
+    rows = []
+    ticket_index = 0
+    for variant in variants:
+        first_index = ticket_index
+        last_index = ticket_index + (variant["last"] - variant["first"])
+        rows.append((
+            variant["title"], ",".join(map(str, variant["stub_color"])), str(variant["background"] or ""),
+            str(variant["first"]).zfill(num_leading_zeros), str(variant["last"]).zfill(num_leading_zeros),
+            2 * (first_index // sheet_capacity), first_index % sheet_capacity,
+            2 * (last_index // sheet_capacity), last_index % sheet_capacity,
+        ))
+        ticket_index = last_index + 1
+
+    print("\nVariant boundaries (front page / slot, 0-based):")
+    for title, color, _, first, last, first_page, first_slot, last_page, last_slot in rows:
+        print(f"  {first}-{last} '{title}' stub ({color}): page {first_page} slot {first_slot} -> page {last_page} slot {last_slot}")
+
+    with open(output_filename, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(("title", "stub_color", "background", "first_number", "last_number",
+                         "first_page_index", "first_slot", "last_page_index", "last_slot"))
+        writer.writerows(rows)
+    print(f"Saved variant boundaries: {output_filename} ({total_tickets} tickets in {len(variants)} variants)")
+
+# --- Multi-event Ganging ---
+
+GANG_EVENT_NAME_PATTERN = re.compile(r"[A-Za-z0-9_.-]{1,64}") # Used in index filenames and as the verification event id
+
+def load_gang_events(path, default_style):
+    """Loads a JSON list of events to gang onto shared sheets, in print order, e.g.
+
+        [{"event": "gala", "numbers": "1-120", "title": "SPRING GALA", "stub_color": "200,30,30", "background": "gala.jpg"},
+         {"event": "quiz", "numbers": "1-45", "title": "QUIZ NIGHT", "stub_color": [0, 90, 200]}]
+
+    Title, stub_color and background fall back to default_style. Returns the variants
+    (see build_ticket_variants), one per event, each with its "event" name; an event's
+    tickets stay contiguous and the next event starts in the following slot.
+    """
+    with open(path, encoding="utf-8") as f:
+        raw_events = json.load(f)
+    if not isinstance(raw_events, list) or not raw_events:
+        raise ValueError(f"'{path}' must hold a non-empty list of events.")
+    variants = []
+    for raw_event in raw_events:
+        event = raw_event.get("event", "")
+        if not GANG_EVENT_NAME_PATTERN.fullmatch(event):
+            raise ValueError(f"Event name '{event}' must be 1-64 letters, digits, '_', '.' or '-'.")
+        if any(variant["event"] == event for variant in variants):
+            raise ValueError(f"Event '{event}' is listed twice in '{path}'.")
+        first_str, _, last_str = str(raw_event.get("numbers", "")).partition("-")
+        first = int(first_str)
+        last = int(last_str) if last_str else first
+        if first > last:
+            raise ValueError(f"Invalid numbers '{raw_event['numbers']}' for event '{event}'.")
+        style = {key: raw_event[key] for key in ("title", "stub_color", "background") if key in raw_event}
+        if "stub_color" in style:
+            style["stub_color"] = parse_rgb(style["stub_color"])
+        variant, = build_ticket_variants(first, last, dict(default_style, **style))
+        variant["event"] = event
+        variants.append(variant)
+    return variants
+
+def write_gang_cut_list(variants, num_leading_zeros, output_filename):
+    """Writes which slots belong to which event, one row per event per sheet (0-based
+    indices; a back ticket sits in the same slot index of the mirrored back layout), and
+    prints the sheets saved against printing each event on its own."""
+    sheet_capacity = tickets_per_sheet()
+    rows = []
+    ticket_index = 0
+    separate_sheets = 0
+    for variant in variants:
+        event_tickets = variant["last"] - variant["first"] + 1
+        separate_sheets += math.ceil(event_tickets / sheet_capacity)
+        first_index, last_index = ticket_index, ticket_index + event_tickets - 1
+        for sheet_index in range(first_index // sheet_capacity, last_index // sheet_capacity + 1):
+            segment_first = max(first_index, sheet_index * sheet_capacity)
+            segment_last = min(last_index, (sheet_index + 1) * sheet_capacity - 1)
+            first_number = variant["first"] + segment_first - first_index
+            rows.append((
+                variant.get("event", ""), variant["title"], sheet_index, 2 * sheet_index, 2 * sheet_index + 1,
+                segment_first % sheet_capacity, segment_last % sheet_capacity,
+                str(first_number).zfill(num_leading_zeros),
+                str(first_number + segment_last - segment_first).zfill(num_leading_zeros),
+                segment_last - segment_first + 1,
+            ))
+        ticket_index = last_index + 1
+
+    with open(output_filename, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(("event", "title", "sheet_index", "front_page_index", "back_page_index",
+                         "first_slot", "last_slot", "first_number", "last_number", "tickets"))
+        writer.writerows(rows)
+    ganged_sheets = math.ceil(ticket_index / sheet_capacity)
+    print(f"Saved cut list: {output_filename} ({len(variants)} events on {ganged_sheets} sheets; "
+          f"{separate_sheets - ganged_sheets} fewer than printing each event on its own)")
+
+# --- Proof Mode ---
+
+def variant_start_indices(variants):
+    """Ticket index of the first ticket of every variant, for bisect lookups."""
+    starts = []
+    ticket_index = 0
+    for variant in variants:
+        starts.append(ticket_index)
+        ticket_index += variant["last"] - variant["first"] + 1
+    return starts
+
+def ticket_at_index(variants, variant_starts, ticket_index):
+    """(variant, ticket number) of the ticket at ticket_index, without walking the range."""
+    variant_position = bisect.bisect_right(variant_starts, ticket_index) - 1
+    variant = variants[variant_position]
+    return variant, variant["first"] + ticket_index - variant_starts[variant_position]
+
+def proof_sample(variants, num_leading_zeros, every_n_sheets=None):
+    """Picks the tickets a proof shows: every ticket of the first and last sheet, the first
+    and last ticket of every Nth sheet, both sides of each point where the zero-padded
+    number gets wider (9999 -> 10000 with 4 digits) and the first and last ticket of every variant.
+
+    N grows for long runs so at most PROOF_MAX_SAMPLED_SHEETS sheets are sampled, which
+    keeps the proof at a few hundred tickets whatever the range size.
+    Returns a sorted list of (ticket_index, reason).
+    """
+    sheet_capacity = tickets_per_sheet()
+    variant_starts = variant_start_indices(variants)
+    total_tickets = variant_starts[-1] + variants[-1]["last"] - variants[-1]["first"] + 1
+    total_sheets = math.ceil(total_tickets / sheet_capacity)
+    every_n_sheets = max(every_n_sheets or PROOF_EVERY_N_SHEETS, math.ceil(total_sheets / PROOF_MAX_SAMPLED_SHEETS))
+    reasons = collections.defaultdict(list)
+
+    for sheet_index, reason in ((0, "first sheet"), (total_sheets - 1, "last sheet")):
+        for ticket_index in range(sheet_index * sheet_capacity, min(total_tickets, (sheet_index + 1) * sheet_capacity)):
+            reasons[ticket_index].append(reason)
+    for sheet_index in range(every_n_sheets, total_sheets - 1, every_n_sheets):
+        reasons[sheet_index * sheet_capacity].append(f"every {every_n_sheets} sheets")
+        reasons[min(total_tickets, (sheet_index + 1) * sheet_capacity) - 1].append(f"every {every_n_sheets} sheets")
+
+    for variant, variant_start in zip(variants, variant_starts):
+        first_number, last_number = variant["first"], variant["last"]
+        reasons[variant_start].append(f"variant '{variant['title']}' start")
+        reasons[variant_start + last_number - first_number].append(f"variant '{variant['title']}' end")
+        power_of_ten = 10
+        while power_of_ten <= last_number:
+            if first_number < power_of_ten and len(str(power_of_ten)) > num_leading_zeros: # Printed width grows here
+                boundary = (str(power_of_ten - 1).zfill(num_leading_zeros), str(power_of_ten).zfill(num_leading_zeros))
+                reasons[variant_start + power_of_ten - 1 - first_number].append(f"width {boundary[0]}->{boundary[1]}")
+                reasons[variant_start + power_of_ten - first_number].append(f"width {boundary[0]}->{boundary[1]}")
+            power_of_ten *= 10
+    return [(ticket_index, ", ".join(dict.fromkeys(reasons[ticket_index]))) for ticket_index in sorted(reasons)]
+
+def render_proof_contact_sheet(variants, num_leading_zeros, output_filename):
+    """Renders the proof_sample tickets at PROOF_PROFILE, reduced by PROOF_THUMBNAIL_REDUCE,
+    and lays them out front + back per cell, captioned with their sheet, page and slot in
+    the active layout (as in the manifest). Saved as a multi-page PDF (one page per
+    PROOF_COLUMNS x PROOF_ROWS cells). Variable data is not merged into proofs."""
+    layout = active_sheet_layout() # Kept: switching profiles resets the active layout
+    samples = proof_sample(variants, num_leading_zeros)
+    variant_starts = variant_start_indices(variants)
+    apply_output_profile(PROOF_PROFILE)
+    use_sheet_layout(layout)
+
+    thumb_width = TICKET_WIDTH_PX // PROOF_THUMBNAIL_REDUCE
+    thumb_height = TICKET_HEIGHT_PX // PROOF_THUMBNAIL_REDUCE
+    caption_font = load_font(PROOF_CAPTION_FONT_SIZE)
+    caption_height = 3 * (PROOF_CAPTION_FONT_SIZE + 3)
+    cell_width = 2 * thumb_width + 3 * PROOF_CELL_PADDING_PX
+    cell_height = thumb_height + caption_height + 2 * PROOF_CELL_PADDING_PX
+    cells_per_page = PROOF_COLUMNS * PROOF_ROWS
+
+    pages = []
+    for sample_position, (ticket_index, reason) in enumerate(samples):
+        if sample_position % cells_per_page == 0:
+            page = Image.new("RGB", (PROOF_COLUMNS * cell_width, PROOF_ROWS * cell_height), BACKGROUND_COLOR)
+            page_draw = ImageDraw.Draw(page)
+            pages.append(page)
+        row_num, col_num = divmod(sample_position % cells_per_page, PROOF_COLUMNS)
+        cell_x, cell_y = col_num * cell_width, row_num * cell_height
+
+        variant, number = ticket_at_index(variants, variant_starts, ticket_index)
+        number_string = str(number).zfill(num_leading_zeros)
+        front_pil = create_ticket_front(number_string, ticket_background(variant["background"], number_string),
+                                        variant["stub_color"], variant["title"])
+        back_pil = create_ticket_back(number_string, verification_code=variant_verification_code(variant, number_string))
+        page.paste(preview_image(front_pil, PROOF_THUMBNAIL_REDUCE), (cell_x + PROOF_CELL_PADDING_PX, cell_y + PROOF_CELL_PADDING_PX))
+        page.paste(preview_image(back_pil, PROOF_THUMBNAIL_REDUCE), (cell_x + 2 * PROOF_CELL_PADDING_PX + thumb_width, cell_y + PROOF_CELL_PADDING_PX))
+
+        sheet_index, slot_index = ticket_sheet_position(ticket_index)
+        slot_row, slot_col = layout.slot_labels[slot_index]
+        back_slot_row, back_slot_col = layout.back_slot_labels[slot_index]
+        caption = (f"No. {number_string}: {reason}\n"
+                   f"sheet {sheet_index + 1}, front page {2 * sheet_index} slot {slot_index} (r{slot_row} c{slot_col})\n"
+                   f"back page {2 * sheet_index + 1} (r{back_slot_row} c{back_slot_col})")
+        page_draw.multiline_text((cell_x + PROOF_CELL_PADDING_PX, cell_y + PROOF_CELL_PADDING_PX + thumb_height + 2),
+                                 caption, font=caption_font, fill=TEXT_COLOR_ON_LIGHT_BG, spacing=3)
+
+    pages[0].save(output_filename, save_all=True, append_images=pages[1:], resolution=EFFECTIVE_DPI_FOR_CONVERSION)
+    print(f"Saved proof: {output_filename} ({len(samples)} sampled tickets on {len(pages)} pages)")
+    return samples
+
+# --- Selective Reprint ---
+
+def parse_ticket_ranges(text):
+    """Parses "10237-10248, 18001" (commas or whitespace) into a list of (event, first, last).
+    Ganged runs name the event of each range, e.g. "gala:10-12 quiz:3"; event is None otherwise."""
+    ranges = []
+    for part in text.replace(",", " ").split():
+        event, _, numbers = part.rpartition(":")
+        first_str, _, last_str = numbers.partition("-")
+        first = int(first_str)
+        last = int(last_str) if last_str else first
+        if first > last:
+            raise ValueError(f"Invalid range '{part}'.")
+        ranges.append((event or None, first, last))
+    return ranges
+
+def reprint_positions(ticket_ranges, variants):
+    """Maps each ticket to reprint onto {sheet_index: {slot_index: ticket_index}}.
+
+    A ticket's index is its offset within the variant holding its number (only the
+    variants of its event when ganged, since events can share numbers), and its sheet and
+    slot follow from the active layout, so only the requested numbers are touched.
+    """
+    ganged = "event" in variants[0]
+    variant_starts = variant_start_indices(variants)
+    positions = collections.defaultdict(dict)
+    for event, first, last in ticket_ranges:
+        if ganged and event is None:
+            raise ValueError(f"Name the event of tickets {first}-{last}, e.g. '{variants[0]['event']}:{first}-{last}'.")
+        if not ganged and event is not None:
+            raise ValueError(f"'{event}:' names an event, but this run has no ganged events.")
+        found = 0
+        for variant, variant_start in zip(variants, variant_starts):
+            if ganged and variant["event"].lower() != event.lower(): # The run mode prompt is lowercased
+                continue
+            for number in range(max(first, variant["first"]), min(last, variant["last"]) + 1):
+                ticket_index = variant_start + number - variant["first"]
+                sheet_index, slot_index = ticket_sheet_position(ticket_index)
+                positions[sheet_index][slot_index] = ticket_index
+                found += 1
+        if found != last - first + 1:
+            if ganged:
+                raise ValueError(f"Tickets {first}-{last} are not all in event '{event}'.")
+            raise ValueError(f"Tickets {first}-{last} are outside the run {variants[0]['first']}-{variants[-1]['last']}.")
+    return dict(sorted(positions.items()))
+
+def reprint_label(variants, variant_starts, ticket_index, num_leading_zeros):
+    variant, number = ticket_at_index(variants, variant_starts, ticket_index)
+    number_string = str(number).zfill(num_leading_zeros)
+    return f"{variant['event']}:{number_string}" if "event" in variant else number_string
+
+def render_reprint_sheets(variants, num_leading_zeros, positions, variable_data_path=None):
+    """Renders only the sheets in `positions` (see reprint_positions), yielding
+    (sheet_index, fronts, backs) like render_ticket_sheets. Slots that are not reprinted
+    are None, so every ticket lands exactly where it was on the original sheet and its
+    back stays registered. Variable data rows are looked up by ticket index."""
+    sheet_capacity = tickets_per_sheet()
+    variant_starts = variant_start_indices(variants)
+    variable_fields_by_index = {}
+    if variable_data_path:
+        wanted_indices = sorted(ticket_index for slots in positions.values() for ticket_index in slots.values())
+        rows = iter_variable_data_rows(variable_data_path)
+        row_index = 0
+        for ticket_index in wanted_indices: # One pass over the CSV, rows parsed but nothing rendered
+            row = next(itertools.islice(rows, ticket_index - row_index, None), None)
+            row_index = ticket_index + 1
+            if row is None:
+                break
+            row.pop(VARIABLE_DATA_NUMBER_COLUMN, None)
+            variable_fields_by_index[ticket_index] = row
+
+    for sheet_index, slots in positions.items():
+        fronts, backs = [None] * sheet_capacity, [None] * sheet_capacity
+        for slot_index, ticket_index in slots.items():
+            variant, number = ticket_at_index(variants, variant_starts, ticket_index)
+            number_string = str(number).zfill(num_leading_zeros)
+            variable_fields = variable_fields_by_index.get(ticket_index)
+            front_pil = create_ticket_front(number_string, ticket_background(variant["background"], number_string),
+                                            variant["stub_color"], variant["title"], variable_fields)
+            back_pil = create_ticket_back(number_string, variable_fields,
+                                          verification_code=variant_verification_code(variant, number_string))
+            if REDUCE_TILE_BIT_DEPTH:
+                front_pil = reduce_tile_mode(front_pil, front_tile_palette(ticket_background(variant["background"], number_string),
+                                                                           variant["stub_color"], variant["title"]))
+                back_pil = reduce_tile_mode(back_pil, back_tile_palette())
+            fronts[slot_index], backs[slot_index] = front_pil, back_pil
+        yield sheet_index, fronts, backs
+
+def write_reprint(variants, num_leading_zeros, ticket_ranges, output_filename,
+                  compression_preset=DEFAULT_PDF_COMPRESSION_PRESET, variable_data_path=None):
+    """Writes a duplex PDF holding only the sheets with the requested tickets, and prints
+    which original pages each reprinted page replaces."""
+    positions = reprint_positions(ticket_ranges, variants)
+    variant_starts = variant_start_indices(variants)
+    writer = SheetPdfWriter(output_filename, compression_preset)
+    sheets = render_reprint_sheets(variants, num_leading_zeros, positions, variable_data_path)
+    for pil_image in duplex_page_images(sheets):
+        writer.add_image(pil_image)
+    writer.close()
+    for reprint_sheet_index, (sheet_index, slots) in enumerate(positions.items()):
+        numbers = ", ".join(reprint_label(variants, variant_starts, slots[slot_index], num_leading_zeros) for slot_index in sorted(slots))
+        print(f"  Reprint pages {2 * reprint_sheet_index}-{2 * reprint_sheet_index + 1} -> original pages "
+              f"{2 * sheet_index}-{2 * sheet_index + 1}: {numbers}")
+    return positions
+
+# --- Thermal Roll Output ---
+
+def apply_thermal_printer(printer_name):
+    """Scales the layout so the ticket (its height, with THERMAL_ROTATE_TICKET) spans the
+    printer's dot width. Returns the THERMAL_PRINTERS entry."""
+    printer = THERMAL_PRINTERS[printer_name]
+    across_roll_px = ORIG_TICKET_HEIGHT_PX if THERMAL_ROTATE_TICKET else ORIG_TICKET_WIDTH_PX
+    apply_scale_factor(printer["dots"] / across_roll_px)
+    apply_color_mode("RGB")
+    clear_render_caches()
+    return printer
+
+@functools.lru_cache(maxsize=THERMAL_TEMPLATE_CACHE_SIZE)
+def build_thermal_template(image_path, stub_bg_color, event_title):
+    """A front template with its background, stub and title dithered to black and white
+    once (Floyd-Steinberg), so per-ticket text is drawn onto pure black/white pixels and
+    only needs a threshold afterwards instead of a dither of every ticket. Kept as 1-bit."""
+    template = dict(build_front_template(image_path, stub_bg_color, event_title))
+    template["image"] = template["image"].convert("L").convert("1")
+    return template
+
+def create_thermal_ticket(number_str, image_path, stub_bg_color, event_title=None, variable_fields=None, underlay=None):
+    """The create_ticket_front layout as a 1-bit image, rotated for the roll if configured."""
+    image_path = ticket_background(resolve_background_source(image_path), number_str)
+    template = dict(build_thermal_template(image_path, tuple(stub_bg_color), event_title or EVENT_TITLE))
+    template["image"] = template["image"].convert("RGB") # Text colors and antialiasing are drawn as on the print tiles
+    if underlay is None and SECURITY_UNDERLAY:
+        underlay = security_underlays([number_str])[0]
+    ticket = render_front_from_template(template, number_str, variable_fields, None, underlay)
+    ticket = ticket.convert("L").point(lambda value: 255 if value >= 128 else 0, "1") # Antialiased text edges only
+    return ticket.transpose(Image.Transpose.ROTATE_90) if THERMAL_ROTATE_TICKET else ticket
+
+def escpos_raster(ticket_1bit, dots):
+    """ESC/POS GS v 0 commands printing a 1-bit ticket, centered on a `dots`-wide line.
+
+    Pixels are packed 8 per byte with NumPy, most significant bit first, 1 = burn a dot.
+    Long tickets are sent in THERMAL_RASTER_BAND_ROWS-row bands.
+    """
+    width, height = ticket_1bit.size
+    if width > dots:
+        raise ValueError(f"The ticket is {width} dots wide; the printer prints {dots}.")
+    burn = np.zeros((height, dots + (-dots) % 8), dtype=bool)
+    left = (dots - width) // 2
+    burn[:, left:left + width] = ~np.asarray(ticket_1bit) # Pillow's "1" is True for white
+    packed = np.packbits(burn, axis=1)
+    bytes_per_row = packed.shape[1]
+    commands = []
+    for band_top in range(0, height, THERMAL_RASTER_BAND_ROWS):
+        band = packed[band_top:band_top + THERMAL_RASTER_BAND_ROWS]
+        commands.append(b"\x1dv0\x00" + bytes_per_row.to_bytes(2, "little") + len(band).to_bytes(2, "little"))
+        commands.append(band.tobytes())
+    return b"".join(commands)
+
+class ThermalRasterWriter:
+    """Streams tickets into an ESC/POS command file (or a printer device opened as a file):
+    printer reset, then per ticket its raster bands, a feed and a cut."""
+
+    def __init__(self, output_filename, printer_name=DEFAULT_THERMAL_PRINTER):
+        self.output_filename = output_filename
+        self.dots = THERMAL_PRINTERS[printer_name]["dots"]
+        # GS V 66/65 n: feed to the cutting position plus n vertical motion units (not lines), then cut
+        self.cut_command = b"\x1dVB" if THERMAL_CUT == "partial" else b"\x1dVA"
+        self.cut_command += bytes([THERMAL_FEED_UNITS_BEFORE_CUT])
+        self._file = open(output_filename, "wb", buffering=1024 * 1024)
+        self._file.write(b"\x1b@") # ESC @: reset the printer
+        self.tickets_written = 0
+        self.bytes_written = 2
+        self.encode_seconds = 0.0
+
+    def add_ticket(self, ticket_1bit):
+        start_time = time.perf_counter()
+        with trace_span("thermal_encode"):
+            data = escpos_raster(ticket_1bit, self.dots) + self.cut_command
+        self.encode_seconds += time.perf_counter() - start_time
+        self._file.write(data)
+        self.tickets_written += 1
+        self.bytes_written += len(data)
+
+    def close(self):
+        self._file.close()
+        print(f"Saved thermal print job: {self.output_filename} ({self.tickets_written} tickets, "
+              f"{self.bytes_written / (1024 * 1024):.1f} MB, encode {self.tickets_written / max(self.encode_seconds, 1e-9):,.0f} tickets/s)")
+
+def write_thermal_roll(variants, num_leading_zeros, printer_name, output_filename, variable_data_path=None):
+    """Renders every ticket's front for a thermal roll printer and streams the ESC/POS job."""
+    printer = apply_thermal_printer(printer_name)
+    total_tickets = sum(variant["last"] - variant["first"] + 1 for variant in variants)
+    print(f"Thermal printer '{printer_name}': {printer['dots']} dots per line, ticket {TICKET_WIDTH_PX}x{TICKET_HEIGHT_PX} dots"
+          f"{', rotated' if THERMAL_ROTATE_TICKET else ''}.")
+    writer = ThermalRasterWriter(output_filename, printer_name)
+    variable_rows = iter_variable_data_rows(variable_data_path) if variable_data_path else None
+    underlays = iter_security_underlays(variants, num_leading_zeros) if SECURITY_UNDERLAY else None
+    count = 0
+    for variant in variants:
+        for i in range(variant["first"], variant["last"] + 1):
+            number_string = str(i).zfill(num_leading_zeros)
+            variable_fields = next(variable_rows, None) if variable_rows is not None else None
+            if variable_fields:
+                variable_fields.pop(VARIABLE_DATA_NUMBER_COLUMN, None)
+            underlay = next(underlays) if underlays is not None else None
+            writer.add_ticket(create_thermal_ticket(number_string, variant["background"], variant["stub_color"], variant["title"],
+                                                    variable_fields, underlay))
+            count += 1
+            if count % 100 == 0 or count == total_tickets:
+                print(f"  Thermal ticket No. {number_string} ({count} of {total_tickets})")
+    writer.close()
+
+# --- Manifest Writer ---
+
+def tile_hash(pil_image):
+    """Short content hash of a rendered tile, used to reconcile the manifest against the PDF."""
+    tile_digest = hashlib.blake2b(pil_image.tobytes(), digest_size=8)
+    if pil_image.mode == "P": # Same indices with a different palette is a different tile
+        tile_digest.update(bytes(pil_image.getpalette()))
+    return tile_digest.hexdigest()
+
+class TicketManifestWriter:
+    """Streams one row per printed ticket to CSV or SQLite while the run is in progress.
+
+    Rows are buffered and flushed MANIFEST_BATCH_SIZE at a time (one csv writerows / one
+    executemany per batch). For SQLite, the number and page lookup indexes are built once
+    at close(), which is far cheaper than maintaining them during a 1M-row insert.
+    Page indexes are recorded for the PDFs of `output_sides` (default PDF_OUTPUT_SIDES).
+    """
+
+    def __init__(self, output_filename, manifest_format, batch_size=MANIFEST_BATCH_SIZE, output_sides=None):
+        if manifest_format not in ("csv", "sqlite"):
+            raise ValueError(f"Unknown manifest format '{manifest_format}'. Use 'csv' or 'sqlite'.")
+        self.output_filename = output_filename
+        self.manifest_format = manifest_format
+        self.batch_size = batch_size
+        self.output_sides = PDF_OUTPUT_SIDES if output_sides is None else output_sides
+        self.rows_written = 0
+        self._pending_rows = []
+
+        if manifest_format == "csv":
+            self._file = open(output_filename, "w", newline="", encoding="utf-8", buffering=1024 * 1024)
+            self._csv_writer = csv.writer(self._file)
+            self._csv_writer.writerow(MANIFEST_COLUMNS)
+        else:
+            if os.path.exists(output_filename):
+                os.remove(output_filename)
+            self._conn = sqlite3.connect(output_filename)
+            # The manifest can always be regenerated from the run, so trade durability for speed
+            self._conn.execute("PRAGMA journal_mode=OFF")
+            self._conn.execute("PRAGMA synchronous=OFF")
+            self._conn.execute(
+                "CREATE TABLE tickets ("
+                "ticket_number TEXT NOT NULL, ticket_index INTEGER NOT NULL, "
+                "page_index INTEGER, slot_row INTEGER NOT NULL, slot_col INTEGER NOT NULL, "
+                "back_page_index INTEGER, back_slot_row INTEGER NOT NULL, back_slot_col INTEGER NOT NULL, "
+                "event_title TEXT NOT NULL, event TEXT NOT NULL, "
+                "front_tile_hash TEXT NOT NULL, back_tile_hash TEXT NOT NULL, background TEXT)"
+            )
+
+    def add_ticket(self, number_str, ticket_index, front_pil, back_pil, event_title, background=None, event=None):
+        sheet_index, slot_index = ticket_sheet_position(ticket_index)
+        layout = active_sheet_layout()
+        slot_row, slot_col = layout.slot_labels[slot_index]
+        back_slot_row, back_slot_col = layout.back_slot_labels[slot_index]
+        page_index, back_page_index = ticket_page_indexes(sheet_index, self.output_sides)
+        self._pending_rows.append((
+            number_str, ticket_index, page_index, slot_row, slot_col,
+            back_page_index, back_slot_row, back_slot_col, event_title, event or "",
+            tile_hash(front_pil), tile_hash(back_pil), background or "",
+        ))
+        if len(self._pending_rows) >= self.batch_size:
+            self.flush()
+
+    def add_rows(self, rows):
+        """Appends finished manifest rows (e.g. from a shard's manifest when merging)."""
+        for row in rows:
+            self._pending_rows.append(tuple(row))
+            if len(self._pending_rows) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if not self._pending_rows:
+            return
+        if self.manifest_format == "csv":
+            self._csv_writer.writerows(self._pending_rows)
+        else:
+            placeholders = ", ".join("?" * len(MANIFEST_COLUMNS))
+            self._conn.executemany(f"INSERT INTO tickets VALUES ({placeholders})", self._pending_rows)
+        self.rows_written += len(self._pending_rows)
+        self._pending_rows = []
+
+    def close(self):
+        self.flush()
+        if self.manifest_format == "csv":
+            self._file.close()
+        else:
+            self._conn.execute("CREATE INDEX idx_tickets_number ON tickets (event, ticket_number)")
+            self._conn.execute("CREATE INDEX idx_tickets_page ON tickets (page_index)")
+            self._conn.commit()
+            self._conn.close()
+        print(f"Saved manifest: {self.output_filename} ({self.rows_written} rows)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def manifest_filename_for(pdf_filename, manifest_format):
+    """ticket_sheet.pdf -> ticket_sheet_manifest.csv / ticket_sheet_manifest.sqlite"""
+    base, _ = os.path.splitext(pdf_filename)
+    return f"{base}_manifest.{manifest_format}"
+
+
+# --- Sharded Runs ---
+
+def plan_shards(total_tickets, shard_count):
+    """Splits a run's tickets into shard_count page-aligned shards of whole sheets (only the
+    run's last sheet can be partial), spreading the sheets as evenly as possible. Depends
+    only on the ticket count and the active sheet layout, so every node computes the same
+    plan. Returns [(first_ticket_index, stop_ticket_index)] in run order."""
+    sheet_capacity = tickets_per_sheet()
+    total_sheets = math.ceil(total_tickets / sheet_capacity)
+    if not 1 <= shard_count <= total_sheets:
+        raise ValueError(f"The run has {total_sheets} sheets; use 1-{total_sheets} shards.")
+    bounds = [min(total_tickets, (shard_index * total_sheets // shard_count) * sheet_capacity)
+              for shard_index in range(shard_count + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+def slice_variants(variants, first_ticket_index, stop_ticket_index):
+    """The variants covering tickets first_ticket_index..stop_ticket_index - 1 of the run,
+    trimmed to that range."""
+    sliced = []
+    ticket_index = 0
+    for variant in variants:
+        variant_tickets = variant["last"] - variant["first"] + 1
+        first = max(first_ticket_index, ticket_index)
+        stop = min(stop_ticket_index, ticket_index + variant_tickets)
+        if first < stop:
+            sliced.append(dict(variant, first=variant["first"] + first - ticket_index, last=variant["first"] + stop - 1 - ticket_index))
+        ticket_index += variant_tickets
+    return sliced
+
+def shard_output_filename(output_pdf_filename, shard_index):
+    """ticket_sheet.pdf -> ticket_sheet_shard0003.pdf; a shard's other outputs are named after it as usual."""
+    base, extension = os.path.splitext(output_pdf_filename)
+    return f"{base}_shard{shard_index:04d}{extension}"
+
+
+# --- Full Run ---
+
+def run_ticket_job(variants, num_leading_zeros, profile_name, compression_preset=DEFAULT_PDF_COMPRESSION_PRESET,
+                   variable_data_path=None, export_settings=None, output_pdf_filename="ticket_sheet.pdf", output_sides=None,
+                   shard=None):
+    """Renders every ticket of `variants` into the print PDFs of `output_sides` (default
+    PDF_OUTPUT_SIDES) and a preview of the first, or into per-ticket files with
+    export_settings ([format, container]), plus the manifest,
+    verification index and run metrics. Takes no input, so it can be driven by scripts
+    (see tkt_scale_test.py); the output profile and sheet layout must already be applied.
+
+    With `shard` (a (first_ticket_index, stop_ticket_index) entry of plan_shards) only
+    those tickets are rendered, into PDF chunks and a manifest named after
+    output_pdf_filename (see shard_output_filename), for tkt_shard.py to merge.
+
+    Returns the run metrics dict. Raises ValueError if one sheet would not fit MEMORY_BUDGET_MB.
+    """
+    first_ticket_index = 0
+    chunk_first_sheet = None
+    if shard is not None:
+        if export_settings is not None:
+            raise ValueError("Per-ticket exports are not sharded; run them on one machine.")
+        first_ticket_index, stop_ticket_index = shard
+        variants = slice_variants(variants, first_ticket_index, stop_ticket_index)
+        chunk_first_sheet = first_ticket_index // tickets_per_sheet()
+    start_number = variants[0]["first"]
+    total_tickets = sum(variant["last"] - variant["first"] + 1 for variant in variants)
+    output_profile = OUTPUT_PROFILES[profile_name]
+    run_start_time = time.perf_counter()
+    profiler = cProfile.Profile() if PROFILE_OUTPUT_PATH else None
+
+    sheet_memory_mb = estimate_sheet_memory_mb()
+    print(f"Output profile '{profile_name}': {EFFECTIVE_DPI_FOR_CONVERSION:.0f} dpi, ~{sheet_memory_mb:.0f} MB of tiles per sheet.")
+    if sheet_memory_mb > MEMORY_BUDGET_MB:
+        raise ValueError(f"One sheet needs ~{sheet_memory_mb:.0f} MB, over MEMORY_BUDGET_MB ({MEMORY_BUDGET_MB} MB). Use a lower profile.")
+
+    output_sides = output_sides or PDF_OUTPUT_SIDES
+    manifest_writer = None
+    if MANIFEST_FORMAT:
+        manifest_writer = TicketManifestWriter(manifest_filename_for(output_pdf_filename, MANIFEST_FORMAT), MANIFEST_FORMAT,
+                                               output_sides=() if export_settings is not None else output_sides)
+
+    variable_rows = None
+    overflow_report = None
+    if variable_data_path:
+        variable_rows = iter_variable_data_rows(variable_data_path)
+        if first_ticket_index:
+            variable_rows = itertools.islice(variable_rows, first_ticket_index, None)
+        overflow_report = VariableDataOverflowReport(os.path.splitext(output_pdf_filename)[0] + "_variable_data_issues.csv")
+
+    verification_codes = None
+    if VERIFICATION_KEY:
+        verification_codes = variants_verification_codes(variants, num_leading_zeros, output_pdf_filename if shard is None else None)
+
+    if export_settings is not None:
+        # One file per ticket instead of imposed sheets; tiles come from the same render pipeline
+        print("\nExporting ticket files...")
+        exporter = TicketImageExporter(os.path.splitext(output_pdf_filename)[0] + "_export", *export_settings)
+        sheet_capacity = tickets_per_sheet()
+        sheets = render_ticket_sheets(variants, num_leading_zeros, manifest_writer, variable_rows, overflow_report, profiler,
+                                      verification_codes)
+        for sheet_index, fronts, backs in sheets:
+            for slot_index, (front_pil, back_pil) in enumerate(zip(fronts, backs)):
+                number_string = str(start_number + sheet_index * sheet_capacity + slot_index).zfill(num_leading_zeros)
+                exporter.add_ticket(number_string, front_pil, back_pil)
+        exporter.close()
+        run_metrics = {
+            "output_profile": profile_name,
+            "tickets": total_tickets,
+            "elapsed_seconds": round(time.perf_counter() - run_start_time, 3),
+            "export": exporter.stats(),
+        }
 
-    ticket_width_pt = TICKET_WIDTH_PX * 72.0 / EFFECTIVE_DPI_FOR_CONVERSION
-    ticket_height_pt = TICKET_HEIGHT_PX * 72.0 / EFFECTIVE_DPI_FOR_CONVERSION
-
-    pdf = FPDF(orientation=PDF_PAGE_ORIENTATION, unit='pt', format=PDF_PAGE_FORMAT)
-    pdf.set_auto_page_break(False)
-
-    tickets_per_page = PDF_TICKETS_PER_ROW * PDF_TICKETS_PER_COL
-    ticket_index_on_page = 0
-
-    for i, pil_image in enumerate(ticket_pil_images):
-        if ticket_index_on_page == 0:
-            pdf.add_page()
-            if i == 0: # Check only for the first page setup
-                page_content_width_pt = pdf.w - 2 * PDF_MARGIN_PT
-                page_content_height_pt = pdf.h - 2 * PDF_MARGIN_PT
-                required_width_for_tickets_pt = (PDF_TICKETS_PER_ROW * ticket_width_pt) + \
-                                                ((PDF_TICKETS_PER_ROW - 1) * PDF_SPACING_PT if PDF_TICKETS_PER_ROW > 1 else 0)
-                required_height_for_tickets_pt = (PDF_TICKETS_PER_COL * ticket_height_pt) + \
-                                                 ((PDF_TICKETS_PER_COL - 1) * PDF_SPACING_PT if PDF_TICKETS_PER_COL > 1 else 0)
-                if required_width_for_tickets_pt > page_content_width_pt:
-                    print(f"Warning: Ticket block width ({required_width_for_tickets_pt:.2f}pt) exceeds PDF content width ({page_content_width_pt:.2f}pt).")
-                if required_height_for_tickets_pt > page_content_height_pt:
-                    print(f"Warning: Ticket block height ({required_height_for_tickets_pt:.2f}pt) exceeds PDF content height ({page_content_height_pt:.2f}pt).")
-
-        col_num = ticket_index_on_page % PDF_TICKETS_PER_ROW
-        row_num = ticket_index_on_page // PDF_TICKETS_PER_ROW
-        
-        page_content_width_pt = pdf.w - 2 * PDF_MARGIN_PT
-        total_width_of_row_pt = (PDF_TICKETS_PER_ROW * ticket_width_pt) + \
-                                ((PDF_TICKETS_PER_ROW - 1) * PDF_SPACING_PT if PDF_TICKETS_PER_ROW > 1 else 0)
-        x_offset_for_centering_pt = (page_content_width_pt - total_width_of_row_pt) / 2
-        
-        x_pt = PDF_MARGIN_PT + x_offset_for_centering_pt + col_num * (ticket_width_pt + PDF_SPACING_PT)
-        y_pt = PDF_MARGIN_PT + row_num * (ticket_height_pt + PDF_SPACING_PT)
-
-        # Using BytesIO is generally preferred and should work with up-to-date fpdf2
-        with io.BytesIO() as img_byte_stream:
-            pil_image.save(img_byte_stream, format="PNG")
-            img_byte_stream.seek(0)
-            pdf.image(img_byte_stream, x=x_pt, y=y_pt, w=ticket_width_pt, h=ticket_height_pt, type="PNG")
-
-        ticket_index_on_page += 1
-        if ticket_index_on_page >= tickets_per_page:
-            ticket_index_on_page = 0
-
-    pdf.output(output_filename, "F")
-    print(f"Saved PDF: {output_filename}")
+    else:
+        print("\nGenerating PDF files...")
+        # Tickets are rendered a sheet at a time and streamed straight into the PDFs:
+        # fronts and mirrored backs interleaved so the sheet prints duplex, and/or fronts
+        # and backs in separate files. Print tiles are rendered and deflated once; every
+        # print PDF embeds the same encoded stream, and the preview PDF is fed reduced
+        # copies of the same tiles. All writers share one compression pool.
+        compression_executor = concurrent.futures.ThreadPoolExecutor(PDF_COMPRESSION_WORKERS)
+        pdf_writers = [(SheetPdfWriter(pdf_filename, compression_preset, compression_executor, sides=sides,
+                                       chunk_first_sheet=chunk_first_sheet), reduce_factor)
+                       for pdf_filename, sides, reduce_factor in run_pdf_outputs(output_pdf_filename, output_sides,
+                                                                                 output_profile["preview_reduce"])]
+
+        sheets = render_ticket_sheets(variants, num_leading_zeros, manifest_writer, variable_rows, overflow_report, profiler,
+                                      verification_codes, first_ticket_index)
+        tile_encodes = 0
+        for _, fronts, backs in sheets:
+            encoded = {} # id(tile) -> deflate future, shared by the print writers for this sheet
+            for writer, reduce_factor in pdf_writers:
+                for pil_image in sheet_page_images(fronts, backs, writer.sides):
+                    if reduce_factor:
+                        writer.add_image(preview_image(pil_image, reduce_factor))
+                    elif pil_image is None:
+                        writer.add_image(None)
+                    else:
+                        if id(pil_image) not in encoded:
+                            encoded[id(pil_image)] = writer.encode_tile(pil_image)
+                            tile_encodes += 1
+                        writer.add_image(pil_image, encoded[id(pil_image)])
+        for writer, _ in pdf_writers:
+            writer.close()
+        compression_executor.shutdown()
+        print("\nPDF generation complete.")
+        if "fronts" in output_sides and "backs" in output_sides:
+            print(f"To print double-sided: print '{side_pdf_filename(output_pdf_filename, 'fronts')}', then flip the paper "
+                  f"and print '{side_pdf_filename(output_pdf_filename, 'backs')}' on the other side.")
+
+        run_metrics = {
+            "output_profile": profile_name,
+            "tickets": total_tickets,
+            "elapsed_seconds": round(time.perf_counter() - run_start_time, 3),
+            "pdf_compression": {
+                writer.output_filename: dict(writer.compression_stats, preset=compression_preset, workers=PDF_COMPRESSION_WORKERS)
+                for writer, _ in pdf_writers
+            },
+            "print_tile_encodes": tile_encodes, # Once per tile, however many print PDFs embed it
+        }
+    write_run_metrics(os.path.splitext(output_pdf_filename)[0] + "_metrics.json", run_metrics)
+
+    if manifest_writer is not None:
+        manifest_writer.close()
+    if profiler is not None:
+        profiler.dump_stats(PROFILE_OUTPUT_PATH)
+        print(f"Saved profile: {PROFILE_OUTPUT_PATH} (every {PROFILE_SAMPLE_EVERY_N_TICKETS}th ticket sampled)")
+    if overflow_report is not None:
+        overflow_report.close()
+        if shard is None and next(variable_rows, None) is not None: # A shard's leftover rows belong to later shards
+            print("Warning: The variable-data CSV has more rows than tickets; extra rows were ignored.")
+    return run_metrics
 
 
 # --- Main Execution ---
 if __name__ == "__main__":
     start_number = int(input("Enter starting ticket number: "))
     end_number = int(input("Enter ending ticket number: "))
-    image_file_path = input("Enter path to the image for the ticket main body background: ")
+    image_file_path = input("Enter path to the image (or a directory of images to rotate) for the ticket main body background: ")
     num_leading_zeros = int(input("Enter number of leading zeros for ticket numbers (e.g., 5 for 00001): "))
     event_title = input("Enter event title (default is 'EVENT TICKET'): ")
     if event_title.strip():
@@ -413,10 +3219,7 @@ if __name__ == "__main__":
     if stub_color_input_str.strip():
         try:
             # Parse R,G,B values
-            r, g, b = map(int, stub_color_input_str.split(','))
-            if not (0 <= r <= 255 and 0 <= g <= 255 and 0 <= b <= 255):
-                raise ValueError("RGB values must be between 0 and 255.")
-            STUB_BACKGROUND_COLOR_USER = (r, g, b)
+            STUB_BACKGROUND_COLOR_USER = parse_rgb(stub_color_input_str)
         except ValueError as e:
             print(f"Invalid color input: {e}. Using default stub color {DEFAULT_STUB_BG_COLOR}.")
             STUB_BACKGROUND_COLOR_USER = DEFAULT_STUB_BG_COLOR
@@ -424,6 +3227,81 @@ if __name__ == "__main__":
         STUB_BACKGROUND_COLOR_USER = DEFAULT_STUB_BG_COLOR
     print(f"Using stub background color: {STUB_BACKGROUND_COLOR_USER}")
 
+    profile_name = input(f"Enter output profile ({', '.join(OUTPUT_PROFILES)}) or press Enter for '{DEFAULT_OUTPUT_PROFILE}': ").strip() or DEFAULT_OUTPUT_PROFILE
+    if profile_name not in OUTPUT_PROFILES:
+        print(f"Unknown output profile '{profile_name}'. Using '{DEFAULT_OUTPUT_PROFILE}'.")
+        profile_name = DEFAULT_OUTPUT_PROFILE
+    output_profile = apply_output_profile(profile_name)
+    if SECURITY_UNDERLAY and np is None:
+        print("NumPy library not found. Please install it: pip install numpy")
+        print("Rendering without the security underlay.")
+        SECURITY_UNDERLAY = False
+
+    compression_preset = input(f"Enter PDF compression ({', '.join(PDF_COMPRESSION_PRESETS)}) or press Enter for '{DEFAULT_PDF_COMPRESSION_PRESET}': ").strip() or DEFAULT_PDF_COMPRESSION_PRESET
+    if compression_preset not in PDF_COMPRESSION_PRESETS:
+        print(f"Unknown compression preset '{compression_preset}'. Using '{DEFAULT_PDF_COMPRESSION_PRESET}'.")
+        compression_preset = DEFAULT_PDF_COMPRESSION_PRESET
+
+    # Optional per-ticket variable data (seat, table, holder name...) merged from a CSV
+    variable_data_path = input(f"Enter path to a variable-data CSV (columns: {', '.join(VARIABLE_TEXT_SLOTS)}), or press Enter to skip: ").strip()
+    if variable_data_path and not os.path.exists(variable_data_path):
+        print(f"Error: Variable-data file '{variable_data_path}' not found. Exiting.")
+        exit()
+
+    # Optional color-coded ranges (e.g. 1-500 red, 501-1000 blue) printed together in one PDF,
+    # or a list of separate events ganged onto shared sheets (see load_gang_events)
+    range_map_path = input("Enter path to a range->style map JSON for color-coded ranges, an event list JSON to gang "
+                           "several events onto shared sheets, or press Enter for a single style: ").strip()
+    range_styles = []
+    gang_events_path = None
+    if range_map_path:
+        try:
+            with open(range_map_path, encoding="utf-8") as f:
+                if isinstance(json.load(f), list):
+                    gang_events_path = range_map_path
+                else:
+                    range_styles = load_range_style_map(range_map_path)
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not load range map '{range_map_path}': {e}. Exiting.")
+            exit()
+
+    run_mode = input("Enter 'proof' for a quick sampled proof, ticket numbers to reprint in their original slots "
+                     "(e.g. '10237-10248, 18001', or 'gala:10-12' for ganged events), 'export <png|webp|jpeg|pdf> [dir|zip|tar]' for one file per ticket, "
+                     f"'thermal [{'|'.join(THERMAL_PRINTERS)}]' for a roll printer job, 'sides <{'|'.join(PDF_SIDE_CHOICES)}> ...' "
+                     "for a full run writing those PDFs (e.g. 'sides duplex fronts backs'), or press Enter for the full run: ").strip().lower()
+    reprint_ranges = None
+    export_settings = None
+    thermal_printer = None
+    output_sides = None
+    if run_mode.startswith("sides"):
+        output_sides = tuple(dict.fromkeys(run_mode.split()[1:])) or PDF_OUTPUT_SIDES
+        if any(sides not in PDF_SIDE_CHOICES for sides in output_sides):
+            print(f"Error: Unknown PDF sides in '{run_mode}'. Use any of {', '.join(PDF_SIDE_CHOICES)}. Exiting.")
+            exit()
+    elif run_mode.startswith("thermal"):
+        thermal_printer = (run_mode.split()[1:] or [DEFAULT_THERMAL_PRINTER])[0]
+        if thermal_printer not in THERMAL_PRINTERS:
+            print(f"Error: Unknown thermal printer '{thermal_printer}'. Use one of {', '.join(THERMAL_PRINTERS)}. Exiting.")
+            exit()
+        if np is None:
+            print("NumPy library not found. Please install it: pip install numpy")
+            print("Thermal output is not available. Exiting.")
+            exit()
+    elif run_mode.startswith("export"):
+        export_settings = run_mode.split()[1:] or ["png"]
+        if export_settings[0] not in EXPORT_FORMATS or (len(export_settings) > 1 and export_settings[1] not in EXPORT_CONTAINERS):
+            print(f"Error: Unknown export '{run_mode}'. Use one of {', '.join(EXPORT_FORMATS)} and one of {', '.join(EXPORT_CONTAINERS)}. Exiting.")
+            exit()
+    elif run_mode and run_mode != "proof":
+        try:
+            reprint_ranges = parse_ticket_ranges(run_mode)
+        except ValueError as e:
+            print(f"Error: Could not read the reprint numbers '{run_mode}': {e}. Exiting.")
+            exit()
+
+    if gang_events_path and export_settings is not None:
+        print("Error: Per-ticket exports are not available for ganged events (their numbers overlap). Exiting.")
+        exit()
 
     if not (os.path.exists(image_file_path) or image_file_path.strip() == ""):
         print(f"Error: Image file '{image_file_path}' not found. Exiting.")
@@ -432,81 +3310,72 @@ if __name__ == "__main__":
         print("No image path provided. Main body of tickets will use fallback background color.")
         image_file_path = None
 
-    if FPDF is None:
-        print("FPDF2 library is not installed. PDF output is disabled. Exiting.")
-        exit()
-    
     if start_number > end_number:
         print("Error: Start number cannot be greater than end number. Exiting.")
         exit()
 
-    all_front_pil_images = []
-    all_back_pil_images = []
+    grid_layout = grid_sheet_layout()
+    use_sheet_layout(plan_sheet_layout() if PDF_SHEET_LAYOUT == "optimized" else grid_layout)
 
     print("\nGenerating ticket images (using Pillow)...")
     print(f"Target ticket size (WxH): {TICKET_WIDTH_PX}px x {TICKET_HEIGHT_PX}px")
-    if image_file_path:
+    if image_file_path and os.path.isdir(image_file_path):
+        print(f"Main body images: rotating the images in '{image_file_path}' ({BACKGROUND_ROTATION_POLICY}).")
+    elif image_file_path:
         print(f"Main body image: '{image_file_path}' will be used as background.")
-    
-    total_tickets = end_number - start_number + 1
-    for count, i in enumerate(range(start_number, end_number + 1)):
-        number_string = str(i).zfill(num_leading_zeros)
-        if (count + 1) % 10 == 0 or (count + 1) == 1 or (count + 1) == total_tickets :
-             print(f"  Creating ticket No. {number_string} ({(count + 1)} of {total_tickets})")
-
-        # Pass the user-defined or default stub background color
-        front_pil = create_ticket_front(number_string, image_file_path, STUB_BACKGROUND_COLOR_USER)
-        all_front_pil_images.append(front_pil)
-
-        back_pil = create_ticket_back(number_string)
-        all_back_pil_images.append(back_pil)
-
-    print(f"\nGenerated {len(all_front_pil_images)} ticket images with Pillow.")
-
-    # if FPDF is not None:
-    #     print("\nGenerating PDF files...")
-    #     if all_front_pil_images:
-    #         generate_pdf_from_images(all_front_pil_images, "ticket_sheet_fronts.pdf")
-    #         generate_pdf_from_images(all_back_pil_images, "ticket_sheet_backs.pdf")
-    #         print("\nPDF generation complete.")
-    #     else:
-    #         print("No ticket images were generated, so no PDF will be created.")
-    # else:
-    #     print("Skipping PDF generation as FPDF2 is not installed or failed to import.")
-
-
-    tickets_per_sheet = PDF_TICKETS_PER_ROW * PDF_TICKETS_PER_COL
-    number_of_sheets = len(all_front_pil_images) + len(all_back_pil_images) // tickets_per_sheet
-    pointer = 0
-
-    if FPDF is not None:
-        print("\nGenerating PDF files...")
-        # stack front and back images into a single PDF
-        all_images = []
-        for x in range(number_of_sheets):       
-            if x % 2 == 0:
-                for image in all_front_pil_images[pointer * tickets_per_sheet:pointer * tickets_per_sheet + tickets_per_sheet]:
-                    all_images.append(image)
-            else:
-                
-                start_idx = pointer * tickets_per_sheet
-                end_idx = start_idx + tickets_per_sheet
-                current_back_sheet_images = all_back_pil_images[start_idx:end_idx]
-                
-                for i in range(0, len(current_back_sheet_images), 2):
-                    if i + 1 < len(current_back_sheet_images):
-                        all_images.append(current_back_sheet_images[i + 1])
-                        all_images.append(current_back_sheet_images[i])
-                    elif i < len(current_back_sheet_images):
-                        # If there's an odd image out, just add it as is
-                        all_images.append(current_back_sheet_images[i])
-                pointer += 1
-        if all_front_pil_images:    
-            generate_pdf_from_images(all_images, "ticket_sheet.pdf")
-            print("\nPDF generation complete.")
-        else:
-            print("No ticket images were generated, so no PDF will be created.")
+
+    run_start_time = time.perf_counter()
+    if TRACE_OUTPUT_PATH:
+        start_tracing(TRACE_OUTPUT_PATH)
+    output_pdf_filename = "ticket_sheet.pdf"
+    default_style = {"title": EVENT_TITLE, "stub_color": STUB_BACKGROUND_COLOR_USER, "background": image_file_path}
+    if gang_events_path:
+        try:
+            variants = load_gang_events(gang_events_path, default_style)
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not load events '{gang_events_path}': {e}. Exiting.")
+            exit()
+        print(f"Ganging {len(variants)} events; their own numbers replace the start and end numbers entered above.")
+        write_gang_cut_list(variants, num_leading_zeros, os.path.splitext(output_pdf_filename)[0] + "_cut_list.csv")
     else:
-        print("Skipping PDF generation as FPDF2 is not installed or failed to import.")
+        variants = build_ticket_variants(start_number, end_number, default_style, range_styles)
+    # After the variants: a gang's own numbers replace the range entered at the prompt
+    if PDF_SHEET_LAYOUT == "optimized":
+        report_sheet_layout(active_sheet_layout(), grid_layout, sum(variant["last"] - variant["first"] + 1 for variant in variants))
+    if len(variants) > 1:
+        report_variant_boundaries(variants, num_leading_zeros, os.path.splitext(output_pdf_filename)[0] + "_variants.csv")
+
+    if run_mode == "proof":
+        render_proof_contact_sheet(variants, num_leading_zeros, os.path.splitext(output_pdf_filename)[0] + "_proof.pdf")
+        stop_tracing()
+        print(f"\nProof done in {time.perf_counter() - run_start_time:.1f}s. Run again without 'proof' to generate the tickets.")
+        exit()
+
+    if thermal_printer is not None:
+        write_thermal_roll(variants, num_leading_zeros, thermal_printer, os.path.splitext(output_pdf_filename)[0] + "_thermal.bin",
+                           variable_data_path)
+        stop_tracing()
+        print(f"\nThermal job done in {time.perf_counter() - run_start_time:.1f}s.")
+        exit()
+
+    if reprint_ranges is not None:
+        # Same profile and layout as the original run, so every ticket keeps its slot
+        reprint_pdf_filename = os.path.splitext(output_pdf_filename)[0] + "_reprint.pdf"
+        try:
+            write_reprint(variants, num_leading_zeros, reprint_ranges, reprint_pdf_filename,
+                          compression_preset, variable_data_path)
+        except ValueError as e:
+            print(f"Error: {e} Exiting.")
+        stop_tracing()
+        exit()
+
+    try:
+        run_ticket_job(variants, num_leading_zeros, profile_name, compression_preset, variable_data_path, export_settings,
+                       output_pdf_filename, output_sides)
+    except ValueError as e:
+        print(f"Error: {e} Exiting.")
+        stop_tracing()
+        exit()
+    stop_tracing()
 
-    print("\nDone!")
\ No newline at end of file
+    print("\nDone!")
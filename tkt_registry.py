@@ -0,0 +1,214 @@
+import os
+import random
+import struct
+import argparse
+
+try:
+    import numpy as np
+except ImportError:
+    print("NumPy library not found. Please install it: pip install numpy")
+    print("The ticket registry is not available.")
+    np = None
+
+# --- Ticket States ---
+# One byte per ticket, indexed by (ticket number - start number).
+STATE_UNISSUED = 0
+STATE_ISSUED = 1
+STATE_SOLD = 2
+STATE_VOID = 3
+STATE_RETURNED = 4
+STATE_NAMES = {
+    STATE_UNISSUED: "unissued",
+    STATE_ISSUED: "issued",
+    STATE_SOLD: "sold",
+    STATE_VOID: "void",
+    STATE_RETURNED: "returned",
+}
+STATE_BY_NAME = {name: state for state, name in STATE_NAMES.items()}
+
+# --- On-disk Format ---
+# Fixed header followed directly by the raw uint8 state array, so the file can be
+# memory-mapped as-is and "loading" a 1M-ticket registry costs one mmap call.
+REGISTRY_MAGIC = b"TKTREG1\0"
+REGISTRY_HEADER_FORMAT = "<8sqqq" # magic, start_number, end_number, num_leading_zeros
+REGISTRY_HEADER_SIZE = struct.calcsize(REGISTRY_HEADER_FORMAT)
+
+# Tickets per block when counting sold tickets for draws. Only one block of
+# candidate indices is ever materialized at a time.
+DRAW_BLOCK_SIZE = 65536
+
+
+class TicketRegistry:
+    """Per-ticket issued/sold/void/returned state for a generator number range.
+
+    Status checks and updates are O(1) array lookups, ranges are updated with a single
+    slice assignment, and winners are drawn uniformly from the sold set using per-block
+    sold counts instead of building a list of every sold number.
+    """
+
+    def __init__(self, start_number, end_number, num_leading_zeros, states):
+        self.start_number = start_number
+        self.end_number = end_number
+        self.num_leading_zeros = num_leading_zeros
+        self.states = states
+
+    @classmethod
+    def create(cls, path, start_number, end_number, num_leading_zeros, initial_state=STATE_ISSUED):
+        if start_number > end_number:
+            raise ValueError("Start number cannot be greater than end number.")
+        total_tickets = end_number - start_number + 1
+        with open(path, "wb") as f:
+            f.write(struct.pack(REGISTRY_HEADER_FORMAT, REGISTRY_MAGIC, start_number, end_number, num_leading_zeros))
+            f.truncate(REGISTRY_HEADER_SIZE + total_tickets)
+        registry = cls.open(path)
+        if initial_state != STATE_UNISSUED:
+            registry.states[:] = initial_state
+        return registry
+
+    @classmethod
+    def open(cls, path, read_only=False):
+        with open(path, "rb") as f:
+            magic, start_number, end_number, num_leading_zeros = struct.unpack(
+                REGISTRY_HEADER_FORMAT, f.read(REGISTRY_HEADER_SIZE))
+        if magic != REGISTRY_MAGIC:
+            raise ValueError(f"'{path}' is not a ticket registry file.")
+        total_tickets = end_number - start_number + 1
+        states = np.memmap(path, dtype=np.uint8, mode="r" if read_only else "r+",
+                           offset=REGISTRY_HEADER_SIZE, shape=(total_tickets,))
+        return cls(start_number, end_number, num_leading_zeros, states)
+
+    def flush(self):
+        if isinstance(self.states, np.memmap) and self.states.mode != "r":
+            self.states.flush()
+
+    def format_number(self, number):
+        return str(number).zfill(self.num_leading_zeros)
+
+    def _index(self, number):
+        number = int(number) # Accepts zero-padded strings like "00042"
+        if not (self.start_number <= number <= self.end_number):
+            raise ValueError(f"Ticket number {number} is outside the registry range {self.start_number}-{self.end_number}.")
+        return number - self.start_number
+
+    def status(self, number):
+        return int(self.states[self._index(number)])
+
+    def set_status(self, number, state):
+        self.states[self._index(number)] = state
+
+    def set_range_status(self, first_number, last_number, state):
+        first_index = self._index(first_number)
+        last_index = self._index(last_number)
+        if first_index > last_index:
+            raise ValueError(f"Invalid range {first_number}-{last_number}.")
+        self.states[first_index:last_index + 1] = state
+        return last_index - first_index + 1
+
+    def import_ranges(self, lines, state):
+        """Applies `state` to every range in `lines` ("10-250", "00017", blank lines and
+        '#' comments are ignored). Returns the number of tickets updated."""
+        updated = 0
+        for line in lines:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            if "-" in line:
+                first, last = line.split("-", 1)
+            else:
+                first = last = line
+            updated += self.set_range_status(first.strip(), last.strip(), state)
+        return updated
+
+    def counts(self):
+        per_state = np.bincount(self.states, minlength=len(STATE_NAMES))
+        return {STATE_NAMES[state]: int(per_state[state]) for state in STATE_NAMES}
+
+    def _sold_counts_per_block(self):
+        # Counting block by block keeps the temporary boolean array at DRAW_BLOCK_SIZE
+        return np.array([
+            np.count_nonzero(self.states[block_start:block_start + DRAW_BLOCK_SIZE] == STATE_SOLD)
+            for block_start in range(0, len(self.states), DRAW_BLOCK_SIZE)
+        ], dtype=np.int64)
+
+    def draw_winners(self, count, rng=None):
+        """Draws `count` distinct ticket numbers uniformly at random from the sold set."""
+        rng = rng or random.SystemRandom()
+        block_counts = self._sold_counts_per_block()
+        cumulative_counts = np.cumsum(block_counts)
+        total_sold = int(cumulative_counts[-1]) if len(cumulative_counts) else 0
+        if count > total_sold:
+            raise ValueError(f"Cannot draw {count} winners from {total_sold} sold tickets.")
+
+        # Draw distinct ranks within the sold set, then resolve each rank to a ticket
+        winning_ranks = rng.sample(range(total_sold), count)
+        winners = []
+        for rank in winning_ranks:
+            block_index = int(np.searchsorted(cumulative_counts, rank, side="right"))
+            rank_in_block = rank - (int(cumulative_counts[block_index - 1]) if block_index > 0 else 0)
+            block_start = block_index * DRAW_BLOCK_SIZE
+            sold_in_block = np.flatnonzero(self.states[block_start:block_start + DRAW_BLOCK_SIZE] == STATE_SOLD)
+            winners.append(self.format_number(self.start_number + block_start + int(sold_in_block[rank_in_block])))
+        return winners
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    if np is None:
+        exit()
+
+    parser = argparse.ArgumentParser(description="Track issued/sold/void/returned tickets and draw winners.")
+    parser.add_argument("registry", help="Path to the registry file (e.g. ticket_registry.bin)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    create_parser = subparsers.add_parser("create", help="Create a registry for a generator number range")
+    create_parser.add_argument("start_number", type=int)
+    create_parser.add_argument("end_number", type=int)
+    create_parser.add_argument("num_leading_zeros", type=int)
+
+    mark_parser = subparsers.add_parser("mark", help="Set the state of ticket numbers or ranges (e.g. 10-250 17)")
+    mark_parser.add_argument("state", choices=sorted(STATE_BY_NAME))
+    mark_parser.add_argument("ranges", nargs="*")
+    mark_parser.add_argument("--from-file", help="Text file with one number or range per line")
+
+    status_parser = subparsers.add_parser("status", help="Show the state of ticket numbers")
+    status_parser.add_argument("numbers", nargs="+")
+
+    subparsers.add_parser("summary", help="Show ticket counts per state")
+
+    draw_parser = subparsers.add_parser("draw", help="Draw winners from the sold tickets")
+    draw_parser.add_argument("count", type=int)
+
+    args = parser.parse_args()
+
+    if args.command == "create":
+        registry = TicketRegistry.create(args.registry, args.start_number, args.end_number, args.num_leading_zeros)
+        registry.flush()
+        print(f"Created registry '{args.registry}' for tickets "
+              f"{registry.format_number(args.start_number)}-{registry.format_number(args.end_number)}.")
+        exit()
+
+    if not os.path.exists(args.registry):
+        print(f"Error: Registry file '{args.registry}' not found. Exiting.")
+        exit()
+
+    if args.command == "mark":
+        registry = TicketRegistry.open(args.registry)
+        state = STATE_BY_NAME[args.state]
+        updated = registry.import_ranges(args.ranges, state)
+        if args.from_file:
+            with open(args.from_file, encoding="utf-8") as f:
+                updated += registry.import_ranges(f, state)
+        registry.flush()
+        print(f"Marked {updated} tickets as {args.state}.")
+    elif args.command == "status":
+        registry = TicketRegistry.open(args.registry, read_only=True)
+        for number in args.numbers:
+            print(f"{registry.format_number(int(number))}: {STATE_NAMES[registry.status(number)]}")
+    elif args.command == "summary":
+        registry = TicketRegistry.open(args.registry, read_only=True)
+        for state_name, count in registry.counts().items():
+            print(f"{state_name:>9}: {count}")
+    elif args.command == "draw":
+        registry = TicketRegistry.open(args.registry, read_only=True)
+        for place, number in enumerate(registry.draw_winners(args.count), start=1):
+            print(f"Winner {place}: {number}")
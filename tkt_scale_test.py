@@ -0,0 +1,200 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from PIL import Image, ImageDraw
+
+try:
+    import psutil
+except ImportError: # /proc is read directly instead (Linux only)
+    psutil = None
+
+# Runs the full generation flow (tkt_gen3.run_ticket_job, no prompts) at growing ticket
+# counts with rotating synthetic backgrounds, samples the run's RSS and open file
+# descriptors, and fails when a ceiling is crossed or time per ticket grows with N.
+#   python tkt_scale_test.py                     # 1k, 10k, 100k and 1M tickets
+#   python tkt_scale_test.py --sizes 1000 10000  # quick check
+
+SCALE_TEST_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+SCALE_TEST_PROFILE = "preview"
+SCALE_TEST_COMPRESSION = "fast"
+SYNTHETIC_BACKGROUND_COUNT = 8 # Rotated round-robin, so the background cache and prefetcher are exercised
+SYNTHETIC_BACKGROUND_SIZE = (1600, 1000)
+SAMPLE_INTERVAL_SECONDS = 0.25
+
+# --- Ceilings ---
+MAX_PEAK_RSS_MB = 600
+MAX_OPEN_FDS = 64
+MAX_SECONDS_PER_TICKET = 0.05
+# Per-ticket time of a run's last tenth against its second tenth (the first includes warm-up),
+# and of each size against the smallest one. Anything above this means the loop is superlinear.
+MAX_PER_TICKET_GROWTH = 1.5
+GROWTH_WINDOWS = 10
+
+PROGRESS_PATTERN = re.compile(r"Creating ticket No\. \S+ \((\d+) of (\d+)\)")
+
+def make_synthetic_backgrounds(directory, count=SYNTHETIC_BACKGROUND_COUNT):
+    """Writes `count` distinct photo-like JPEGs (gradient plus shapes) to `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    width, height = SYNTHETIC_BACKGROUND_SIZE
+    for i in range(count):
+        img = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+        draw = ImageDraw.Draw(img)
+        for x in range(0, width, width // 20):
+            draw.ellipse([(x, height // 3), (x + width // 25, height // 3 + width // 25)], fill=((i * 37) % 255, 90, (x * 7) % 255))
+        img.save(os.path.join(directory, f"background_{i:02d}.jpg"), format="JPEG", quality=85)
+
+def child_code(repo_dir, background_dir, output_pdf_filename, ticket_count):
+    return f"""
+import sys, os, json
+sys.path.insert(0, {repo_dir!r})
+import tkt_gen3
+tkt_gen3.FONT_PATH = os.path.join({repo_dir!r}, tkt_gen3.FONT_PATH)
+tkt_gen3.apply_output_profile({SCALE_TEST_PROFILE!r})
+grid_layout = tkt_gen3.grid_sheet_layout()
+tkt_gen3.use_sheet_layout(tkt_gen3.plan_sheet_layout() if tkt_gen3.PDF_SHEET_LAYOUT == "optimized" else grid_layout)
+default_style = {{"title": "SCALE TEST", "stub_color": tkt_gen3.DEFAULT_STUB_BG_COLOR, "background": {background_dir!r}}}
+variants = tkt_gen3.build_ticket_variants(1, {ticket_count}, default_style)
+metrics = tkt_gen3.run_ticket_job(variants, len(str({ticket_count})), {SCALE_TEST_PROFILE!r}, {SCALE_TEST_COMPRESSION!r},
+                                  output_pdf_filename={output_pdf_filename!r})
+try:
+    with open("/proc/self/status") as f:
+        peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+except OSError:
+    peak_kb = 0 # The parent's samples still give the peak
+print("SCALE_TEST_RESULT " + json.dumps({{"metrics": metrics, "peak_rss_mb": peak_kb / 1024}}), flush=True)
+"""
+
+def sample_process(pid):
+    """(RSS in MB, open file descriptors) of a running process, or None once it has exited."""
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            return process.memory_info().rss / (1024 * 1024), process.num_fds()
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        return rss_kb / 1024, len(os.listdir(f"/proc/{pid}/fd"))
+    except (OSError, StopIteration): # Exited between samples
+        return None
+
+def per_ticket_seconds(progress, first_ticket, last_ticket):
+    """Seconds per ticket between the progress points nearest to two ticket counts."""
+    (start_count, start_time), (end_count, end_time) = (
+        min(progress, key=lambda point: abs(point[0] - ticket)) for ticket in (first_ticket, last_ticket))
+    return (end_time - start_time) / max(1, end_count - start_count)
+
+def run_case(repo_dir, background_dir, work_dir, ticket_count):
+    """Runs one size in a fresh process while sampling it. Returns a result dict."""
+    output_pdf_filename = os.path.join(work_dir, f"scale_{ticket_count}.pdf")
+    process = subprocess.Popen([sys.executable, "-c", child_code(repo_dir, background_dir, output_pdf_filename, ticket_count)],
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+    progress = [] # (tickets done, seconds since start), from the render loop's progress lines
+    child_result = {}
+    output_tail = []
+    start_time = time.perf_counter()
+
+    def read_output():
+        for line in process.stdout:
+            match = PROGRESS_PATTERN.search(line)
+            if match:
+                progress.append((int(match.group(1)), time.perf_counter() - start_time))
+            elif line.startswith("SCALE_TEST_RESULT "):
+                child_result.update(json.loads(line.split(" ", 1)[1]))
+            output_tail[:] = (output_tail + [line.rstrip()])[-20:]
+    reader = threading.Thread(target=read_output, daemon=True)
+    reader.start()
+
+    peak_rss_mb, peak_fds = 0.0, 0
+    while process.poll() is None:
+        sample = sample_process(process.pid)
+        if sample is not None:
+            peak_rss_mb, peak_fds = max(peak_rss_mb, sample[0]), max(peak_fds, sample[1])
+        time.sleep(SAMPLE_INTERVAL_SECONDS)
+    reader.join()
+    elapsed = time.perf_counter() - start_time
+
+    result = {"tickets": ticket_count, "seconds": elapsed, "exit_code": process.returncode,
+              "peak_rss_mb": max(peak_rss_mb, child_result.get("peak_rss_mb", 0)), "peak_fds": peak_fds}
+    if process.returncode != 0 or not child_result or len(progress) < 2:
+        result["error"] = "\n".join(output_tail)
+        return result
+    window = ticket_count / GROWTH_WINDOWS
+    result["seconds_per_ticket"] = per_ticket_seconds(progress, progress[0][0], ticket_count)
+    result["early_seconds_per_ticket"] = per_ticket_seconds(progress, window, 2 * window)
+    result["late_seconds_per_ticket"] = per_ticket_seconds(progress, ticket_count - window, ticket_count)
+    return result
+
+def check_ceilings(results):
+    """Returns a list of failure messages (empty if every run is within its ceilings)."""
+    failures = []
+    baseline = None
+    for result in results:
+        label = f"{result['tickets']:,} tickets"
+        if "error" in result:
+            failures.append(f"{label}: run failed (exit code {result['exit_code']}):\n{result['error']}")
+            continue
+        if result["peak_rss_mb"] > MAX_PEAK_RSS_MB:
+            failures.append(f"{label}: peak RSS {result['peak_rss_mb']:.0f} MB > {MAX_PEAK_RSS_MB} MB")
+        if result["peak_fds"] > MAX_OPEN_FDS:
+            failures.append(f"{label}: {result['peak_fds']} open file descriptors > {MAX_OPEN_FDS}")
+        if result["seconds_per_ticket"] > MAX_SECONDS_PER_TICKET:
+            failures.append(f"{label}: {result['seconds_per_ticket'] * 1000:.2f} ms per ticket > {MAX_SECONDS_PER_TICKET * 1000:.2f} ms")
+        within_run_growth = result["late_seconds_per_ticket"] / max(result["early_seconds_per_ticket"], 1e-9)
+        if within_run_growth > MAX_PER_TICKET_GROWTH:
+            failures.append(f"{label}: the last tenth of the run is {within_run_growth:.2f}x slower per ticket than the second")
+        if baseline is None:
+            baseline = result
+        elif result["seconds_per_ticket"] > MAX_PER_TICKET_GROWTH * baseline["seconds_per_ticket"]:
+            failures.append(f"{label}: {result['seconds_per_ticket'] / baseline['seconds_per_ticket']:.2f}x the per-ticket time "
+                            f"of {baseline['tickets']:,} tickets")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scale and soak test of the full ticket generation flow.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SCALE_TEST_SIZES), help="Ticket counts to run, smallest first")
+    parser.add_argument("--work-dir", help="Keep outputs here instead of a temporary directory (1M tickets need several GB)")
+    args = parser.parse_args()
+    if psutil is None and not os.path.isdir("/proc"):
+        print("psutil library not found. Please install it: pip install psutil")
+        print("Memory and file descriptor sampling needs psutil on this platform.")
+        exit()
+
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or tmp_dir
+        background_dir = os.path.join(tmp_dir, "backgrounds")
+        make_synthetic_backgrounds(background_dir)
+
+        print(f"{'tickets':>10} {'seconds':>9} {'ms/ticket':>10} {'early':>8} {'late':>8} {'peak RSS (MB)':>14} {'peak fds':>9}")
+        results = []
+        for ticket_count in sorted(args.sizes):
+            result = run_case(repo_dir, background_dir, work_dir, ticket_count)
+            results.append(result)
+            if "error" in result:
+                print(f"{ticket_count:>10,} failed (exit code {result['exit_code']})")
+            else:
+                print(f"{ticket_count:>10,} {result['seconds']:>9.1f} {result['seconds_per_ticket'] * 1000:>10.3f} "
+                      f"{result['early_seconds_per_ticket'] * 1000:>8.3f} {result['late_seconds_per_ticket'] * 1000:>8.3f} "
+                      f"{result['peak_rss_mb']:>14.0f} {result['peak_fds']:>9}")
+            if not args.work_dir: # Outputs of big runs are large; only the numbers are kept
+                for name in os.listdir(work_dir):
+                    if name.startswith(f"scale_{ticket_count}"):
+                        path = os.path.join(work_dir, name)
+                        if os.path.isfile(path):
+                            os.remove(path)
+
+    failures = check_ceilings(results)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    print("PASS: every run is within its memory, file descriptor and per-ticket time ceilings.")
@@ -0,0 +1,261 @@
+import os
+import sys
+import csv
+import json
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+
+import tkt_gen3
+
+# Splits one big run across machines. Every node gets the same job spec and its shard
+# index; tkt_gen3.plan_shards cuts the run into whole sheets, so each shard knows its PDF
+# object numbers without the others, and the merge only copies the chunks and writes the
+# page tree and xref. The merged files are byte-identical to a single-node run.
+#   python tkt_shard.py plan job.json               # the shards and their ticket ranges
+#   python tkt_shard.py render job.json 3           # on node 3: PDF chunks + manifest of shard 3
+#   python tkt_shard.py merge job.json              # once every shard's outputs are collected
+#   python tkt_shard.py test job.json --processes 4 # local processes as nodes, checked against a single-node run
+#
+# Job spec (JSON); only start_number and end_number are required:
+#   {"start_number": 1, "end_number": 200000, "num_leading_zeros": 6, "event_title": "SPRING LOTTERY",
+#    "stub_color": "200,30,30", "background": "sponsors/", "profile": "print300", "compression": "default",
+#    "variable_data": null, "range_map": null, "sides": ["duplex"], "output": "ticket_sheet.pdf", "shards": 8}
+# "range_map" is a range->style map or an event list to gang, as at the tkt_gen3.py prompt.
+
+JOB_SPEC_DEFAULTS = {
+    "num_leading_zeros": 0,
+    "event_title": tkt_gen3.EVENT_TITLE,
+    "stub_color": tkt_gen3.DEFAULT_STUB_BG_COLOR,
+    "background": None,
+    "profile": tkt_gen3.DEFAULT_OUTPUT_PROFILE,
+    "compression": tkt_gen3.DEFAULT_PDF_COMPRESSION_PRESET,
+    "variable_data": None,
+    "range_map": None,
+    "sides": list(tkt_gen3.PDF_OUTPUT_SIDES),
+    "output": "ticket_sheet.pdf",
+    "shards": 1,
+}
+
+def load_job_spec(path):
+    with open(path, encoding="utf-8") as f:
+        spec = dict(JOB_SPEC_DEFAULTS, **json.load(f))
+    for key in ("start_number", "end_number"):
+        if key not in spec:
+            raise ValueError(f"The job spec needs '{key}'.")
+    if spec["start_number"] > spec["end_number"]:
+        raise ValueError("Start number cannot be greater than end number.")
+    if spec["profile"] not in tkt_gen3.OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile '{spec['profile']}'.")
+    if spec["compression"] not in tkt_gen3.PDF_COMPRESSION_PRESETS:
+        raise ValueError(f"Unknown compression preset '{spec['compression']}'.")
+    if any(sides not in tkt_gen3.PDF_SIDE_CHOICES for sides in spec["sides"]):
+        raise ValueError(f"Unknown PDF sides in {spec['sides']}. Use any of {', '.join(tkt_gen3.PDF_SIDE_CHOICES)}.")
+    return spec
+
+def prepare_job(spec):
+    """Applies the spec's profile and sheet layout to tkt_gen3 the way its prompts do and
+    returns the run's variants. Every node and the merge call this, so they agree on the plan."""
+    if not os.path.exists(tkt_gen3.FONT_PATH): # Nodes may run from another directory
+        tkt_gen3.FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), tkt_gen3.FONT_PATH)
+    tkt_gen3.EVENT_TITLE = spec["event_title"]
+    tkt_gen3.apply_output_profile(spec["profile"])
+    if tkt_gen3.SECURITY_UNDERLAY and tkt_gen3.np is None:
+        tkt_gen3.SECURITY_UNDERLAY = False # As at the prompt; every node must agree, so install NumPy everywhere or nowhere
+    grid_layout = tkt_gen3.grid_sheet_layout()
+    tkt_gen3.use_sheet_layout(tkt_gen3.plan_sheet_layout() if tkt_gen3.PDF_SHEET_LAYOUT == "optimized" else grid_layout)
+
+    default_style = {"title": spec["event_title"], "stub_color": tkt_gen3.parse_rgb(spec["stub_color"]),
+                     "background": spec["background"] or None}
+    if spec["range_map"]:
+        with open(spec["range_map"], encoding="utf-8") as f:
+            if isinstance(json.load(f), list):
+                return tkt_gen3.load_gang_events(spec["range_map"], default_style)
+        range_styles = tkt_gen3.load_range_style_map(spec["range_map"])
+    else:
+        range_styles = []
+    return tkt_gen3.build_ticket_variants(spec["start_number"], spec["end_number"], default_style, range_styles)
+
+def job_shards(spec, variants):
+    total_tickets = sum(variant["last"] - variant["first"] + 1 for variant in variants)
+    return tkt_gen3.plan_shards(total_tickets, spec["shards"])
+
+def run_job(spec, variants, output_pdf_filename, shard=None):
+    return tkt_gen3.run_ticket_job(variants, spec["num_leading_zeros"], spec["profile"], spec["compression"],
+                                   spec["variable_data"], None, output_pdf_filename, tuple(spec["sides"]), shard)
+
+def merged_files(spec, output_pdf_filename):
+    """(merged filename, [the file of each shard]) for every PDF and CSV the merge writes."""
+    shard_outputs = [tkt_gen3.shard_output_filename(output_pdf_filename, shard_index) for shard_index in range(spec["shards"])]
+    preview_reduce = tkt_gen3.OUTPUT_PROFILES[spec["profile"]]["preview_reduce"]
+    files = []
+    for output_index, (pdf_filename, _, _) in enumerate(tkt_gen3.run_pdf_outputs(output_pdf_filename, spec["sides"], preview_reduce)):
+        files.append((pdf_filename, [tkt_gen3.run_pdf_outputs(shard_output, spec["sides"], preview_reduce)[output_index][0] + ".chunk"
+                                     for shard_output in shard_outputs]))
+    if tkt_gen3.MANIFEST_FORMAT:
+        files.append((tkt_gen3.manifest_filename_for(output_pdf_filename, tkt_gen3.MANIFEST_FORMAT),
+                      [tkt_gen3.manifest_filename_for(shard_output, tkt_gen3.MANIFEST_FORMAT) for shard_output in shard_outputs]))
+    if spec["variable_data"]:
+        files.append((os.path.splitext(output_pdf_filename)[0] + "_variable_data_issues.csv",
+                      [os.path.splitext(shard_output)[0] + "_variable_data_issues.csv" for shard_output in shard_outputs]))
+    return files
+
+def merge_manifests(output_filename, shard_filenames):
+    with tkt_gen3.TicketManifestWriter(output_filename, tkt_gen3.MANIFEST_FORMAT) as manifest_writer:
+        for shard_filename in shard_filenames:
+            if tkt_gen3.MANIFEST_FORMAT == "csv":
+                with open(shard_filename, newline="", encoding="utf-8") as f:
+                    rows = csv.reader(f)
+                    next(rows) # Header
+                    manifest_writer.add_rows(rows)
+            else:
+                conn = sqlite3.connect(shard_filename)
+                manifest_writer.add_rows(conn.execute("SELECT * FROM tickets ORDER BY rowid"))
+                conn.close()
+
+def merge_issue_reports(output_filename, shard_filenames):
+    """Concatenates the shards' variable-data issue CSVs (written only by shards that had issues)."""
+    shard_filenames = [shard_filename for shard_filename in shard_filenames if os.path.exists(shard_filename)]
+    if not shard_filenames:
+        return
+    with open(output_filename, "w", newline="", encoding="utf-8") as out:
+        for shard_position, shard_filename in enumerate(shard_filenames):
+            with open(shard_filename, newline="", encoding="utf-8") as f:
+                header = f.readline()
+                if shard_position == 0:
+                    out.write(header)
+                out.write(f.read())
+    print(f"Warning: Some variable-data fields did not fit or did not match their ticket. See {output_filename}")
+
+def merge_job(spec, variants, output_pdf_filename):
+    missing = [filename for merged_filename, shard_filenames in merged_files(spec, output_pdf_filename)
+               if not merged_filename.endswith("_variable_data_issues.csv")
+               for filename in shard_filenames if not os.path.exists(filename)]
+    if missing:
+        raise ValueError(f"Missing shard outputs: {', '.join(missing)}")
+    for merged_filename, shard_filenames in merged_files(spec, output_pdf_filename):
+        if merged_filename.endswith(".pdf"):
+            pdf = tkt_gen3.StreamingPdfFile(merged_filename)
+            for chunk_filename in shard_filenames:
+                pdf.append_chunk(chunk_filename)
+            pdf.close()
+            print(f"Saved PDF: {merged_filename} ({len(shard_filenames)} chunks, {len(pdf.page_ids)} pages)")
+            if tkt_gen3.PDF_LINEARIZE:
+                tkt_gen3.linearize_pdf(merged_filename)
+        elif merged_filename.endswith("_variable_data_issues.csv"):
+            merge_issue_reports(merged_filename, shard_filenames)
+        else:
+            merge_manifests(merged_filename, shard_filenames)
+    # Run-wide outputs, computed from the plan alone
+    output_base = os.path.splitext(output_pdf_filename)[0]
+    if "event" in variants[0]:
+        tkt_gen3.write_gang_cut_list(variants, spec["num_leading_zeros"], output_base + "_cut_list.csv")
+    if len(variants) > 1:
+        tkt_gen3.report_variant_boundaries(variants, spec["num_leading_zeros"], output_base + "_variants.csv")
+    if tkt_gen3.VERIFICATION_KEY:
+        tkt_gen3.variants_verification_codes(variants, spec["num_leading_zeros"], output_pdf_filename)
+
+def compare_outputs(spec, merged_pdf_filename, single_pdf_filename):
+    """Byte-compares every merged file with the same file of the single-node run. Returns a list of differences."""
+    differences = []
+    pairs = [(merged_filename, merged_filename.replace(os.path.splitext(merged_pdf_filename)[0], os.path.splitext(single_pdf_filename)[0], 1))
+             for merged_filename, _ in merged_files(spec, merged_pdf_filename)]
+    if tkt_gen3.VERIFICATION_KEY:
+        merged_dir = os.path.dirname(merged_pdf_filename) or "."
+        merged_prefix = os.path.basename(os.path.splitext(merged_pdf_filename)[0])
+        pairs += [(os.path.join(merged_dir, name), os.path.join(merged_dir, name).replace(
+                      os.path.splitext(merged_pdf_filename)[0], os.path.splitext(single_pdf_filename)[0], 1))
+                  for name in sorted(os.listdir(merged_dir)) if name.startswith(merged_prefix) and name.endswith("_codes.idx")]
+    for merged_filename, single_filename in pairs:
+        merged_exists, single_exists = os.path.exists(merged_filename), os.path.exists(single_filename)
+        if not (merged_exists or single_exists):
+            continue
+        if merged_exists != single_exists:
+            differences.append(f"{merged_filename if merged_exists else single_filename} has no counterpart")
+            continue
+        with open(merged_filename, "rb") as f:
+            merged_bytes = f.read()
+        with open(single_filename, "rb") as f:
+            single_bytes = f.read()
+        if merged_bytes != single_bytes:
+            first_difference = next((i for i, (a, b) in enumerate(zip(merged_bytes, single_bytes)) if a != b),
+                                    min(len(merged_bytes), len(single_bytes)))
+            differences.append(f"{merged_filename} differs from {single_filename} at byte {first_difference}")
+        else:
+            print(f"  identical: {os.path.basename(merged_filename)} ({len(merged_bytes):,} bytes)")
+    return differences
+
+def run_local_test(job_path, spec, processes):
+    """Renders every shard in its own process (at most `processes` at a time), merges them,
+    renders the same job on one node, and byte-compares the results."""
+    script = os.path.abspath(__file__)
+    with tempfile.TemporaryDirectory() as work_dir:
+        merged_pdf_filename = os.path.join(work_dir, "sharded.pdf")
+        single_pdf_filename = os.path.join(work_dir, "single.pdf")
+        shard_processes = [] # Every shard's process, so each return code is checked
+        for shard_index in range(spec["shards"]):
+            if shard_index >= processes:
+                shard_processes[shard_index - processes].wait() # At most `processes` running
+            shard_processes.append(subprocess.Popen([sys.executable, script, "render", job_path, str(shard_index),
+                                                     "--output", merged_pdf_filename], stdout=subprocess.DEVNULL))
+        failed = [process.args[4] for process in shard_processes if process.wait() != 0]
+        single = subprocess.run([sys.executable, script, "single", job_path, "--output", single_pdf_filename], stdout=subprocess.DEVNULL)
+        if failed or single.returncode != 0:
+            print(f"FAIL: {'shards ' + ', '.join(failed) if failed else 'the single-node run'} did not finish.")
+            return False
+        variants = prepare_job(spec)
+        merge_job(spec, variants, merged_pdf_filename)
+        print(f"\nComparing the merge of {spec['shards']} shards with a single-node run:")
+        differences = compare_outputs(spec, merged_pdf_filename, single_pdf_filename)
+    for difference in differences:
+        print(f"FAIL {difference}")
+    if not differences:
+        print("PASS: the merged outputs are byte-identical to the single-node run.")
+    return not differences
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render one ticket run as page-aligned shards on several machines and merge them.")
+    parser.add_argument("command", choices=("plan", "render", "merge", "single", "test"))
+    parser.add_argument("job", help="Job spec JSON (see the top of this file)")
+    parser.add_argument("shard_index", type=int, nargs="?", help="Shard to render (render only), 0-based")
+    parser.add_argument("--output", help="Override the spec's output PDF filename")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Shards rendered at once (test only)")
+    args = parser.parse_args()
+
+    try:
+        spec = load_job_spec(args.job)
+        if args.output:
+            spec["output"] = args.output
+        if args.command == "test":
+            sys.exit(0 if run_local_test(os.path.abspath(args.job), spec, max(1, args.processes)) else 1)
+        variants = prepare_job(spec)
+        shards = job_shards(spec, variants)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e} Exiting.")
+        sys.exit(1)
+
+    if args.command == "plan":
+        sheet_capacity = tkt_gen3.tickets_per_sheet()
+        for shard_index, (first_ticket, stop_ticket) in enumerate(shards):
+            sliced = tkt_gen3.slice_variants(variants, first_ticket, stop_ticket)
+            print(f"Shard {shard_index}: tickets {first_ticket}-{stop_ticket - 1} "
+                  f"(numbers {str(sliced[0]['first']).zfill(spec['num_leading_zeros'])}-{str(sliced[-1]['last']).zfill(spec['num_leading_zeros'])}), "
+                  f"sheets {first_ticket // sheet_capacity}-{(stop_ticket - 1) // sheet_capacity} -> "
+                  f"{tkt_gen3.shard_output_filename(spec['output'], shard_index)}")
+    elif args.command == "render":
+        if args.shard_index is None or not 0 <= args.shard_index < len(shards):
+            print(f"Error: Give a shard index from 0 to {len(shards) - 1}. Exiting.")
+            sys.exit(1)
+    try:
+        if args.command == "render":
+            run_job(spec, variants, tkt_gen3.shard_output_filename(spec["output"], args.shard_index), shards[args.shard_index])
+        elif args.command == "merge":
+            merge_job(spec, variants, spec["output"])
+        elif args.command == "single":
+            run_job(spec, variants, spec["output"])
+    except (OSError, ValueError) as e:
+        print(f"Error: {e} Exiting.")
+        sys.exit(1)
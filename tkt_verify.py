@@ -0,0 +1,219 @@
+import os
+import re
+import sys
+import csv
+import hmac
+import time
+import array
+import struct
+import hashlib
+import argparse
+
+# --- Verification Codes ---
+# A ticket's code is HMAC-SHA256(key, "<event id>:<number>") truncated to a few base32
+# characters. Door staff check the printed code against the index written with the run;
+# without the key a forger cannot produce a valid code for a number.
+CODE_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ234567" # RFC 4648 base32: no 0, 1 or 8 to misread as O, I or B
+MIN_CODE_LENGTH = 4
+MAX_CODE_LENGTH = 6 # 30 bits, so every code fits the index's uint32 slots
+KEY_ENVIRONMENT_VARIABLE = "TICKET_VERIFICATION_KEY"
+
+# --- On-disk Format ---
+# Header, one uint32 code per ticket indexed by (number - start_number), then an
+# HMAC-SHA256 of everything before it, so an edited index is rejected. The codes are
+# stored rather than recomputed so a scan costs one array lookup.
+INDEX_MAGIC = b"TKTVER1\0"
+INDEX_HEADER_FORMAT = "<8sqqqq64s8s" # magic, start_number, end_number, num_leading_zeros, code_length, event_id, key fingerprint
+INDEX_HEADER_SIZE = struct.calcsize(INDEX_HEADER_FORMAT)
+INDEX_MAC_SIZE = 32
+
+# A scan is a ticket number followed by its code, e.g. "00042 K7QX2M" or "00042-K7QX2M"
+SCAN_PATTERN = re.compile(r"^\s*(\d+)[\s,;:\-]+([A-Za-z2-7]+)\s*$")
+
+
+def _code_table():
+    codes = array.array("I")
+    if codes.itemsize != 4:
+        codes = array.array("L")
+    return codes
+
+def key_bytes(key):
+    return key.encode("utf-8") if isinstance(key, str) else key
+
+def key_fingerprint(key):
+    """Identifies the key an index was written with, without revealing it."""
+    return hmac.new(key_bytes(key), b"ticket verification key fingerprint", hashlib.sha256).digest()[:8]
+
+def verification_codes(key, event_id, first_number, last_number, code_length=MAX_CODE_LENGTH):
+    """Codes for every number in first_number..last_number as an array of ints.
+
+    The keyed HMAC state is built once and copied per ticket, which skips rehashing the
+    key pads for every number.
+    """
+    if not MIN_CODE_LENGTH <= code_length <= MAX_CODE_LENGTH:
+        raise ValueError(f"Code length must be {MIN_CODE_LENGTH}-{MAX_CODE_LENGTH} characters.")
+    keyed = hmac.new(key_bytes(key), f"{event_id}:".encode("utf-8"), hashlib.sha256)
+    shift = 32 - 5 * code_length
+    codes = _code_table()
+    for number in range(first_number, last_number + 1):
+        mac = keyed.copy()
+        mac.update(str(number).encode("ascii"))
+        codes.append(int.from_bytes(mac.digest()[:4], "big") >> shift)
+    return codes
+
+def verification_code(key, event_id, number, code_length=MAX_CODE_LENGTH):
+    number = int(number) # Accepts zero-padded strings like "00042"
+    return format_code(verification_codes(key, event_id, number, number, code_length)[0], code_length)
+
+def format_code(code, code_length):
+    return "".join(CODE_ALPHABET[(code >> (5 * (code_length - 1 - i))) & 31] for i in range(code_length))
+
+def parse_code(text):
+    """The integer value of a scanned code, or None if it has characters outside CODE_ALPHABET."""
+    code = 0
+    for char in text.upper():
+        value = CODE_ALPHABET.find(char)
+        if value < 0:
+            return None
+        code = (code << 5) | value
+    return code
+
+def write_verification_index(path, key, event_id, start_number, end_number, num_leading_zeros, codes, code_length):
+    event_id_bytes = event_id.encode("utf-8")
+    if len(event_id_bytes) > 64:
+        raise ValueError("The event id must be at most 64 bytes.")
+    if len(codes) != end_number - start_number + 1:
+        raise ValueError("There must be one code per ticket number.")
+    mac = hmac.new(key_bytes(key), digestmod=hashlib.sha256)
+    with open(path, "wb") as f:
+        for chunk in (struct.pack(INDEX_HEADER_FORMAT, INDEX_MAGIC, start_number, end_number, num_leading_zeros,
+                                  code_length, event_id_bytes, key_fingerprint(key)),
+                      codes.tobytes() if sys.byteorder == "little" else _little_endian(codes)):
+            f.write(chunk)
+            mac.update(chunk)
+        f.write(mac.digest())
+
+def _little_endian(codes):
+    swapped = array.array(codes.typecode, codes)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+
+class VerificationIndex:
+    """The codes of one run, loaded from the index written next to its PDF."""
+
+    def __init__(self, start_number, end_number, num_leading_zeros, code_length, event_id, codes):
+        self.start_number = start_number
+        self.end_number = end_number
+        self.num_leading_zeros = num_leading_zeros
+        self.code_length = code_length
+        self.event_id = event_id
+        self.codes = codes
+
+    @classmethod
+    def open(cls, path, key):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < INDEX_HEADER_SIZE + INDEX_MAC_SIZE or data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError(f"'{path}' is not a ticket verification index.")
+        magic, start_number, end_number, num_leading_zeros, code_length, event_id, fingerprint = struct.unpack(
+            INDEX_HEADER_FORMAT, data[:INDEX_HEADER_SIZE])
+        if not hmac.compare_digest(fingerprint, key_fingerprint(key)):
+            raise ValueError(f"'{path}' was written with a different key.")
+        expected_mac = hmac.new(key_bytes(key), data[:-INDEX_MAC_SIZE], hashlib.sha256).digest()
+        if not hmac.compare_digest(data[-INDEX_MAC_SIZE:], expected_mac):
+            raise ValueError(f"'{path}' has been modified since it was written.")
+        codes = _code_table()
+        codes.frombytes(data[INDEX_HEADER_SIZE:-INDEX_MAC_SIZE])
+        if sys.byteorder != "little":
+            codes.byteswap()
+        if len(codes) != end_number - start_number + 1:
+            raise ValueError(f"'{path}' is truncated.")
+        return cls(start_number, end_number, num_leading_zeros, code_length, event_id.rstrip(b"\0").decode("utf-8"), codes)
+
+    def format_number(self, number):
+        return str(number).zfill(self.num_leading_zeros)
+
+    def verify_scans(self, lines):
+        """Checks scanned "<number> <code>" lines. Yields (line, number or None, result),
+        where result is "valid", "invalid_code", "unknown_number", "duplicate" (a valid
+        ticket scanned before) or "unreadable"."""
+        codes, start_number, end_number, code_length = self.codes, self.start_number, self.end_number, self.code_length
+        admitted = set()
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            match = SCAN_PATTERN.match(line)
+            if match is None:
+                yield line, None, "unreadable"
+                continue
+            number = int(match.group(1))
+            if not start_number <= number <= end_number:
+                yield line, number, "unknown_number"
+                continue
+            code_text = match.group(2)
+            if len(code_text) != code_length or parse_code(code_text) != codes[number - start_number]:
+                yield line, number, "invalid_code"
+            elif number in admitted:
+                yield line, number, "duplicate"
+            else:
+                admitted.add(number)
+                yield line, number, "valid"
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check scanned ticket verification codes offline against a run's index.")
+    parser.add_argument("index", help="Path to the verification index (e.g. ticket_sheet_codes.idx)")
+    parser.add_argument("scans", nargs="*", help="Scanned '<number> <code>' pairs, e.g. '00042 K7QX2M'")
+    parser.add_argument("--from-file", help="Text file with one scanned '<number> <code>' per line")
+    parser.add_argument("--key-file", help=f"File holding the key (default: the {KEY_ENVIRONMENT_VARIABLE} environment variable)")
+    parser.add_argument("--rejects", help="Write every rejected scan with its reason to this CSV")
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+    args = parser.parse_args()
+
+    if args.key_file:
+        with open(args.key_file, "rb") as f:
+            key = f.read().strip()
+    else:
+        key = os.environ.get(KEY_ENVIRONMENT_VARIABLE, "")
+    if not key:
+        print(f"Error: No key. Use --key-file or set {KEY_ENVIRONMENT_VARIABLE}. Exiting.")
+        exit()
+    if not os.path.exists(args.index):
+        print(f"Error: Index file '{args.index}' not found. Exiting.")
+        exit()
+    try:
+        index = VerificationIndex.open(args.index, key)
+    except ValueError as e:
+        print(f"Error: {e} Exiting.")
+        exit()
+
+    scan_lines = list(args.scans)
+    if args.from_file:
+        with open(args.from_file, encoding="utf-8") as f:
+            scan_lines.extend(f)
+
+    start_time = time.perf_counter()
+    counts = {}
+    rejects = []
+    for line, number, result in index.verify_scans(scan_lines):
+        counts[result] = counts.get(result, 0) + 1
+        if result != "valid":
+            rejects.append((line, result))
+        if not args.quiet:
+            print(f"{index.format_number(number) if number is not None else line}: {result}")
+    seconds = time.perf_counter() - start_time
+
+    if args.rejects:
+        with open(args.rejects, "w", newline="", encoding="utf-8") as f:
+            rejects_writer = csv.writer(f)
+            rejects_writer.writerow(("scan", "result"))
+            rejects_writer.writerows(rejects)
+    scanned = sum(counts.values())
+    print(f"Event '{index.event_id}', tickets {index.format_number(index.start_number)}-{index.format_number(index.end_number)}: "
+          f"{scanned} scans checked in {seconds:.3f}s ({scanned / max(seconds, 1e-9):,.0f} per second)")
+    for result in ("valid", "invalid_code", "duplicate", "unknown_number", "unreadable"):
+        if counts.get(result):
+            print(f"{result:>14}: {counts[result]}")